@@ -8,5 +8,9 @@ global_config = {
     'make_movie__y_inc': 30,
     'make_movie__text_color': 'green',
     'make_movie__font_size': 36,
-    'create_mosaic_video__max_mosaic_vids': 16
+    'create_mosaic_video__max_mosaic_vids': 16,
+    #'auto' (numba if installed, otherwise numpy), 'numba', 'numpy' or 'pandas' (the reference implementation)
+    'feature_engineering__geometry_backend': 'auto',
+    #Also run the reference implementation, and raise an error if the outputs differ
+    'feature_engineering__check_geometry_backend': False
 }
@@ -2,14 +2,39 @@ import pandas as pd
 import numpy as np
 
 from behaveml.io import XY_IDS
+from behaveml.config import global_config
+from behaveml.dl import geometry
+from behaveml.utils import shift_within_segments, diff_within_segments, window_stats_within_segments
 
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 #Shift decorator
 #If a feature creation function has this applied then the features are
 #automatically shifted/differences/had distribution stats computed and
 #concatenated with the rest of the table
 
+def _cache_params(args, kwargs):
+    """Hashable summary of the arguments of a feature function, for looking up its results in a FeatureCache"""
+    offsets = kwargs.get('offsets', None)
+    kwargs = {k:v for k,v in kwargs.items() if k not in ['n_shifts', 'mode', 'offsets']}
+    return (repr(args), repr(sorted(kwargs.items())), None if offsets is None else tuple(offsets))
+
+#Window sizes for the distribution stats of 'distr' mode
+DISTR_WINDOW_SIZES = [1, 5, 10]
+DISTR_STATS = ['min', 'max', 'std', 'mean']
+
+def _shift_periods(n_shifts, window_size):
+    return [-(i+1)*window_size for i in range(n_shifts)] + [(i+1)*window_size for i in range(n_shifts)]
+
+def _augmented_columns(cols, n_shifts, mode, window_size = 5):
+    """Names of the columns augment_features adds for the feature columns cols, in the order it adds them"""
+    if n_shifts == 0:
+        return []
+    if mode == 'distr':
+        return [f'{cn}_{stat}_pm_{ws}' for ws in DISTR_WINDOW_SIZES for stat in DISTR_STATS for cn in cols]
+    return [f'{k}_shifted_{p}' for p in _shift_periods(n_shifts, window_size) for k in cols]
+
 #The decorator maker, so we can provide arguments
 def augment_features(window_size = 5, n_shifts = 3, mode = 'shift'):
     #The decorator
@@ -24,32 +49,55 @@ def augment_features(window_size = 5, n_shifts = 3, mode = 'shift'):
             if 'n_shifts' in kwargs:
                 n_shifts = kwargs['n_shifts']
 
+            #Segment (video) offsets, so shifts don't move values between videos
+            offsets = kwargs.get('offsets', None)
+            #Intermediates shared with other feature sets on the same data
+            cache = kwargs.pop('cache', None)
+            #Names of the shifted/distribution columns wanted, if not all of them
+            augment_columns = kwargs.pop('augment_columns', None)
+
             old_cols = set(args[0].columns)
-            df = feature_function(*args, **kwargs)
+            if cache is None:
+                df = feature_function(*args, **kwargs)
+            else:
+                params = _cache_params(args[1:], kwargs)
+                cached = cache.get(feature_function.__name__, args[0], params)
+                if cached is None:
+                    df = feature_function(*args, **kwargs)
+                    cache.put(feature_function.__name__, args[0], params, df[[c for c in df.columns if c not in old_cols]])
+                else:
+                    df = pd.concat([args[0], cached], axis = 1)
             if n_shifts == 0: return df
             new_cols = set(df.columns)
             added_cols = list(new_cols.difference(old_cols))
+            if augment_columns is not None:
+                #Only the columns with a wanted shift or window statistic
+                added_cols = [k for k in added_cols 
+                              if augment_columns.intersection(_augmented_columns([k], n_shifts, mode, window_size))]
+                if not added_cols: return df
+            added_data = df[added_cols].to_numpy()
             #Shift the features just made
             shifted_data = []
             if mode == 'distr':
-                window_sizes = [1, 5, 10]
+                window_sizes = DISTR_WINDOW_SIZES
+                if augment_columns is not None:
+                    window_sizes = [ws for ws in window_sizes if any(f'{cn}_{stat}_pm_{ws}' in augment_columns 
+                                                                     for cn in added_cols for stat in DISTR_STATS)]
+                stats = window_stats_within_segments(added_data, window_sizes, offsets)
                 for ws in window_sizes:
-                    data = np.dstack([np.array(df[added_cols].shift(p)) for p in range(-ws, ws+1)])
-                    min_data = pd.DataFrame(np.min(data, axis = 2), columns = [f'{cn}_min_pm_{ws}' for cn in added_cols])
-                    max_data = pd.DataFrame(np.max(data, axis = 2), columns = [f'{cn}_max_pm_{ws}' for cn in added_cols])
-                    std_data = pd.DataFrame(np.std(data, axis = 2), columns = [f'{cn}_std_pm_{ws}' for cn in added_cols])
-                    mean_data = pd.DataFrame(np.mean(data, axis = 2), columns = [f'{cn}_mean_pm_{ws}' for cn in added_cols])
-                    shifted_data += [min_data, max_data, std_data, mean_data]
+                    shifted_data += [pd.DataFrame(d, index = df.index, columns = [f'{cn}_{stat}_pm_{ws}' for cn in added_cols]) 
+                                     for d, stat in zip(stats[ws], DISTR_STATS)]
             else:
-                periods = [-(i+1)*window_size for i in range(n_shifts)] + \
-                        [(i+1)*window_size for i in range(n_shifts)]
+                periods = _shift_periods(n_shifts, window_size)
+                if augment_columns is not None:
+                    periods = [p for p in periods if any(f'{k}_shifted_{p}' in augment_columns for k in added_cols)]
                 #Rename all column names
                 for p in periods:
                     if mode == 'shift':
-                        s_df = df[added_cols].shift(p)
+                        s_data = shift_within_segments(added_data, p, offsets)
                     elif mode == 'diff':
-                        s_df = df[added_cols].diff(p)
-                    s_df = s_df.rename(columns = {k:f'{k}_shifted_{p}' for k in added_cols})
+                        s_data = diff_within_segments(added_data, p, offsets)
+                    s_df = pd.DataFrame(s_data, index = df.index, columns = [f'{k}_shifted_{p}' for k in added_cols])
                     shifted_data.append(s_df)
             #Combine with current table
             #TODO
@@ -63,7 +111,31 @@ def augment_features(window_size = 5, n_shifts = 3, mode = 'shift'):
 
 from pandas.api.types import is_numeric_dtype
 
-def boiler_plate(features_df):
+def fill_missing_with_means(features_df, means = None):
+    """Fill the missing values of the numeric columns with the column means, all columns at once
+
+    Args:
+        features_df: table of features
+        means: default None. Series with the mean of each column, if they are computed over more rows than 
+            features_df has. If None, the means of features_df's columns
+
+    Returns:
+        The filled table
+    """
+    numeric_cols = [col for col, dtype in features_df.dtypes.items() if is_numeric_dtype(dtype)]
+    missing = features_df[numeric_cols].isnull().to_numpy()
+    if missing.any():
+        has_missing = missing.any(axis = 0)
+        missing_cols = [col for col, m in zip(numeric_cols, has_missing) if m]
+        values = features_df[missing_cols].to_numpy(copy = True)
+        rows, cols = np.nonzero(missing[:,has_missing])
+        col_means = features_df[missing_cols].mean() if means is None else means[missing_cols]
+        values[rows, cols] = col_means.to_numpy()[cols]
+        filled = pd.DataFrame(values, index = features_df.index, columns = missing_cols)
+        features_df = pd.concat([features_df.drop(columns = missing_cols), filled], axis = 1)[list(features_df.columns)]
+    return features_df
+
+def boiler_plate(features_df, impute = True):
     reversemap = None
     if 'seq_id' in features_df:
         hashmap = {k: i for (i,k) in enumerate(list(set(features_df['seq_id'])))}
@@ -75,14 +147,13 @@ def boiler_plate(features_df):
     for col in to_drop:
         if col in features_df.columns:
             features_df = features_df.drop(columns = col)
-    #Impute nas
-    for col in features_df:
-        if is_numeric_dtype(features_df[col]):
-            features_df[col] = features_df[col].fillna(features_df[col].mean())
+    #Impute nas with the column means
+    if impute:
+        features_df = fill_missing_with_means(features_df)
     return features_df, reversemap
 
 @augment_features()
-def _compute_centroid(df, name, animal_setup, body_parts = None, n_shifts = 3, mode = 'shift'):
+def _compute_centroid(df, name, animal_setup, body_parts = None, n_shifts = 3, mode = 'shift', offsets = None):
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
     colnames = animal_setup['colnames']
@@ -98,12 +169,79 @@ def _compute_centroid(df, name, animal_setup, body_parts = None, n_shifts = 3, m
         df[f'centroid_{name}_{mouse_id}_y'] = np.mean(df[part_names_y], axis = 1)
     return df
 
-@augment_features()
-def _compute_abs_angle(df, name, animal_setup, bps, centroid = True, n_shifts = 3, mode = 'shift'):
+######################
+## Geometry kernels ##
+######################
+
+#The angle, IOU and relative motion features are computed by the kernels in behaveml.dl.geometry. The pandas 
+#implementations below are kept as the reference, and are used with the 'pandas' backend.
+
+GEOMETRY_BACKENDS = ['numba', 'numpy', 'pandas']
+
+def _geometry_backend():
+    backend = global_config['feature_engineering__geometry_backend']
+    if backend == 'auto':
+        return 'numba' if geometry.has_numba else 'numpy'
+    if backend not in GEOMETRY_BACKENDS:
+        raise ValueError(f"Unknown geometry backend '{backend}'. Options are 'auto' or one of {GEOMETRY_BACKENDS}")
+    return backend
+
+def _geometry_features(reference, kernel, df, *args, **kwargs):
+    """Compute features with the configured geometry backend
+
+    Args:
+        reference: pandas implementation. Returns df with the new columns added
+        kernel: kernel implementation. Takes a backend keyword argument and returns a dictionary of new columns
+        df: table to compute the features from
+        args, kwargs: other arguments to reference and kernel
+
+    Returns:
+        df with the new columns added
+    """
+    backend = _geometry_backend()
+    if backend == 'pandas':
+        return reference(df, *args, **kwargs)
+    features = kernel(df, *args, backend = backend, **kwargs)
+    if global_config['feature_engineering__check_geometry_backend']:
+        expected = reference(df.copy(), *args, **kwargs)
+        for col, values in features.items():
+            if not np.allclose(values, expected[col], rtol = 1e-6, atol = 1e-8, equal_nan = True):
+                raise RuntimeError(f"Geometry backend '{backend}' disagrees with the reference implementation for '{col}'")
+    #Shallow copy, so the new columns are added without copying the table
+    df = df.copy(deep = False)
+    for col, values in features.items():
+        df[col] = values
+    return df
+
+def _points(df, mouse_ids, bp, centroid = False):
+    """Array of shape (frames, animals, 2) with the position of a body part or centroid of each animal"""
+    if centroid:
+        cols = [[f'{bp}_{m}_{xy}' for xy in XY_IDS] for m in mouse_ids]
+    else:
+        cols = [[f'{m}_{xy}_{bp}' for xy in XY_IDS] for m in mouse_ids]
+    return df[sum(cols, [])].to_numpy(dtype = float).reshape(-1, len(mouse_ids), 2)
+
+def _track_tensor(df, animal_setup):
+    """Array of shape (frames, animals, bodyparts, 2) with the tracks"""
     mouse_ids = animal_setup['mouse_ids']
-    df = df.copy()
+    bodypart_ids = animal_setup['bodypart_ids']
+    colnames = ['_'.join([a[0], a[2], a[1]]) for a in product(mouse_ids, bodypart_ids, XY_IDS)]
+    return df[colnames].to_numpy(dtype = float).reshape(-1, len(mouse_ids), len(bodypart_ids), 2)
+
+@augment_features()
+def _compute_abs_angle(df, name, animal_setup, bps, centroid = True, n_shifts = 3, mode = 'shift', offsets = None):
     if len(bps) != 2:
         raise ValueError('Abs angle only works between 2 bodyparts, too many or too few specified')
+    return _geometry_features(_abs_angle_reference, _abs_angle_kernel, df, name, animal_setup, bps, centroid = centroid)
+
+def _abs_angle_kernel(df, name, animal_setup, bps, centroid = True, backend = 'numpy'):
+    mouse_ids = animal_setup['mouse_ids']
+    angles = geometry.abs_angle(*[_points(df, mouse_ids, bp, centroid) for bp in bps], backend = backend)
+    return {f'angle_{name}_{m_id}': angles[:,idx] for idx, m_id in enumerate(mouse_ids)}
+
+def _abs_angle_reference(df, name, animal_setup, bps, centroid = True):
+    mouse_ids = animal_setup['mouse_ids']
+    df = df.copy()
     for mouse_id in mouse_ids:
         if centroid:
             diff_x = df[f'{bps[0]}_{mouse_id}_x'] - df[f'{bps[1]}_{mouse_id}_x']
@@ -115,11 +253,19 @@ def _compute_abs_angle(df, name, animal_setup, bps, centroid = True, n_shifts =
     return df
 
 @augment_features()
-def _compute_rel_angle(df, name, animal_setup, bps, centroid = False, n_shifts = 3, mode = 'shift'):
-    mouse_ids = animal_setup['mouse_ids']    
-    df = df.copy()
+def _compute_rel_angle(df, name, animal_setup, bps, centroid = False, n_shifts = 3, mode = 'shift', offsets = None):
     if len(bps) != 3:
         raise ValueError('too many body parts to compute an absolute angle. Only works for 2')
+    return _geometry_features(_rel_angle_reference, _rel_angle_kernel, df, name, animal_setup, bps, centroid = centroid)
+
+def _rel_angle_kernel(df, name, animal_setup, bps, centroid = False, backend = 'numpy'):
+    mouse_ids = animal_setup['mouse_ids']
+    angles = geometry.rel_angle(*[_points(df, mouse_ids, bp, centroid) for bp in bps], backend = backend)
+    return {f'angle_{name}_{m_id}': angles[:,idx] for idx, m_id in enumerate(mouse_ids)}
+
+def _rel_angle_reference(df, name, animal_setup, bps, centroid = False):
+    mouse_ids = animal_setup['mouse_ids']    
+    df = df.copy()
     for mouse_id in mouse_ids:
         if centroid:
             diff_x1 = df[f'{bps[0]}_{mouse_id}_x'] - df[f'{bps[1]}_{mouse_id}_x']
@@ -138,18 +284,33 @@ def _compute_rel_angle(df, name, animal_setup, bps, centroid = False, n_shifts =
         df[f'angle_{name}_{mouse_id}'] = np.arccos(cosine_angle)
     return df
 
+def _ellipse_axes(data):
+    """Singular values of the centered body part positions, from the 2x2 scatter matrix in closed form
+
+    Args:
+        data: array of shape (..., n_bodyparts, 2) with the x and y positions of each body part
+
+    Returns:
+        Array of shape (..., 2) with the larger then the smaller singular value
+    """
+    centered = data - np.mean(data, axis = -2, keepdims = True)
+    x, y = centered[...,0], centered[...,1]
+    sxx = np.sum(x*x, axis = -1)
+    syy = np.sum(y*y, axis = -1)
+    sxy = np.sum(x*y, axis = -1)
+    #Eigenvalues of [[sxx, sxy], [sxy, syy]] are the squared singular values
+    half_trace = (sxx + syy)/2
+    disc = np.sqrt(((sxx - syy)/2)**2 + sxy**2)
+    evals = np.stack([half_trace + disc, np.maximum(half_trace - disc, 0)], axis = -1)
+    return np.sqrt(evals)
+
 @augment_features()
-def _compute_ellipsoid(df, animal_setup, n_shifts = 3, mode = 'shift'):
+def _compute_ellipsoid(df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None):
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
-    colnames = animal_setup['colnames']
 
     df = df.copy()
-    #Perform SVD
-    colnames = ['_'.join([a[0], a[2], a[1]]) for a in product(mouse_ids, bodypart_ids, XY_IDS)]
-    data = np.array(df[colnames]).reshape(-1, 2, 7, 2)
-    mean_data = np.transpose(np.tile(np.mean(data, axis = 2), (7,1,1,1)), (1,2,0,3))
-    svals = np.linalg.svd(data-mean_data, compute_uv = False)
+    svals = _ellipse_axes(_track_tensor(df, animal_setup))
     #Not technically correct, but not sure if the square of the singular values is exaclty
     #what we want either. This keeps the scale roughly the same as the distances involved
     evals = svals
@@ -163,12 +324,13 @@ def _compute_ellipsoid(df, animal_setup, n_shifts = 3, mode = 'shift'):
         df[f'ellipse_area_{m_id}'] = df[f'ellipse_minor_{m_id}']*df[f'ellipse_major_{m_id}']
 
     ## ratio of areas of ellipses of the mice
-    df[f'ellipse_area_ratio'] = df[f'ellipse_area_{mouse_ids[0]}']/df[f'ellipse_area_{mouse_ids[1]}']
+    if len(mouse_ids) > 1:
+        df[f'ellipse_area_ratio'] = df[f'ellipse_area_{mouse_ids[0]}']/df[f'ellipse_area_{mouse_ids[1]}']
 
     return df
 
 #Recall framerate is 30 fps
-def _compute_kinematics(df, names, animal_setup, window_size = 5, n_shifts = 3):
+def _compute_kinematics(df, names, animal_setup, window_size = 5, n_shifts = 3, offsets = None):
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
     colnames = animal_setup['colnames']
@@ -176,19 +338,36 @@ def _compute_kinematics(df, names, animal_setup, window_size = 5, n_shifts = 3):
     for mouse_id in mouse_ids:
         for name in names:
             ## Speed of centroids
-            dx = df[f'centroid_{name}_{mouse_id}_x'].diff(window_size)
-            dy = df[f'centroid_{name}_{mouse_id}_y'].diff(window_size)
+            dx = diff_within_segments(df[f'centroid_{name}_{mouse_id}_x'].to_numpy(), window_size, offsets)
+            dy = diff_within_segments(df[f'centroid_{name}_{mouse_id}_y'].to_numpy(), window_size, offsets)
             df[f'centroid_{name}_{mouse_id}_speed'] = np.sqrt(dx**2 + dy**2)
             #colnames.append(f'centroid_{name}_{mouse_id}_speed')
             ## Acceleration of centroids
-            ddx = dx.diff(window_size)
-            ddy = dy.diff(window_size)
+            ddx = diff_within_segments(dx, window_size, offsets)
+            ddy = diff_within_segments(dy, window_size, offsets)
             df[f'centroid_{name}_{mouse_id}_accel_x'] = ddx/(window_size**2)
             df[f'centroid_{name}_{mouse_id}_accel_y'] = ddy/(window_size**2)
     return df
 
 @augment_features()
-def _compute_relative_body_motions(df, animal_setup, window_size = 3, n_shifts = 3, mode = 'shift'):
+def _compute_relative_body_motions(df, animal_setup, window_size = 3, n_shifts = 3, mode = 'shift', offsets = None):
+    return _geometry_features(_relative_body_motions_reference, _relative_body_motions_kernel, df, animal_setup, 
+                              window_size = window_size, offsets = offsets)
+
+def _relative_body_motions_kernel(df, animal_setup, window_size = 3, offsets = None, backend = 'numpy'):
+    mouse_ids = animal_setup['mouse_ids']
+    centroids = _points(df, mouse_ids, 'centroid_all', centroid = True)
+    velocities = diff_within_segments(centroids.reshape(len(df), -1), window_size, offsets).reshape(centroids.shape)/window_size
+    major = df[[f'ellipse_major_{m_id}' for m_id in mouse_ids]].to_numpy(dtype = float)
+    dm, v_tangent, v_perp, scaled = geometry.relative_body_motions(centroids, velocities, major, backend = backend)
+    features = {'distance_main_centroid': dm}
+    for idx, m_id in enumerate(mouse_ids):
+        features[f'relative_vel_tanget_{m_id}'] = v_tangent[:,idx]
+        features[f'relative_vel_perp_{m_id}'] = v_perp[:,idx]
+        features[f'scaled_main_centroid_distance_by_ellipse_major_{m_id}'] = scaled[:,idx]
+    return features
+
+def _relative_body_motions_reference(df, animal_setup, window_size = 3, offsets = None):
 
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
@@ -202,8 +381,8 @@ def _compute_relative_body_motions(df, animal_setup, window_size = 3, n_shifts =
 
     #Compute velocity of mouse centroids
     for m_id in mouse_ids:
-        vx = df[f'centroid_all_{m_id}_x'].diff(window_size)/window_size
-        vy = df[f'centroid_all_{m_id}_y'].diff(window_size)/window_size
+        vx = diff_within_segments(df[f'centroid_all_{m_id}_x'].to_numpy(), window_size, offsets)/window_size
+        vy = diff_within_segments(df[f'centroid_all_{m_id}_y'].to_numpy(), window_size, offsets)/window_size
         v_tangent = (dx*vx + dy*vy)/dm
         v_perp_x = vx - dx*v_tangent/dm
         v_perp_y = vy - dy*v_tangent/dm
@@ -218,7 +397,22 @@ def _compute_relative_body_motions(df, animal_setup, window_size = 3, n_shifts =
     return df
 
 @augment_features()
-def _compute_relative_body_angles(df, animal_setup, n_shifts = 3, mode = 'shift'):
+def _compute_relative_body_angles(df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None):
+    return _geometry_features(_relative_body_angles_reference, _relative_body_angles_kernel, df, animal_setup)
+
+def _relative_body_angles_kernel(df, animal_setup, backend = 'numpy'):
+    mouse_ids = animal_setup['mouse_ids']
+    centroids, heads, bodies = [_points(df, mouse_ids, f'centroid_{name}', centroid = True) for name in ['all', 'head', 'body']]
+    noses, necks = [_points(df, mouse_ids, bp) for bp in ['nose', 'neck']]
+    body_angle, head_angle, in_view = geometry.relative_body_angles(centroids, heads, bodies, noses, necks, backend = backend)
+    features = {}
+    for idx, m_id in enumerate(mouse_ids):
+        features[f'angle_head_body_centroid_{m_id}'] = body_angle[:,idx]
+        features[f'angle_head_centroid_{m_id}'] = head_angle[:,idx]
+        features[f'{mouse_ids[1-idx]}_in_view_of_{m_id}'] = in_view[:,idx]
+    return features
+
+def _relative_body_angles_reference(df, animal_setup):
 
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
@@ -251,7 +445,13 @@ def _compute_relative_body_angles(df, animal_setup, n_shifts = 3, mode = 'shift'
     return df
     
 @augment_features()
-def _compute_iou(df, animal_setup, n_shifts = 3, mode = 'shift'):
+def _compute_iou(df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None):
+    return _geometry_features(_iou_reference, _iou_kernel, df, animal_setup)
+
+def _iou_kernel(df, animal_setup, backend = 'numpy'):
+    return {'iou': geometry.iou(_track_tensor(df, animal_setup), backend = backend)}
+
+def _iou_reference(df, animal_setup):
 
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
@@ -284,7 +484,7 @@ def _compute_iou(df, animal_setup, n_shifts = 3, mode = 'shift'):
 #These depend on the video you're applying it to...
 #Which can change from video to video, train to test, etc. So perhaps not useful
 @augment_features()
-def _compute_cage_distances(features_df, animal_setup, n_shifts = 3, mode = 'shift'):
+def _compute_cage_distances(features_df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None):
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
     colnames = animal_setup['colnames']
@@ -298,38 +498,34 @@ def _compute_cage_distances(features_df, animal_setup, n_shifts = 3, mode = 'shi
         features_df = features_df.drop(columns = [f'centroid_all_{m_id}_x_inverted', f'centroid_all_{m_id}_y_inverted'])
     return features_df
 
-def make_features_distances(df, animal_setup):
+def _compute_distances(df, animal_setup, offsets = None):
 
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
-    colnames = animal_setup['colnames']
-    print(colnames)
 
-    features_df = df.copy()
+    def dist(m1, bp1, m2, bp2):
+        dx = df['_'.join([m1, 'x', bp1])].to_numpy() - df['_'.join([m2, 'x', bp2])].to_numpy()
+        dy = df['_'.join([m1, 'y', bp1])].to_numpy() - df['_'.join([m2, 'y', bp2])].to_numpy()
+        return np.sqrt(dx**2 + dy**2)
 
-    ##Make the distance features
+    ##Make the distance features, added to the table in one go
+    features = {}
     for i, bp1 in enumerate(bodypart_ids):
         for j, bp2 in enumerate(bodypart_ids):
             if i < j:
                 for mouse_id in mouse_ids:
                     #We can compute the intra-mouse difference
-                    f1x = '_'.join([mouse_id, 'x', bp1])
-                    f2x = '_'.join([mouse_id, 'x', bp2])
-                    f1y = '_'.join([mouse_id, 'y', bp1])
-                    f2y = '_'.join([mouse_id, 'y', bp2])
-                    f_new = '_'.join([mouse_id, 'dist', bp1, bp2])
-                    features_df[f_new] = \
-                        np.sqrt((features_df[f1x] - features_df[f2x])**2 + 
-                                (features_df[f1y] - features_df[f2y])**2)
+                    features['_'.join([mouse_id, 'dist', bp1, bp2])] = dist(mouse_id, bp1, mouse_id, bp2)
             #Inter-mouse difference
-            f1x = '_'.join([mouse_ids[0], 'x', bp1])
-            f2x = '_'.join([mouse_ids[1], 'x', bp2])
-            f1y = '_'.join([mouse_ids[0], 'y', bp1])
-            f2y = '_'.join([mouse_ids[1], 'y', bp2])
-            f_new = '_'.join(['M0_M1', 'dist', bp1, bp2])
-            features_df[f_new] = \
-                        np.sqrt((features_df[f1x] - features_df[f2x])**2 + 
-                                (features_df[f1y] - features_df[f2y])**2)
+            features['_'.join(['M0_M1', 'dist', bp1, bp2])] = dist(mouse_ids[0], bp1, mouse_ids[1], bp2)
+    return pd.concat([df, pd.DataFrame(features, index = df.index)], axis = 1)
+
+def make_features_distances(df, animal_setup):
+
+    colnames = animal_setup['colnames']
+    print(colnames)
+
+    features_df = _compute_distances(df, animal_setup)
 
     #Remove base features
     features_df = features_df.drop(columns = colnames)
@@ -339,105 +535,307 @@ def make_features_distances(df, animal_setup):
 
     return features_df
 
-def make_features_mars(df, animal_setup, n_shifts = 3, mode = 'shift'):
-
-    features_df = df.copy()
-
-    #######################
-    ## Position features ##
-    #######################
-    features_df = _compute_centroid(features_df, 'all', animal_setup, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'head', animal_setup, ['nose', 'leftear', 'rightear', 'neck'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'hips', animal_setup, ['lefthip', 'tail', 'righthip'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'body', animal_setup, ['neck', 'lefthip', 'righthip', 'tail'], n_shifts = n_shifts, mode = mode)
-
-    #This is too specific to the particular cage setup, and requires knowing the cage (or image) dimensions, 
-    #so we'll remove it.
-    #features_df = _compute_cage_distances(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #####################
-    #Appearance features#
-    #####################
-
-    ## absolute orientation of mice
-    features_df = _compute_abs_angle(features_df, 'head_hips', animal_setup, ['centroid_head', 'centroid_hips'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'head_nose', animal_setup, ['neck', 'nose'], centroid = False, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'tail_neck', animal_setup, ['tail', 'neck'], centroid = False, n_shifts = n_shifts, mode = mode)
-    ## relative orientation of mice
-    features_df = _compute_rel_angle(features_df, 'leftear_neck_rightear', animal_setup, ['leftear', 'neck', 'rightear'], n_shifts = n_shifts, mode = mode)
-    ## major axis len, minor axis len of ellipse fit to mouses body
-    features_df = _compute_ellipsoid(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #####################
-    #Locomotion features#
-    #####################
-
-    features_df = _compute_kinematics(features_df, ['all', 'head', 'hips', 'body'], animal_setup)
-
-    #################
-    #Social features#
-    #################
-
-    features_df = _compute_relative_body_motions(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_relative_body_angles(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #Intersection of union of bounding boxes of two mice
-    features_df = _compute_iou(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    ## distance between all pairs of keypoints of each mouse
-    features_df = make_features_distances(features_df, animal_setup)
-
-    return features_df
-
-def make_features_mars_distr(x, y):
-    return make_features_mars(x, y, n_shifts = 3, mode = 'distr')
+###################
+## Feature graph ##
+###################
+
+#Each feature set is made of nodes of this graph. Each node declares the nodes whose columns it reads and 
+#the columns it makes, so requesting several feature sets together computes each node only once, nodes 
+#whose columns are already in the table are skipped, and independent nodes can run in parallel.
+
+class FeatureNode(object):
+
+    def __init__(self, name, function, outputs, inputs = (), augment = True, kwargs = None, context = (0, 0)):
+        """A step of the feature graph
+
+        Args:
+            name: name of the node
+            function: the feature function. Called as function(df, animal_setup = animal_setup, **kwargs) and returns df with the new columns added
+            outputs: function of the animal setup, giving the names of the columns the node makes (before any shifts)
+            inputs: names of the nodes whose columns the function reads
+            augment: default True. Whether function is decorated with augment_features, and so adds shifted copies of its columns
+            kwargs: default None. Dictionary of other arguments to function
+            context: default (0, 0). Number of past and future frames of its inputs each row of the function's 
+                columns (before any shifts) depends on
+        """
+        self.name = name
+        self.function = function
+        self.outputs = outputs
+        self.inputs = tuple(inputs)
+        self.augment = augment
+        self.kwargs = {} if kwargs is None else kwargs
+        self.context = tuple(context)
+
+    def columns(self, animal_setup, n_shifts, mode):
+        """All columns the node adds to the table, including the shifted copies"""
+        cols = list(self.outputs(animal_setup))
+        if self.augment:
+            cols += _augmented_columns(cols, n_shifts, mode)
+        return cols
+
+    def __repr__(self):
+        return f'FeatureNode({self.name}, inputs = {list(self.inputs)})'
+
+def _centroid_node(name, body_parts = None):
+    return FeatureNode(f'centroid_{name}', _compute_centroid, 
+                       lambda a: [f'centroid_{name}_{m}_{xy}' for m in a['mouse_ids'] for xy in XY_IDS], 
+                       kwargs = {'name': name, 'body_parts': body_parts})
+
+def _angle_node(name, function, bps, inputs = (), **kwargs):
+    return FeatureNode(f'angle_{name}', function, lambda a: [f'angle_{name}_{m}' for m in a['mouse_ids']], 
+                       inputs = inputs, kwargs = dict(name = name, bps = bps, **kwargs))
+
+def _ellipsoid_outputs(animal_setup):
+    mouse_ids = animal_setup['mouse_ids']
+    cols = [f'ellipse_{k}_{m}' for m in mouse_ids for k in ['major', 'minor', 'ratio', 'area']]
+    return cols + ['ellipse_area_ratio'] if len(mouse_ids) > 1 else cols
 
-def make_features_mars_reduced(df, animal_setup, n_shifts = 2, mode = 'diff'):
+def _kinematics_outputs(animal_setup):
+    return [f'centroid_{name}_{m}_{k}' for m in animal_setup['mouse_ids'] for name in ['all', 'head', 'hips', 'body'] 
+            for k in ['speed', 'accel_x', 'accel_y']]
 
-    features_df = df.copy()
+def _relative_body_motions_outputs(animal_setup):
+    return ['distance_main_centroid'] + \
+           [f'{k}_{m}' for m in animal_setup['mouse_ids'] for k in ['relative_vel_tanget', 'relative_vel_perp', 
+                                                                   'scaled_main_centroid_distance_by_ellipse_major']]
 
-    #######################
-    ## Position features ##
-    #######################
-    features_df = _compute_centroid(features_df, 'all', animal_setup, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'head', animal_setup, ['nose', 'leftear', 'rightear', 'neck'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'hips', animal_setup, ['lefthip', 'tail', 'righthip'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'body', animal_setup, ['neck', 'lefthip', 'righthip', 'tail'], n_shifts = n_shifts, mode = mode)
-
-    #####################
-    #Appearance features#
-    #####################
-
-    ## absolute orientation of mice
-    features_df = _compute_abs_angle(features_df, 'head_hips', animal_setup, ['centroid_head', 'centroid_hips'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'head_nose', animal_setup, ['neck', 'nose'], centroid = False, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'tail_neck', animal_setup, ['tail', 'neck'], centroid = False, n_shifts = n_shifts, mode = mode)
-    ## relative orientation of mice
-    features_df = _compute_rel_angle(features_df, 'leftear_neck_rightear', animal_setup, ['leftear', 'neck', 'rightear'], n_shifts = n_shifts, mode = mode)
-    ## major axis len, minor axis len of ellipse fit to mouses body
-    features_df = _compute_ellipsoid(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #####################
-    #Locomotion features#
-    #####################
-
-    features_df = _compute_kinematics(features_df, ['all', 'head', 'hips', 'body'], animal_setup)
+def _relative_body_angles_outputs(animal_setup):
+    mouse_ids = animal_setup['mouse_ids']
+    return [c for idx, m in enumerate(mouse_ids) for c in [f'angle_head_body_centroid_{m}', f'angle_head_centroid_{m}', 
+                                                          f'{mouse_ids[1-idx]}_in_view_of_{m}']]
 
+def _distances_outputs(animal_setup):
+    bodypart_ids = animal_setup['bodypart_ids']
+    cols = []
+    for i, bp1 in enumerate(bodypart_ids):
+        for j, bp2 in enumerate(bodypart_ids):
+            if i < j:
+                cols += ['_'.join([m, 'dist', bp1, bp2]) for m in animal_setup['mouse_ids']]
+            cols.append('_'.join(['M0_M1', 'dist', bp1, bp2]))
+    return cols
+
+#In the order the columns appear in the feature tables
+FEATURE_GRAPH = {node.name: node for node in [
+    ## Position features
+    _centroid_node('all'),
+    _centroid_node('head', ['nose', 'leftear', 'rightear', 'neck']),
+    _centroid_node('hips', ['lefthip', 'tail', 'righthip']),
+    _centroid_node('body', ['neck', 'lefthip', 'righthip', 'tail']),
+    ## Appearance features
+    #absolute orientation of mice
+    _angle_node('head_hips', _compute_abs_angle, ['centroid_head', 'centroid_hips'], inputs = ['centroid_head', 'centroid_hips']),
+    _angle_node('head_nose', _compute_abs_angle, ['neck', 'nose'], centroid = False),
+    _angle_node('tail_neck', _compute_abs_angle, ['tail', 'neck'], centroid = False),
+    #relative orientation of mice
+    _angle_node('leftear_neck_rightear', _compute_rel_angle, ['leftear', 'neck', 'rightear']),
+    #major axis len, minor axis len of ellipse fit to mouses body
+    FeatureNode('ellipsoid', _compute_ellipsoid, _ellipsoid_outputs),
+    ## Locomotion features
+    #Accelerations are differences of differences over window_size = 5 frames
+    FeatureNode('kinematics', _compute_kinematics, _kinematics_outputs, 
+                inputs = ['centroid_all', 'centroid_head', 'centroid_hips', 'centroid_body'], 
+                augment = False, kwargs = {'names': ['all', 'head', 'hips', 'body']}, context = (10, 0)),
+    ## Social features
+    #Velocities are differences over window_size = 3 frames
+    FeatureNode('relative_body_motions', _compute_relative_body_motions, _relative_body_motions_outputs, 
+                inputs = ['centroid_all', 'ellipsoid'], context = (3, 0)),
+    FeatureNode('relative_body_angles', _compute_relative_body_angles, _relative_body_angles_outputs, 
+                inputs = ['centroid_all', 'centroid_head', 'centroid_body']),
     #Intersection of union of bounding boxes of two mice
-    features_df = _compute_iou(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    ## distance between all pairs of keypoints of each mouse
-    features_df = make_features_distances(features_df, animal_setup)
-
-    return features_df
-
-def make_features_velocities(df, animal_setup, n_shifts = 5):
+    FeatureNode('iou', _compute_iou, lambda a: ['iou']),
+    #distance between all pairs of keypoints of each mouse
+    FeatureNode('distances', _compute_distances, _distances_outputs, augment = False)
+]}
+
+#The nodes whose columns make up each feature set
+FEATURE_SETS = {'mars': list(FEATURE_GRAPH), 
+                'mars_reduced': ['centroid_all', 'centroid_head', 'centroid_hips', 'centroid_body', 
+                                 'angle_head_hips', 'angle_head_nose', 'angle_tail_neck', 'angle_leftear_neck_rightear', 
+                                 'ellipsoid', 'kinematics', 'iou', 'distances'], 
+                'social': ['relative_body_motions', 'relative_body_angles', 'iou']}
+
+def resolve_feature_graph(targets):
+    """Nodes needed to compute the target nodes, including their dependencies
+
+    Args:
+        targets: names of nodes of FEATURE_GRAPH
+
+    Returns:
+        List of node names, each after the nodes it depends on
+    """
+    needed = set()
+    def visit(name):
+        if name not in FEATURE_GRAPH:
+            raise ValueError(f"Unknown feature node '{name}'. Available nodes: {list(FEATURE_GRAPH)}")
+        if name in needed: return
+        needed.add(name)
+        for dep in FEATURE_GRAPH[name].inputs:
+            visit(dep)
+    for name in targets:
+        visit(name)
+    #FEATURE_GRAPH is listed in dependency order
+    return [name for name in FEATURE_GRAPH if name in needed]
+
+def _augment_context(n_shifts, mode, window_size = 5):
+    """Number of past and future frames the columns augment_features adds depend on"""
+    if n_shifts == 0:
+        return (0, 0)
+    if mode == 'distr':
+        return (max(DISTR_WINDOW_SIZES), max(DISTR_WINDOW_SIZES))
+    return (n_shifts*window_size, n_shifts*window_size)
+
+def feature_set_context(feature_set, n_shifts = 3, mode = 'shift'):
+    """Number of past and future frames each row of a feature set depends on
+
+    Args:
+        feature_set: name of a feature set, key of FEATURE_SETS
+        n_shifts, mode: as passed to make_feature_sets
+
+    Returns:
+        Tuple (past frames, future frames)
+    """
+    if feature_set not in FEATURE_SETS:
+        raise ValueError(f"Unknown feature set '{feature_set}'. Available sets: {list(FEATURE_SETS)}")
+    #Context of each node's columns before shifting, following its inputs
+    base = {}
+    for name in resolve_feature_graph(FEATURE_SETS[feature_set]):
+        node = FEATURE_GRAPH[name]
+        inputs = [base[dep] for dep in node.inputs]
+        base[name] = tuple(c + max([d[i] for d in inputs], default = 0) for i, c in enumerate(node.context))
+    augment = _augment_context(n_shifts, mode)
+    context = [tuple(c + a for c, a in zip(base[name], augment)) if FEATURE_GRAPH[name].augment else base[name] 
+               for name in FEATURE_SETS[feature_set]]
+    return tuple(max(c[i] for c in context) for i in range(2))
+
+def compute_feature_graph(df, animal_setup, targets, n_shifts = 3, mode = 'shift', offsets = None, cache = None, 
+                          n_jobs = 1, columns = None):
+    """Compute the columns of the target nodes, and the nodes they depend on, each once
+
+    Nodes whose columns are all already in df are not recomputed. If columns is given, only those shifted or 
+    distribution columns are made, along with the unshifted columns of each node computed. 
+
+    Args:
+        df: table with the raw tracks
+        animal_setup: dictionary with mouse_ids, bodypart_ids and colnames
+        targets: names of nodes of FEATURE_GRAPH
+        n_shifts: default 3. Number of shifts augment_features makes of each feature
+        mode: default 'shift'. How augment_features augments each feature ('shift', 'diff' or 'distr')
+        offsets: default None. Video offsets, so shifts don't move values between videos
+        cache: default None. A FeatureCache for intermediate results
+        n_jobs: default 1. Number of threads to evaluate independent nodes with
+        columns: default None. Names of the columns wanted, if not all of them
+
+    Returns:
+        Dictionary with, for each node computed, a DataFrame with the columns it added
+    """
+    order = resolve_feature_graph(targets)
+    results = {}
+
+    def run(name):
+        node = FEATURE_GRAPH[name]
+        cols = node.columns(animal_setup, n_shifts, mode)
+        augment_columns = None
+        if columns is not None:
+            #The unshifted columns are made anyway, and other nodes may need them
+            outputs = set(node.outputs(animal_setup))
+            augment_columns = set(c for c in cols if c in columns and c not in outputs)
+            cols = [c for c in cols if c in outputs or c in augment_columns]
+        cols = [c for c in cols if c not in df.columns]
+        if not cols:
+            return pd.DataFrame(index = df.index)
+        node_df = pd.concat([df] + [results[dep] for dep in node.inputs], axis = 1)
+        kwargs = dict(node.kwargs, offsets = offsets)
+        if node.augment:
+            kwargs.update(n_shifts = n_shifts, mode = mode, cache = cache, augment_columns = augment_columns)
+        return node.function(node_df, animal_setup = animal_setup, **kwargs)[cols]
+
+    if n_jobs == 1:
+        for name in order:
+            results[name] = run(name)
+        return results
+
+    #Submit each node once the nodes it depends on are done
+    waiting = list(order)
+    with ThreadPoolExecutor(max_workers = n_jobs) as pool:
+        running = {}
+        while waiting or running:
+            for name in [n for n in waiting if all(dep in results for dep in FEATURE_GRAPH[n].inputs)]:
+                running[pool.submit(run, name)] = name
+                waiting.remove(name)
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+def make_feature_sets(df, animal_setup, feature_sets, n_shifts = 3, mode = 'shift', offsets = None, cache = None, 
+                      n_jobs = 1, columns = None, impute = True):
+    """Make several feature sets, computing the nodes they share only once
+
+    Args:
+        df: table with the raw tracks
+        animal_setup: dictionary with mouse_ids, bodypart_ids and colnames
+        feature_sets: names of feature sets, keys of FEATURE_SETS
+        n_shifts, mode, offsets, cache, n_jobs: see compute_feature_graph
+        columns: default None. Names of the feature columns wanted. If given, only the nodes, shifts and window 
+            statistics these need are computed, and each table only has the wanted columns in the feature set
+        impute: default True. Whether to fill missing values with the column means, see fill_missing_with_means
+
+    Returns:
+        Dictionary with a table of features for each feature set
+    """
+    for name in feature_sets:
+        if name not in FEATURE_SETS:
+            raise ValueError(f"Unknown feature set '{name}'. Available sets: {list(FEATURE_SETS)}")
+    set_nodes = {name: FEATURE_SETS[name] for name in feature_sets}
+    if columns is not None:
+        columns = set(columns)
+        #Only the nodes making a wanted column
+        node_columns = {node: set(FEATURE_GRAPH[node].columns(animal_setup, n_shifts, mode)) 
+                        for name in feature_sets for node in set_nodes[name]}
+        unknown = columns.difference(*node_columns.values())
+        if unknown:
+            raise ValueError(f"Columns not made by the feature sets {feature_sets}: {sorted(unknown)}")
+        set_nodes = {name: [node for node in nodes if columns.intersection(node_columns[node])] 
+                     for name, nodes in set_nodes.items()}
+    targets = [t for name in feature_sets for t in set_nodes[name]]
+    results = compute_feature_graph(df, animal_setup, targets, n_shifts = n_shifts, mode = mode, offsets = offsets, 
+                                    cache = cache, n_jobs = n_jobs, columns = columns)
+    colnames = animal_setup['colnames']
+    feature_tables = {}
+    for name in feature_sets:
+        features_df = pd.concat([df] + [results[t] for t in set_nodes[name]], axis = 1)
+        #Remove base features
+        features_df = features_df.drop(columns = [c for c in colnames if c in features_df.columns])
+        if columns is not None:
+            features_df = features_df[[c for c in features_df.columns if c in columns]]
+        ##Clean up seq_id columns
+        features_df, _ = boiler_plate(features_df, impute = impute)
+        feature_tables[name] = features_df
+    return feature_tables
+
+def make_features_mars(df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None, cache = None, n_jobs = 1, 
+                       columns = None, impute = True):
+    return make_feature_sets(df, animal_setup, ['mars'], n_shifts = n_shifts, mode = mode, offsets = offsets, 
+                             cache = cache, n_jobs = n_jobs, columns = columns, impute = impute)['mars']
+
+def make_features_mars_distr(x, y, offsets = None, cache = None, columns = None, impute = True):
+    return make_features_mars(x, y, n_shifts = 3, mode = 'distr', offsets = offsets, cache = cache, columns = columns, 
+                              impute = impute)
+
+def make_features_mars_reduced(df, animal_setup, n_shifts = 2, mode = 'diff', offsets = None, cache = None, n_jobs = 1, 
+                               columns = None, impute = True):
+    return make_feature_sets(df, animal_setup, ['mars_reduced'], n_shifts = n_shifts, mode = mode, offsets = offsets, 
+                             cache = cache, n_jobs = n_jobs, columns = columns, impute = impute)['mars_reduced']
+
+def make_features_velocities(df, animal_setup, n_shifts = 5, offsets = None):
 
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
     colnames = animal_setup['colnames']
 
     features_df = df.copy()
+    diffs = pd.DataFrame(diff_within_segments(features_df[colnames].to_numpy(), n_shifts, offsets), 
+                         index = features_df.index, columns = colnames)
 
     ##Make the distance features
     for i, bp1 in enumerate(bodypart_ids):
@@ -451,8 +849,8 @@ def make_features_velocities(df, animal_setup, n_shifts = 5):
                     f2y = '_'.join([mouse_id, 'y', bp2])
                     f_new = '_'.join([mouse_id, 'speed', bp1, bp2])
                     features_df[f_new] = \
-                        np.sqrt((features_df[f1x].diff(periods = n_shifts) - features_df[f2x].diff(periods = n_shifts))**2 + 
-                                (features_df[f1y].diff(periods = n_shifts) - features_df[f2y].diff(periods = n_shifts))**2)
+                        np.sqrt((diffs[f1x] - diffs[f2x])**2 + 
+                                (diffs[f1y] - diffs[f2y])**2)
             #Inter-mouse difference
             f1x = '_'.join([mouse_ids[0], 'x', bp1])
             f2x = '_'.join([mouse_ids[1], 'x', bp2])
@@ -460,8 +858,8 @@ def make_features_velocities(df, animal_setup, n_shifts = 5):
             f2y = '_'.join([mouse_ids[1], 'y', bp2])
             f_new = '_'.join(['M0_M1', 'speed', bp1, bp2])
             features_df[f_new] = \
-                        np.sqrt((features_df[f1x].diff(periods = n_shifts) - features_df[f2x].diff(periods = n_shifts))**2 + 
-                                (features_df[f1y].diff(periods = n_shifts) - features_df[f2y].diff(periods = n_shifts))**2)
+                        np.sqrt((diffs[f1x] - diffs[f2x])**2 + 
+                                (diffs[f1y] - diffs[f2y])**2)
 
     #Remove base features
     features_df = features_df.drop(columns = colnames)
@@ -471,50 +869,7 @@ def make_features_velocities(df, animal_setup, n_shifts = 5):
 
     return features_df
 
-def make_features_social(df, animal_setup, n_shifts = 3, mode = 'shift'):
-
-    features_df = df.copy()
-    colnames = animal_setup['colnames']
-
-    #######################
-    ## Position features ##
-    #######################
-    features_df = _compute_centroid(features_df, 'all', animal_setup, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'head', animal_setup, ['nose', 'leftear', 'rightear', 'neck'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'hips', animal_setup, ['lefthip', 'tail', 'righthip'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_centroid(features_df, 'body', animal_setup, ['neck', 'lefthip', 'righthip', 'tail'], n_shifts = n_shifts, mode = mode)
-
-    #####################
-    #Appearance features#
-    #####################
-
-    ## absolute orientation of mice
-    features_df = _compute_abs_angle(features_df, 'head_hips', animal_setup, ['centroid_head', 'centroid_hips'], n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'head_nose', animal_setup, ['neck', 'nose'], centroid = False, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_abs_angle(features_df, 'tail_neck', animal_setup, ['tail', 'neck'], centroid = False, n_shifts = n_shifts, mode = mode)
-    ## relative orientation of mice
-    features_df = _compute_rel_angle(features_df, 'leftear_neck_rightear', animal_setup, ['leftear', 'neck', 'rightear'], n_shifts = n_shifts, mode = mode)
-
-    ## major axis len, minor axis len of ellipse fit to mouses body
-    features_df = _compute_ellipsoid(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #################
-    #Social features#
-    #################
-
-    #Added columns 
-    added_cols = list(set(features_df.columns).difference(set(df.columns)))
-
-    features_df = _compute_relative_body_motions(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-    features_df = _compute_relative_body_angles(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    #Intersection of union of bounding boxes of two mice
-    features_df = _compute_iou(features_df, animal_setup, n_shifts = n_shifts, mode = mode)
-
-    features_df = features_df.drop(columns = added_cols)
-    colnames = [c for c in colnames if c in features_df.columns]
-    features_df = features_df.drop(columns = colnames)
-
-    features_df, _ = boiler_plate(features_df)
-
-    return features_df
\ No newline at end of file
+def make_features_social(df, animal_setup, n_shifts = 3, mode = 'shift', offsets = None, cache = None, n_jobs = 1, 
+                         columns = None, impute = True):
+    return make_feature_sets(df, animal_setup, ['social'], n_shifts = n_shifts, mode = mode, offsets = offsets, 
+                             cache = cache, n_jobs = n_jobs, columns = columns, impute = impute)['social']
@@ -0,0 +1,242 @@
+"""Geometric kernels for the MARS angle, IOU and relative motion features.
+
+Each kernel takes arrays of points, shaped (frames, animals, 2) or (frames, animals, bodyparts, 2), and
+computes its features in one pass over the frames. There are two versions of each kernel: a Numba-compiled
+loop, used if Numba is installed, and a vectorized NumPy version. Which one the feature functions use is set
+by `global_config['feature_engineering__geometry_backend']`.
+"""
+
+import numpy as np
+
+try:
+    import numba
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+def _jit(function):
+    if not has_numba:
+        return None
+    #numpy error model, so division by zero gives inf/nan instead of raising. Compiled code is cached on 
+    #disk, so worker processes don't compile the kernels again
+    return numba.njit(error_model = 'numpy', cache = True)(function)
+
+###########
+## Numba ##
+###########
+
+def _abs_angle_loop(a, b):
+    n, m = a.shape[0], a.shape[1]
+    out = np.empty((n, m))
+    for i in range(n):
+        for j in range(m):
+            out[i,j] = np.arctan2(a[i,j,1] - b[i,j,1], a[i,j,0] - b[i,j,0])
+    return out
+
+def _rel_angle_loop(a, b, c):
+    n, m = a.shape[0], a.shape[1]
+    out = np.empty((n, m))
+    for i in range(n):
+        for j in range(m):
+            x1 = a[i,j,0] - b[i,j,0]
+            y1 = a[i,j,1] - b[i,j,1]
+            x2 = c[i,j,0] - b[i,j,0]
+            y2 = c[i,j,1] - b[i,j,1]
+            out[i,j] = np.arccos((x1*x2 + y1*y2)/(np.sqrt(x1*x1 + y1*y1)*np.sqrt(x2*x2 + y2*y2)))
+    return out
+
+def _bounds(tracks, i, j, k):
+    #Min and max over the body parts, skipping missing points
+    lo = np.nan
+    hi = np.nan
+    for l in range(tracks.shape[2]):
+        v = tracks[i,j,l,k]
+        if v == v:
+            if not (lo <= v): lo = v
+            if not (hi >= v): hi = v
+    return lo, hi
+
+def _iou_loop(tracks):
+    n = tracks.shape[0]
+    out = np.empty(n)
+    for i in range(n):
+        min_x0, max_x0 = _bounds_jit(tracks, i, 0, 0)
+        min_y0, max_y0 = _bounds_jit(tracks, i, 0, 1)
+        min_x1, max_x1 = _bounds_jit(tracks, i, 1, 0)
+        min_y1, max_y1 = _bounds_jit(tracks, i, 1, 1)
+        dx = np.maximum(np.minimum(max_x0, max_x1) - np.maximum(min_x0, min_x1), 0.)
+        dy = np.maximum(np.minimum(max_y0, max_y1) - np.maximum(min_y0, min_y1), 0.)
+        intersection = dx*dy
+        area0 = (max_x0 - min_x0)*(max_y0 - min_y0)
+        area1 = (max_x1 - min_x1)*(max_y1 - min_y1)
+        out[i] = intersection/(area0 + area1 - intersection)
+    return out
+
+def _relative_body_motions_loop(centroids, velocities, major):
+    n, m = velocities.shape[0], velocities.shape[1]
+    distance = np.empty(n)
+    tangent = np.empty((n, m))
+    perp = np.empty((n, m))
+    scaled = np.empty((n, m))
+    for i in range(n):
+        dx = centroids[i,0,0] - centroids[i,1,0]
+        dy = centroids[i,0,1] - centroids[i,1,1]
+        dm = np.sqrt(dx*dx + dy*dy)
+        distance[i] = dm
+        for j in range(m):
+            vx = velocities[i,j,0]
+            vy = velocities[i,j,1]
+            v_tangent = (dx*vx + dy*vy)/dm
+            px = vx - dx*v_tangent/dm
+            py = vy - dy*v_tangent/dm
+            tangent[i,j] = v_tangent
+            perp[i,j] = np.sqrt(px*px + py*py)
+            scaled[i,j] = dm/major[i,j]
+    return distance, tangent, perp, scaled
+
+def _relative_body_angles_loop(centroids, heads, bodies, noses, necks):
+    n, m = centroids.shape[0], centroids.shape[1]
+    body_angle = np.empty((n, m))
+    head_angle = np.empty((n, m))
+    in_view = np.empty((n, m))
+    threshold = 1/np.sqrt(2)
+    for i in range(n):
+        for j in range(m):
+            dx1 = centroids[i,1-j,0] - centroids[i,j,0]
+            dy1 = centroids[i,1-j,1] - centroids[i,j,1]
+            n1 = np.sqrt(dx1*dx1 + dy1*dy1)
+            dx2 = heads[i,j,0] - bodies[i,j,0]
+            dy2 = heads[i,j,1] - bodies[i,j,1]
+            body_angle[i,j] = np.arccos((dx1*dx2 + dy1*dy2)/(n1*np.sqrt(dx2*dx2 + dy2*dy2)))
+            #As in the reference implementation, the head vector's y component uses the nose's x coordinate
+            dx2 = noses[i,j,0] - necks[i,j,0]
+            dy2 = noses[i,j,0] - necks[i,j,1]
+            cosine_angle = (dx1*dx2 + dy1*dy2)/(n1*np.sqrt(dx2*dx2 + dy2*dy2))
+            head_angle[i,j] = np.arccos(cosine_angle)
+            in_view[i,j] = 1. if cosine_angle > threshold else 0.
+    return body_angle, head_angle, in_view
+
+_bounds_jit = _jit(_bounds)
+_abs_angle_jit = _jit(_abs_angle_loop)
+_rel_angle_jit = _jit(_rel_angle_loop)
+_iou_jit = _jit(_iou_loop)
+_relative_body_motions_jit = _jit(_relative_body_motions_loop)
+_relative_body_angles_jit = _jit(_relative_body_angles_loop)
+
+###########
+## NumPy ##
+###########
+
+def _cosine(x1, y1, x2, y2):
+    return (x1*x2 + y1*y2)/(np.sqrt(x1*x1 + y1*y1)*np.sqrt(x2*x2 + y2*y2))
+
+def _abs_angle_numpy(a, b):
+    return np.arctan2(a[...,1] - b[...,1], a[...,0] - b[...,0])
+
+def _rel_angle_numpy(a, b, c):
+    d1 = a - b
+    d2 = c - b
+    return np.arccos(_cosine(d1[...,0], d1[...,1], d2[...,0], d2[...,1]))
+
+def _iou_numpy(tracks):
+    #fmin/fmax skip missing points, like DataFrame.min/max
+    mins = np.fmin.reduce(tracks[:,:2], axis = 2)
+    maxs = np.fmax.reduce(tracks[:,:2], axis = 2)
+    d = np.minimum(maxs[:,0], maxs[:,1]) - np.maximum(mins[:,0], mins[:,1])
+    d = np.maximum(0, d)
+    intersection = d[:,0]*d[:,1]
+    areas = np.prod(maxs - mins, axis = -1)
+    return intersection/(areas[:,0] + areas[:,1] - intersection)
+
+def _relative_body_motions_numpy(centroids, velocities, major):
+    d = centroids[:,0] - centroids[:,1]
+    dm = np.sqrt(d[:,0]**2 + d[:,1]**2)
+    v_tangent = (d[:,None,0]*velocities[...,0] + d[:,None,1]*velocities[...,1])/dm[:,None]
+    v_perp = velocities - d[:,None,:]*(v_tangent/dm[:,None])[...,None]
+    return dm, v_tangent, np.sqrt(v_perp[...,0]**2 + v_perp[...,1]**2), dm[:,None]/major
+
+def _relative_body_angles_numpy(centroids, heads, bodies, noses, necks):
+    d1 = centroids[:,::-1] - centroids
+    d2 = heads - bodies
+    body_angle = np.arccos(_cosine(d1[...,0], d1[...,1], d2[...,0], d2[...,1]))
+    #As in the reference implementation, the head vector's y component uses the nose's x coordinate
+    cosine_angle = _cosine(d1[...,0], d1[...,1], noses[...,0] - necks[...,0], noses[...,0] - necks[...,1])
+    return body_angle, np.arccos(cosine_angle), (cosine_angle > 1/np.sqrt(2)).astype(float)
+
+#############
+## Kernels ##
+#############
+
+def _kernel(backend, compiled, vectorized):
+    if backend == 'numba':
+        if not has_numba:
+            raise RuntimeError("The 'numba' geometry backend needs Numba, which is not installed")
+        return compiled
+    return vectorized
+
+def abs_angle(a, b, backend = 'numpy'):
+    """Angle of the vector from b to a
+
+    Args:
+        a, b: arrays of shape (frames, animals, 2)
+        backend: 'numba' or 'numpy'
+
+    Returns:
+        Array of shape (frames, animals)
+    """
+    return _kernel(backend, _abs_angle_jit, _abs_angle_numpy)(a, b)
+
+def rel_angle(a, b, c, backend = 'numpy'):
+    """Angle at b between the vectors from b to a and from b to c
+
+    Args:
+        a, b, c: arrays of shape (frames, animals, 2)
+        backend: 'numba' or 'numpy'
+
+    Returns:
+        Array of shape (frames, animals)
+    """
+    return _kernel(backend, _rel_angle_jit, _rel_angle_numpy)(a, b, c)
+
+def iou(tracks, backend = 'numpy'):
+    """Intersection over union of the bounding boxes of the first two animals
+
+    Args:
+        tracks: array of shape (frames, animals, bodyparts, 2)
+        backend: 'numba' or 'numpy'
+
+    Returns:
+        Array of shape (frames,)
+    """
+    return _kernel(backend, _iou_jit, _iou_numpy)(tracks)
+
+def relative_body_motions(centroids, velocities, major, backend = 'numpy'):
+    """Distance between the first two animals' centroids, and each animal's velocity along and across the line
+    joining them
+
+    Args:
+        centroids: array of shape (frames, animals, 2)
+        velocities: array of shape (frames, animals, 2) with the velocity of each centroid
+        major: array of shape (frames, animals) with the major axis of each animal's ellipse
+        backend: 'numba' or 'numpy'
+
+    Returns:
+        Tuple with the centroid distance, shape (frames,), and the tangent velocity, perpendicular speed and
+        distance scaled by the major axis, each of shape (frames, animals)
+    """
+    return _kernel(backend, _relative_body_motions_jit, _relative_body_motions_numpy)(centroids, velocities, major)
+
+def relative_body_angles(centroids, heads, bodies, noses, necks, backend = 'numpy'):
+    """Angles between the line joining two animals' centroids and each animal's body and head
+
+    Args:
+        centroids, heads, bodies: arrays of shape (frames, 2, 2) with each animal's centroids
+        noses, necks: arrays of shape (frames, 2, 2) with each animal's nose and neck
+        backend: 'numba' or 'numpy'
+
+    Returns:
+        Tuple with the body angle, the head angle and whether the other animal is in view, each of
+        shape (frames, 2)
+    """
+    return _kernel(backend, _relative_body_angles_jit, _relative_body_angles_numpy)(centroids, heads, bodies,
+                                                                                   noses, necks)
@@ -10,7 +10,7 @@ The function `create_custom_features` has the form:
 
 Where:
 
-`df` is the dataframe to compute the features on
+`df` is the dataframe to compute the features on. It only has the required columns, the raw tracking columns, and the `time`, `frame` and `filename` columns -- features computed earlier are not passed on. Treat it as read-only.
 `raw_col_names` is a list of the names of the columns in the dataframe that contain the raw data used for the feature creation. These are required for the model.
 `animal_setup` is a dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
    `bodypart_ids` is a list of the bodypart ids that are used in the dataframe
@@ -20,7 +20,7 @@ Where:
 
 The function returns:
 
-A dataframe, that only contains the new features. These will be added to the VideosetDataFrame as columns.
+A dataframe, that only contains the new features (with the same index as `df`). These will be added to the VideosetDataFrame as columns. There is no need to copy `df`.
 
 Once you have such a function defined, you can create a "feature making object" with
 
@@ -31,19 +31,37 @@ This could be used on datasets as:
 ```
 dataset.add_features(custom_feature_maker, featureset_name = 'CUSTOM', add_to_features = True)
 ```
+
+To compute only some of the features, pass their names as `columns`, e.g. `dataset.add_features(custom_feature_maker, featureset_name = 'CUSTOM', columns = [...])`. The names are also passed to the function as the keyword argument `columns`: a function can use them to skip the intermediates no requested column depends on (the MARS and social feature makers do), or ignore them, in which case the other columns are dropped afterwards.
+
+To compute the features from a live stream of frames, also give the number of past and future frames each row of features depends on, e.g. `Features(create_custom_features, req_columns, context = (5, 0))`, and use `custom_feature_maker.stream(animal_setup)`. See `FeatureStream`.
 """
 
 from typing import Callable
 import warnings
+import hashlib
+import json
+import os
+import time
+from functools import partial
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
 
 from behaveml.dl.dl_features import compute_dl_probability_features
-from behaveml.mars_features import compute_mars_features, compute_mars_reduced_features, compute_social_features
+from behaveml.mars_features import compute_mars_features, compute_mars_reduced_features, compute_social_features, \
+                                   compute_feature_sets, feature_sets_context, \
+                                   MARS_CONTEXT, MARS_REDUCED_CONTEXT, SOCIAL_CONTEXT
+from behaveml.utils import segment_offsets, parallel_imap
+from behaveml.dl.feature_engineering import fill_missing_with_means
 from behaveml.generic_features import compute_centerofmass_interanimal_distances, \
                                         compute_centerofmass_interanimal_speed, \
                                         compute_centerofmass, \
                                         compute_centerofmass_velocity, \
                                         compute_speed_features, \
-                                        compute_distance_features
+                                        compute_distance_features, \
+                                        differences_context, \
+                                        centerofmass_interanimal_speed_context
 
 default_tracking_columns = ['resident_x_nose', 'resident_x_leftear', 'resident_x_rightear', 'resident_x_neck',
                             'resident_x_lefthip', 'resident_x_righthip', 'resident_x_tail', 'resident_y_nose',
@@ -55,8 +73,215 @@ default_tracking_columns = ['resident_x_nose', 'resident_x_leftear', 'resident_x
                             'intruder_y_rightear', 'intruder_y_neck', 'intruder_y_lefthip',
                             'intruder_y_righthip', 'intruder_y_tail']
 
+class FeatureCache(object):
+    def __init__(self):
+        """Store of intermediate results (centroids, angles, ellipse fits, ...) shared between feature makers.
+
+        Each dataset has one of these, which is passed to the feature creation functions as the `cache` 
+        keyword argument, so that e.g. the MARS, reduced MARS and social feature sets compute their common 
+        intermediates only once. Entries are keyed by the version of the track data, the name of the 
+        intermediate, the rows it was computed on and its parameters. 
+        
+        The cache is cleared whenever the tracks change: when they are interpolated, when videos are added, 
+        when the data table is assigned, or when the track values are edited directly (detected from a hash 
+        of the tracks). It is never saved along with the dataset.
+        """
+        self.version = 0
+        self._store = {}
+        self._fingerprint = None
+
+    def invalidate(self) -> None:
+        """Drop all cached results, e.g. after the tracks have changed"""
+        self.version += 1
+        self._store = {}
+
+    def check_tracks(self, tracks) -> None:
+        """Invalidate the cache if the tracks differ from the ones the cached results were computed from.
+
+        Args:
+            tracks: DataFrame with the raw track columns
+        """
+        values = np.ascontiguousarray(tracks.to_numpy(dtype = float))
+        fingerprint = (values.shape, hashlib.blake2b(values.tobytes(), digest_size = 16).hexdigest())
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                self.invalidate()
+            self._fingerprint = fingerprint
+
+    def _key(self, name : str, df, params) -> tuple:
+        rows = (len(df), df.index[0], df.index[-1]) if len(df) > 0 else (0,)
+        return (self.version, name, rows, params)
+
+    def get(self, name : str, df, params):
+        """Get a cached intermediate result.
+
+        Args:
+            name: name of the intermediate, e.g. the function computing it
+            df: the table the result was computed from
+            params: hashable parameters the result depends on
+
+        Returns:
+            The cached result, or None if it isn't in the cache
+        """
+        return self._store.get(self._key(name, df, params), None)
+
+    def put(self, name : str, df, params, value) -> None:
+        """Add an intermediate result to the cache. See `get` for the arguments."""
+        self._store[self._key(name, df, params)] = value
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getstate__(self):
+        #Cached results are not saved with the dataset
+        return {'version': self.version, '_store': {}, '_fingerprint': None}
+
+class DiskFeatureCache(object):
+    def __init__(self, path : str, max_size : int = 2**30):
+        """On-disk store of computed features, one entry per video, shared across sessions.
+
+        Entries are content-addressed: the key is a hash of the video's input columns (the raw tracks and 
+        the feature maker's required columns), the feature creation function's name, the feature maker's 
+        `version`, the behaveml version and the keyword arguments. Features computed again from the same 
+        tracks and arguments are loaded instead, and changing a video's tracks only changes its own key. 
+        
+        Each entry is saved as a .npy file, with its column names in a .json file of the same name. There is 
+        no shared index, so several processes can use the same cache: files are written to a temporary name 
+        and then renamed. The modification time of the .npy file records when the entry was last used, and 
+        when the entries take more than `max_size` bytes, the least recently used ones are deleted. The size 
+        of the entries is kept as a running total, and the directory is only scanned when it goes over 
+        `max_size` (entries other processes add are counted at the next scan).
+
+        Args:
+            path: directory to store the cache in. Created if it doesn't exist
+            max_size: Default 2**30 (1 GB). Maximum size of the cached features, in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok = True)
+        #The cache may have been made with a larger max_size. Also counts the size of the entries
+        self._evict()
+
+    def _entry_fn(self, key : str) -> str:
+        return os.path.join(self.path, f'{key}.npy')
+
+    def _columns_fn(self, key : str) -> str:
+        return os.path.join(self.path, f'{key}.json')
+
+    def _keys(self) -> list:
+        return [fn[:-len('.npy')] for fn in os.listdir(self.path) if fn.endswith('.npy')]
+
+    def _touch(self, key : str) -> None:
+        """Mark an entry as used now"""
+        now = time.time()
+        os.utime(self._entry_fn(key), (now, now))
+
+    def _remove(self, key : str) -> None:
+        #Another process may have removed it already
+        for fn in [self._entry_fn(key), self._columns_fn(key)]:
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+
+    def key(self, features, data : pd.DataFrame, kwargs : dict) -> str:
+        """Key of the features a feature maker makes from the rows of one video.
+
+        Args:
+            features: the Features object
+            data: the input columns of the video
+            kwargs: the keyword arguments passed onto the feature creation function
+
+        Returns:
+            Hex digest identifying the entry
+        """
+        from behaveml import __version__
+        cols = [c for c in data.columns if c != 'filename']
+        h = hashlib.sha256()
+        function = features.feature_maker
+        h.update(repr((getattr(function, '__module__', None), getattr(function, '__qualname__', repr(function)), 
+                       getattr(features, 'version', None), __version__)).encode())
+        h.update(repr(sorted({**features.kwargs, **kwargs}.items())).encode())
+        h.update(repr(cols).encode())
+        h.update(np.ascontiguousarray(data[cols].to_numpy(dtype = float)).tobytes())
+        return h.hexdigest()
+
+    def get(self, key : str, index : pd.Index):
+        """Load cached features.
+
+        Args:
+            key: the entry's key, see `key`
+            index: the index of the video's rows in the dataset
+
+        Returns:
+            DataFrame of features, or None if they aren't in the cache
+        """
+        try:
+            with open(self._columns_fn(key), 'r') as file:
+                columns = json.load(file)
+            values = np.load(self._entry_fn(key))
+            self._touch(key)
+        except FileNotFoundError:
+            return None
+        if len(values) != len(index):
+            return None
+        return pd.DataFrame(values, index = index, columns = columns)
+
+    def put(self, key : str, features : pd.DataFrame) -> None:
+        """Save the features of a video, then evict the least recently used entries if the cache is too big.
+
+        Features that aren't all numeric are not cached.
+        """
+        values = features.to_numpy()
+        if values.dtype == object:
+            return
+        #Written to temporary files first, so readers never see a partly written entry
+        tmp = f'.{os.getpid()}.tmp'
+        with open(self._columns_fn(key) + tmp, 'w') as file:
+            json.dump([str(c) for c in features.columns], file)
+        with open(self._entry_fn(key) + tmp, 'wb') as file:
+            np.save(file, values, allow_pickle = False)
+        size = os.path.getsize(self._entry_fn(key) + tmp)
+        try:
+            size -= os.path.getsize(self._entry_fn(key))
+        except FileNotFoundError:
+            pass
+        os.replace(self._columns_fn(key) + tmp, self._columns_fn(key))
+        os.replace(self._entry_fn(key) + tmp, self._entry_fn(key))
+        self._touch(key)
+        self._size += size
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in max_size"""
+        entries = []
+        for key in self._keys():
+            try:
+                stat = os.stat(self._entry_fn(key))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            total -= size
+            self._remove(key)
+        self._size = total
+
+    def clear(self) -> None:
+        """Delete all entries"""
+        for key in self._keys():
+            self._remove(key)
+        self._size = 0
+
+    def __len__(self):
+        return len(self._keys())
+
 class Features(object):
-    def __init__(self, feature_maker : Callable, required_columns : list, **kwargs):
+    def __init__(self, feature_maker : Callable, required_columns : list, context = None, version = None, 
+                 fill_missing = False, **kwargs):
         """Feature creation object. This houses the feature creation function and the columns that are required to compute the features. Performs some checks on data to make sure has these columns.
 
         See docstring for the `features` model for more information.
@@ -64,37 +289,316 @@ class Features(object):
         Args:
             feature_maker: The function that will be used to compute the features.
             required_columns: The columns that are required to compute the features.
+            context: Default None. Number of past and future frames each row of features depends on, as a tuple, 
+                or a function of the feature maker's keyword arguments returning the tuple. Needed to stream 
+                the features, see `stream`. None if the features can't be streamed.
+            version: Default None. Version of the feature creation function. Change it when the function 
+                changes, so that features saved in a DiskFeatureCache aren't reused.
+            fill_missing: Default False. Whether the feature creation function fills missing values with the 
+                column means, and takes an `impute` keyword argument to turn this off. Features computed one 
+                video at a time are then filled with the means over all videos, as if computed at once.
         """
         self.required_columns = required_columns
         self.feature_maker = feature_maker
+        self.context = context
+        self.version = version
+        self.fill_missing = fill_missing
         self.kwargs = kwargs
 
-    def make(self, vdf, **kwargs):
+    def context_size(self, **kwargs) -> tuple:
+        """Number of past and future frames each row of features depends on.
+
+        Args:
+            **kwargs: Extra arguments passed onto the feature creation function.
+
+        Returns:
+            Tuple (past frames, future frames)
+        """
+        context = getattr(self, 'context', None)
+        if context is None:
+            raise RuntimeError("This feature maker doesn't declare its context, so its features can't be streamed.")
+        if callable(context):
+            context = context(**self.kwargs, **kwargs)
+        return tuple(context)
+
+    def stream(self, animal_setup : dict, means = None, **kwargs):
+        """Make the features from a stream of frames, e.g. from a real-time pose estimator. See `FeatureStream`.
+
+        Args:
+            animal_setup: Dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
+            means: Default None. Series with the mean of each feature, to fill missing values with. If None, 
+                the running means of the emitted rows.
+            **kwargs: Extra arguments passed onto the feature creation function.
+
+        Returns:
+            A FeatureStream
+        """
+        return FeatureStream(self, animal_setup, means = means, **kwargs)
+
+    def make(self, vdf, n_jobs : int = 1, backend : str = 'loky', **kwargs):
         """Make the features. This is called internally by the dataset object when running `add_features`.
 
         Args:
             vdf: The VideosetDataFrame to compute the features on.
+            n_jobs: Default 1. If not 1, the features of each video are computed separately, by this many worker 
+                processes. -1 uses all cores. 
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1. 
+            **kwargs: Extra arguments passed onto the feature creation function.
+        """
+        #Only take the needed columns, without building the full table
+        data = vdf._select(self._input_columns(vdf._columns(), vdf.animal_setup))
+        disk_cache = getattr(vdf, 'disk_cache', None)
+        if disk_cache is not None:
+            return self.make_cached(data, vdf.animal_setup, disk_cache, n_jobs = n_jobs, backend = backend, **kwargs)
+        if n_jobs != 1:
+            return self.make_per_video(data, vdf.animal_setup, n_jobs = n_jobs, backend = backend, **kwargs)
+        cache = getattr(vdf, 'feature_cache', None)
+        if cache is not None:
+            cache.check_tracks(data[vdf.raw_track_columns])
+            kwargs = {**kwargs, 'cache': cache}
+        return self.make_from_data(data, vdf.animal_setup, **kwargs)
+
+    def _input_columns(self, columns : list, animal_setup : dict) -> list:
+        """The columns needed by the feature creation function: the required columns, the raw tracks and the 
+        'time', 'frame' and 'filename' columns. Previously computed features aren't passed on."""
+        cols = list(self.required_columns) + [c for c in animal_setup['colnames'] if c not in self.required_columns]
+        cols += [c for c in ['time', 'frame', 'filename'] if c not in cols]
+        columns = set(columns)
+        return [c for c in cols if c in columns]
+
+    def _project(self, data, animal_setup : dict):
+        """Only the columns of the table needed by the feature creation function"""
+        if len(data.columns) == 0:
+            return data
+        cols = self._input_columns(data.columns, animal_setup)
+        if len(cols) == len(data.columns):
+            return data
+        return data[cols]
+
+    def make_from_data(self, data, animal_setup : dict, **kwargs):
+        """Make the features from a data table directly, e.g. the rows of a single video.
+
+        Args:
+            data: The DataFrame to compute the features on.
+            animal_setup: Dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
             **kwargs: Extra arguments passed onto the feature creation function.
         """
         #Validate columns:
-        checks = [col in self.required_columns for col in vdf.data.columns]
+        checks = [col in self.required_columns for col in data.columns]
         if sum(checks) < len(self.required_columns):
             raise RuntimeError("VideosetDataFrame doesn't have necessary columns to compute this set of features.")
-        if vdf.data[self.required_columns].isnull().values.any():
+        if data[self.required_columns].isnull().values.any():
             warnings.warn("Missing values in required data columns. May result in unexpected behavior. Consider interpolating or imputing missing data first.")
-        new_features = self.feature_maker(vdf.data, self.required_columns, vdf.animal_setup, **self.kwargs, **kwargs)
+        data = self._project(data, animal_setup)
+        new_features = self.feature_maker(data, self.required_columns, animal_setup, **self.kwargs, **kwargs)
+        columns = kwargs.get('columns', None)
+        if columns is not None:
+            missing = [c for c in columns if c not in new_features.columns]
+            if len(missing) > 0:
+                raise ValueError(f"Columns not made by this feature maker: {missing}")
+            new_features = new_features[[c for c in new_features.columns if c in set(columns)]]
+        return new_features
+
+    def make_columns(self, vdf, columns : list, **kwargs):
+        """Make only some of the features, computing only what they depend on where the feature creation 
+        function supports it.
+
+        Args:
+            vdf: The VideosetDataFrame to compute the features on.
+            columns: Names of the features to make, without the featureset name prefix.
+            **kwargs: Extra arguments passed onto `make`.
+
+        Returns:
+            DataFrame with the requested features, in the order the feature creation function makes them
+        """
+        return self.make(vdf, columns = list(columns), **kwargs)
+
+    def make_per_video(self, data, animal_setup : dict, n_jobs : int = -1, backend : str = 'loky', **kwargs):
+        """Make the features of each video separately, in a pool of worker processes.
+
+        The table is split into the contiguous rows of each video (by `filename`), and the blocks of features 
+        are put back together in the original row order. The default loky backend keeps its workers alive 
+        between calls, so the package is only imported once per worker. 
+        
+        For feature makers that fill missing values with the column means (see `fill_missing`), the videos' 
+        features are filled after they are put back together, with the means over all videos. Intermediate 
+        results aren't shared through the dataset's FeatureCache.
+
+        Args:
+            data: The DataFrame to compute the features on.
+            animal_setup: Dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
+            n_jobs: Default -1. Number of worker processes. -1 uses all cores.
+            backend: Default 'loky'. joblib backend.
+            **kwargs: Extra arguments passed onto the feature creation function.
+        """
+        if 'filename' not in data.columns:
+            raise RuntimeError("Data needs a 'filename' column to compute features per video.")
+        offsets = segment_offsets(data['filename'])
+        if len(offsets) <= 2:
+            return self.make_from_data(data, animal_setup, **kwargs)
+        blocks = Parallel(n_jobs = n_jobs, backend = backend)(
+            delayed(self.make_from_data)(data.iloc[start:end], animal_setup, **self._video_kwargs(kwargs)) 
+            for start, end in zip(offsets[:-1], offsets[1:]))
+        return self._fill_missing(pd.concat(blocks, axis = 0), kwargs)
+
+    def _video_kwargs(self, kwargs : dict) -> dict:
+        """Arguments for computing the features of one video: missing values are filled once all videos are done"""
+        if self.fill_missing:
+            return {**kwargs, 'impute': False}
+        return kwargs
+
+    def _fill_missing(self, features, kwargs : dict):
+        """Fill the missing values of features computed one video at a time, unless `impute = False` was passed"""
+        if self.fill_missing and kwargs.get('impute', True):
+            return fill_missing_with_means(features)
+        return features
+
+    def make_cached(self, data, animal_setup : dict, disk_cache : DiskFeatureCache, n_jobs : int = 1, 
+                    backend : str = 'loky', **kwargs):
+        """Make the features of each video separately, loading those already in a DiskFeatureCache.
+
+        Only the videos whose features aren't in the cache are computed, and their features are then saved 
+        to it. As in `make_per_video`, missing values are filled once all videos are put back together, so 
+        the cached features are the ones before filling.
+
+        Args:
+            data: The DataFrame to compute the features on.
+            animal_setup: Dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
+            disk_cache: The DiskFeatureCache.
+            n_jobs: Default 1. Number of worker processes computing the videos not in the cache. -1 uses all cores.
+            backend: Default 'loky'. joblib backend.
+            **kwargs: Extra arguments passed onto the feature creation function.
+        """
+        if 'filename' not in data.columns:
+            raise RuntimeError("Data needs a 'filename' column to compute features per video.")
+        offsets = segment_offsets(data['filename'])
+        videos = [data.iloc[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        video_kwargs = self._video_kwargs(kwargs)
+        keys = [disk_cache.key(self, self._project(video, animal_setup), video_kwargs) for video in videos]
+        blocks = [disk_cache.get(key, video.index) for key, video in zip(keys, videos)]
+        missing = [idx for idx, block in enumerate(blocks) if block is None]
+        if n_jobs == 1 or len(missing) <= 1:
+            computed = (self.make_from_data(videos[idx], animal_setup, **video_kwargs) for idx in missing)
+        else:
+            computed = parallel_imap(partial(self.make_from_data, animal_setup = animal_setup, **video_kwargs), 
+                                     (videos[idx] for idx in missing), n_jobs = n_jobs, backend = backend)
+        for idx, block in zip(missing, computed):
+            disk_cache.put(keys[idx], block)
+            blocks[idx] = block
+        return self._fill_missing(pd.concat(blocks, axis = 0), kwargs)
+
+class FeatureStream(object):
+    def __init__(self, features : Features, animal_setup : dict, means = None, **kwargs):
+        """Make features from a stream of frames, a chunk at a time.
+
+        Only the last frames needed to compute the next rows are kept, in a buffer of past + future frames, 
+        where (past, future) is the feature maker's context (see `Features.context_size`). Each row is emitted 
+        as soon as its future frames have arrived, so rows are delayed by at most `latency` frames, and each 
+        chunk costs the same whatever the length of the stream. 
+
+        Emitted rows are the same as computing the features on the whole recording at once, except where 
+        values are missing. Feature makers that fill missing values with the column means (see 
+        `Features.fill_missing`) use the means over the whole recording, which aren't known until it ends. 
+        The stream fills them with the given `means` instead, e.g. those of the training data, or else with 
+        the means over the rows emitted so far, kept across `reset`.
+
+        Args:
+            features: the Features object
+            animal_setup: Dictionary with keys `bodypart_ids`, `mouse_ids`, `colnames`.
+            means: Default None. Series with the mean of each feature, to fill missing values with. If None, 
+                the running means of the emitted rows.
+            **kwargs: Extra arguments passed onto the feature creation function.
+        """
+        self.features = features
+        self.animal_setup = animal_setup
+        self.means = means
+        self.impute = features.fill_missing and kwargs.get('impute', True)
+        self.kwargs = features._video_kwargs(kwargs)
+        self.past, self.future = features.context_size(**kwargs)
+        self._sums = 0
+        self._counts = 0
+        self.reset()
+
+    @property
+    def latency(self) -> int:
+        """Number of frames each row of features is emitted after its frame arrives"""
+        return self.future
+
+    def reset(self) -> None:
+        """Start a new stream, e.g. a new video"""
+        self._buffer = None
+        self._pending = 0
+        self._n_frames = 0
+
+    def _compute(self, frames):
+        """Features of the frames in the buffer and the new chunk"""
+        return self.features.make_from_data(frames, self.animal_setup, **self.kwargs)
+
+    def _fill_missing(self, new_features):
+        """Fill the missing values of the emitted rows with the given or the running means"""
+        if not self.impute:
+            return new_features
+        means = self.means
+        if means is None:
+            self._sums = new_features.sum() + self._sums
+            self._counts = new_features.count() + self._counts
+            means = self._sums/self._counts
+        return fill_missing_with_means(new_features, means)
+
+    def push(self, chunk) -> pd.DataFrame:
+        """Add a chunk of frames to the stream.
+
+        Args:
+            chunk: DataFrame with the next frames: the raw track columns, and the 'time' and 'frame' columns if 
+                the feature maker uses them
+
+        Returns:
+            DataFrame with the rows of features that could be computed, indexed by position in the stream. 
+            None if none could be computed yet.
+        """
+        chunk = chunk.set_axis(pd.RangeIndex(self._n_frames, self._n_frames + len(chunk)), axis = 0)
+        self._n_frames += len(chunk)
+        frames = chunk if self._buffer is None else pd.concat([self._buffer, chunk], axis = 0)
+        #Rows are emitted once their future frames have all arrived
+        first = len(frames) - len(chunk) - self._pending
+        last = max(first, len(frames) - self.future)
+        new_features = self._fill_missing(self._compute(frames).iloc[first:last]) if last > first else None
+        self._pending = len(frames) - last
+        #Keep the frames not yet emitted, and the past frames they depend on
+        n_keep = self.past + self._pending
+        self._buffer = frames.iloc[len(frames) - n_keep:] if n_keep < len(frames) else frames
+        return new_features
+
+    def flush(self) -> pd.DataFrame:
+        """End the stream, and emit the remaining rows, as the end of the recording. 
+
+        Returns:
+            DataFrame with the remaining rows of features, or None if there are none
+        """
+        if self._buffer is None or self._pending == 0:
+            self.reset()
+            return None
+        new_features = self._fill_missing(self._compute(self._buffer).iloc[-self._pending:])
+        self.reset()
         return new_features
 
 ## MARS features
-mars_feature_maker = Features(compute_mars_features, default_tracking_columns)
-marsreduced_feature_maker = Features(compute_mars_reduced_features, default_tracking_columns)
+mars_feature_maker = Features(compute_mars_features, default_tracking_columns, context = MARS_CONTEXT, 
+                              fill_missing = True)
+marsreduced_feature_maker = Features(compute_mars_reduced_features, default_tracking_columns, context = MARS_REDUCED_CONTEXT, 
+                                     fill_missing = True)
 cnn_probability_feature_maker = Features(compute_dl_probability_features, default_tracking_columns)
-social_feature_maker = Features(compute_social_features, default_tracking_columns)
+social_feature_maker = Features(compute_social_features, default_tracking_columns, context = SOCIAL_CONTEXT, 
+                                fill_missing = True)
+#Several sets of the above at once, e.g. `feature_sets = ['mars_reduced', 'social']`, sharing their intermediates
+feature_sets_maker = Features(compute_feature_sets, default_tracking_columns, context = feature_sets_context, 
+                              fill_missing = True)
 
 ## Generic features -- don't need any specific column names. Will be based on the animal setup.
-com_interanimal_feature_maker = Features(compute_centerofmass_interanimal_distances, [])
-com_interanimal_speed_feature_maker = Features(compute_centerofmass_interanimal_speed, [])
-com_feature_maker = Features(compute_centerofmass, [])
-com_velocity_feature_maker = Features(compute_centerofmass_velocity, [])
-speed_feature_maker = Features(compute_speed_features, [])
-distance_feature_maker = Features(compute_distance_features, [])
\ No newline at end of file
+com_interanimal_feature_maker = Features(compute_centerofmass_interanimal_distances, [], context = (0, 0))
+com_interanimal_speed_feature_maker = Features(compute_centerofmass_interanimal_speed, [], 
+                                               context = centerofmass_interanimal_speed_context)
+com_feature_maker = Features(compute_centerofmass, [], context = (0, 0))
+com_velocity_feature_maker = Features(compute_centerofmass_velocity, [], context = differences_context)
+speed_feature_maker = Features(compute_speed_features, [], context = differences_context)
+distance_feature_maker = Features(compute_distance_features, [], context = (0, 0))
\ No newline at end of file
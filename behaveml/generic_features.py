@@ -3,31 +3,77 @@
 import pandas as pd
 import numpy as np
 
+from behaveml.utils import diff_within_segments, video_offsets
+
 # TODO
 # * More generic feature creation functions, for general models, not just MARS featureset
 #   - [ ] Intra-animal angles (of all body parts)
 
 ############################
 
-def _diff_within_group(df, sort_key, diff_col, **kwargs):
-    return df.groupby(sort_key)[diff_col].transform(lambda x: x.diff(**kwargs)) 
+def _track_tensor_columns(mouse_ids : list, bodypart_ids : list) -> list:
+    """Raw track columns, ordered by animal, body part then x/y"""
+    return ['_'.join([m, c, bp]) for m in mouse_ids for bp in bodypart_ids for c in ['x', 'y']]
 
-def compute_centerofmass_interanimal_distances(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
+def _track_tensor(df : pd.DataFrame, mouse_ids : list, bodypart_ids : list) -> np.ndarray:
+    """Gather the raw tracks into an array of shape (frame, animal, body part, x/y)"""
+    cols = _track_tensor_columns(mouse_ids, bodypart_ids)
+    return df[cols].to_numpy().reshape((len(df), len(mouse_ids), len(bodypart_ids), 2))
 
-    bodypart_ids = animal_setup['bodypart_ids']
-    mouse_ids = animal_setup['mouse_ids']
+def _pair_indices(mouse_ids : list, bodypart_ids : list, feature_name : str) -> tuple:
+    """Index arrays and column names for all intra- and inter-animal body part pairs
+
+    Intra-animal pairs are taken over the upper triangle of body parts, inter-animal pairs over all 
+    combinations of body parts, for each pair of animals (animal_i, animal_j), j < i.
 
-    features_df = df.copy()
+    Args:
+        mouse_ids: list of animal names
+        bodypart_ids: list of body part names
+        feature_name: name placed in the column names, e.g. 'distance'
 
+    Returns:
+        Tuple (animal_1, bodypart_1, animal_2, bodypart_2, column names), where the first four are 
+        integer arrays indexing into the animal and body part axes of the track tensor
+    """
+    a1, b1, a2, b2, col_names = [], [], [], [], []
+    for i, bp1 in enumerate(bodypart_ids):
+        for j, bp2 in enumerate(bodypart_ids):
+            if i < j:
+                for m, mouse_id in enumerate(mouse_ids):
+                    a1.append(m); b1.append(i); a2.append(m); b2.append(j)
+                    col_names.append('_'.join([mouse_id, feature_name, bp1, bp2]))
+            for animal_i in range(len(mouse_ids)):
+                for animal_j in range(animal_i):
+                    a1.append(animal_i); b1.append(i); a2.append(animal_j); b2.append(j)
+                    col_names.append('_'.join([f'M{animal_i}_M{animal_j}', feature_name, bp1, bp2]))
+    return np.array(a1, dtype = int), np.array(b1, dtype = int), np.array(a2, dtype = int), np.array(b2, dtype = int), col_names
+
+def _centerofmass(df : pd.DataFrame, mouse_ids : list, bodypart_ids : list, cache = None) -> pd.DataFrame:
+    """Center of mass of each animal, in columns <animal>_COM_x and <animal>_COM_y. Taken from the cache if there"""
+    params = (tuple(mouse_ids), tuple(bodypart_ids))
+    if cache is not None:
+        com = cache.get('centerofmass', df, params)
+        if com is not None:
+            return com
+
+    com = pd.DataFrame(index = df.index)
     for animal_id in mouse_ids:
         fxs = ['_'.join([animal_id, 'x', bp]) for bp in bodypart_ids]
         fys = ['_'.join([animal_id, 'y', bp]) for bp in bodypart_ids]
-        fx_new = '_'.join([animal_id, 'COM_x'])
-        fy_new = '_'.join([animal_id, 'COM_y'])
-        features_df[fx_new] = features_df[fxs].sum(axis = 1) / len(bodypart_ids)
-        features_df[fy_new] = features_df[fys].sum(axis = 1) / len(bodypart_ids)
+        com['_'.join([animal_id, 'COM_x'])] = df[fxs].sum(axis = 1) / len(bodypart_ids)
+        com['_'.join([animal_id, 'COM_y'])] = df[fys].sum(axis = 1) / len(bodypart_ids)
 
-    orig_cols = features_df.columns
+    if cache is not None:
+        cache.put('centerofmass', df, params, com)
+    return com
+
+def compute_centerofmass_interanimal_distances(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
+
+    bodypart_ids = animal_setup['bodypart_ids']
+    mouse_ids = animal_setup['mouse_ids']
+
+    com = _centerofmass(df, mouse_ids, bodypart_ids, kwargs.get('cache', None))
+    features_df = pd.DataFrame(index = df.index)
 
     for i, animal_i in enumerate(mouse_ids):
         fx_i = '_'.join([animal_i, 'COM_x'])
@@ -36,10 +82,9 @@ def compute_centerofmass_interanimal_distances(df : pd.DataFrame, raw_col_names
             fx_j = '_'.join([animal_j, 'COM_x'])
             fy_j = '_'.join([animal_j, 'COM_y'])
             f_new = '_'.join([animal_i, animal_j, 'COM_distance'])
-            features_df[f_new] = np.sqrt((features_df[fx_i] - features_df[fx_j])**2 \
-                                         + (features_df[fy_i] - features_df[fy_j])**2)
+            features_df[f_new] = np.sqrt((com[fx_i] - com[fx_j])**2 \
+                                         + (com[fy_i] - com[fy_j])**2)
 
-    features_df = features_df.drop(columns = orig_cols)
     return features_df
 
 def compute_centerofmass_interanimal_speed(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, n_shifts = 5, **kwargs) -> pd.DataFrame:
@@ -47,21 +92,15 @@ def compute_centerofmass_interanimal_speed(df : pd.DataFrame, raw_col_names : li
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
 
-    features_df = df.copy()
+    offsets = video_offsets(df)
+    dt = diff_within_segments(df['time'].to_numpy(dtype = float), n_shifts, offsets)
 
-    dt = features_df['time'].diff(periods = n_shifts)
+    com = _centerofmass(df, mouse_ids, bodypart_ids, kwargs.get('cache', None))
+    com_vel = pd.DataFrame(index = df.index)
+    for col in com.columns:
+        com_vel[col] = diff_within_segments(com[col].to_numpy(), n_shifts, offsets)/dt
 
-    for animal_id in mouse_ids:
-        fxs = ['_'.join([animal_id, 'x', bp]) for bp in bodypart_ids]
-        fys = ['_'.join([animal_id, 'y', bp]) for bp in bodypart_ids]
-        fx_new = '_'.join([animal_id, 'COM_x'])
-        fy_new = '_'.join([animal_id, 'COM_y'])
-        features_df[fx_new] = features_df[fxs].sum(axis = 1) / len(bodypart_ids)
-        features_df[fy_new] = features_df[fys].sum(axis = 1) / len(bodypart_ids)
-        features_df[fx_new] = _diff_within_group(features_df, 'filename', fx_new, periods = n_shifts)/dt
-        features_df[fy_new] = _diff_within_group(features_df, 'filename', fy_new, periods = n_shifts)/dt
-
-    orig_cols = features_df.columns
+    features_df = pd.DataFrame(index = df.index)
 
     for i, animal_i in enumerate(mouse_ids):
         fx_i = '_'.join([animal_i, 'COM_x'])
@@ -71,14 +110,13 @@ def compute_centerofmass_interanimal_speed(df : pd.DataFrame, raw_col_names : li
             fy_j = '_'.join([animal_j, 'COM_y'])
             f_new = '_'.join([animal_i, animal_j, 'COM_speed'])
 
-            vx_i = _diff_within_group(features_df, 'filename', fx_i, periods = n_shifts)/dt
-            vy_i = _diff_within_group(features_df, 'filename', fy_i, periods = n_shifts)/dt
-            vx_j = _diff_within_group(features_df, 'filename', fx_j, periods = n_shifts)/dt
-            vy_j = _diff_within_group(features_df, 'filename', fy_j, periods = n_shifts)/dt
+            vx_i = diff_within_segments(com_vel[fx_i].to_numpy(), n_shifts, offsets)/dt
+            vy_i = diff_within_segments(com_vel[fy_i].to_numpy(), n_shifts, offsets)/dt
+            vx_j = diff_within_segments(com_vel[fx_j].to_numpy(), n_shifts, offsets)/dt
+            vy_j = diff_within_segments(com_vel[fy_j].to_numpy(), n_shifts, offsets)/dt
 
             features_df[f_new] = np.sqrt((vx_i - vx_j)**2 + (vy_i - vy_j)**2)
 
-    features_df = features_df.drop(columns = orig_cols)
     return features_df
 
 def compute_centerofmass(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, bodyparts : list = [], **kwargs) -> pd.DataFrame:
@@ -92,18 +130,7 @@ def compute_centerofmass(df : pd.DataFrame, raw_col_names : list, animal_setup :
 
     mouse_ids = animal_setup['mouse_ids']
 
-    features_df = df.copy()
-    orig_cols = df.columns
-
-    for animal_id in mouse_ids:
-        fxs = ['_'.join([animal_id, 'x', bp]) for bp in bodypart_ids]
-        fys = ['_'.join([animal_id, 'y', bp]) for bp in bodypart_ids]
-        fx_new = '_'.join([animal_id, 'COM_x'])
-        fy_new = '_'.join([animal_id, 'COM_y'])
-        features_df[fx_new] = features_df[fxs].sum(axis = 1) / len(bodypart_ids)
-        features_df[fy_new] = features_df[fys].sum(axis = 1) / len(bodypart_ids)
-
-    features_df = features_df.drop(columns = orig_cols)
+    features_df = _centerofmass(df, mouse_ids, bodypart_ids, kwargs.get('cache', None)).copy()
     return features_df
 
 # def compute_centerofmass(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
@@ -138,22 +165,18 @@ def compute_centerofmass_velocity(df : pd.DataFrame, raw_col_names : list, anima
 
     mouse_ids = animal_setup['mouse_ids']
 
-    features_df = df.copy()
-    orig_cols = df.columns
+    offsets = video_offsets(df)
+    dt = diff_within_segments(df['time'].to_numpy(dtype = float), n_shifts, offsets)
 
-    dt = features_df['time'].diff(periods = n_shifts)
+    com = _centerofmass(df, mouse_ids, bodypart_ids, kwargs.get('cache', None))
+    features_df = pd.DataFrame(index = df.index)
 
     for animal_id in mouse_ids:
-        fxs = ['_'.join([animal_id, 'x', bp]) for bp in bodypart_ids]
-        fys = ['_'.join([animal_id, 'y', bp]) for bp in bodypart_ids]
         fx_new = '_'.join([animal_id, 'COM_vel_x'])
         fy_new = '_'.join([animal_id, 'COM_vel_y'])
-        features_df[fx_new] = features_df[fxs].sum(axis = 1) / len(bodypart_ids)
-        features_df[fy_new] = features_df[fys].sum(axis = 1) / len(bodypart_ids)
-        features_df[fx_new] = _diff_within_group(features_df, 'filename', fx_new, periods = n_shifts)/dt
-        features_df[fy_new] = _diff_within_group(features_df, 'filename', fy_new, periods = n_shifts)/dt
+        features_df[fx_new] = diff_within_segments(com['_'.join([animal_id, 'COM_x'])].to_numpy(), n_shifts, offsets)/dt
+        features_df[fy_new] = diff_within_segments(com['_'.join([animal_id, 'COM_y'])].to_numpy(), n_shifts, offsets)/dt
 
-    features_df = features_df.drop(columns = orig_cols)
     return features_df
 
 
@@ -162,47 +185,22 @@ def compute_speed_features(df : pd.DataFrame, raw_col_names : list, animal_setup
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
 
-    features_df = df.copy()
-    orig_cols = df.columns
+    offsets = video_offsets(df)
+    dt = diff_within_segments(df['time'].to_numpy(dtype = float), n_shifts, offsets)
 
-    dt = features_df['time'].diff(periods = n_shifts)
+    #Velocity of each body part, computed once and within each video
+    cols = _track_tensor_columns(mouse_ids, bodypart_ids)
+    vel = diff_within_segments(df[cols].to_numpy(), n_shifts, offsets)
+    vel = (vel / dt[:,None]).reshape((len(df), len(mouse_ids), len(bodypart_ids), 2))
 
-    ##Make the distance features
-    for i, bp1 in enumerate(bodypart_ids):
-        for j, bp2 in enumerate(bodypart_ids):
-            if i < j:
-                for mouse_id in mouse_ids:
-                    #We can compute the intra-mouse difference
-                    f1x = '_'.join([mouse_id, 'x', bp1])
-                    f2x = '_'.join([mouse_id, 'x', bp2])
-                    f1y = '_'.join([mouse_id, 'y', bp1])
-                    f2y = '_'.join([mouse_id, 'y', bp2])
-                    f_new = '_'.join([mouse_id, 'speed', bp1, bp2])
-
-                    vx1 = _diff_within_group(features_df, 'filename', f1x, periods = n_shifts)/dt
-                    vy1 = _diff_within_group(features_df, 'filename', f1y, periods = n_shifts)/dt
-                    vx2 = _diff_within_group(features_df, 'filename', f2x, periods = n_shifts)/dt
-                    vy2 = _diff_within_group(features_df, 'filename', f2y, periods = n_shifts)/dt
-                    features_df[f_new] = np.sqrt((vx1 - vx2)**2 + (vy1 - vy2)**2)
-
-            #Inter-mouse difference
-            for animal_i in range(len(mouse_ids)):
-                for animal_j in range(animal_i):
-                    f1x = '_'.join([mouse_ids[animal_i], 'x', bp1])
-                    f2x = '_'.join([mouse_ids[animal_j], 'x', bp2])
-                    f1y = '_'.join([mouse_ids[animal_i], 'y', bp1])
-                    f2y = '_'.join([mouse_ids[animal_j], 'y', bp2])
-                    f_new = '_'.join([f'M{animal_i}_M{animal_j}', 'speed', bp1, bp2])
+    a1, b1, a2, b2, col_names = _pair_indices(mouse_ids, bodypart_ids, 'speed')
 
-                    vx1 = _diff_within_group(features_df, 'filename', f1x, periods = n_shifts)/dt
-                    vy1 = _diff_within_group(features_df, 'filename', f1y, periods = n_shifts)/dt
-                    vx2 = _diff_within_group(features_df, 'filename', f2x, periods = n_shifts)/dt
-                    vy2 = _diff_within_group(features_df, 'filename', f2y, periods = n_shifts)/dt
-                    features_df[f_new] = np.sqrt((vx1 - vx2)**2 + (vy1 - vy2)**2)
-
-    #Remove base features
-    features_df = features_df.drop(columns = orig_cols)
+    ##Make the relative speed features, all pairs at once
+    speeds = (vel[:,a1,b1,0] - vel[:,a2,b2,0])**2
+    speeds += (vel[:,a1,b1,1] - vel[:,a2,b2,1])**2
+    np.sqrt(speeds, out = speeds)
 
+    features_df = pd.DataFrame(speeds, index = df.index, columns = col_names)
     return features_df
 
 def compute_distance_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
@@ -210,37 +208,22 @@ def compute_distance_features(df : pd.DataFrame, raw_col_names : list, animal_se
     bodypart_ids = animal_setup['bodypart_ids']
     mouse_ids = animal_setup['mouse_ids']
 
-    features_df = df.copy()
-    orig_cols = df.columns
+    tracks = _track_tensor(df, mouse_ids, bodypart_ids)
+    a1, b1, a2, b2, col_names = _pair_indices(mouse_ids, bodypart_ids, 'distance')
 
-    ##Make the distance features
-    for i, bp1 in enumerate(bodypart_ids):
-        for j, bp2 in enumerate(bodypart_ids):
-            if i < j:
-                for mouse_id in mouse_ids:
-                    #We can compute the intra-mouse difference
-                    f1x = '_'.join([mouse_id, 'x', bp1])
-                    f2x = '_'.join([mouse_id, 'x', bp2])
-                    f1y = '_'.join([mouse_id, 'y', bp1])
-                    f2y = '_'.join([mouse_id, 'y', bp2])
-                    f_new = '_'.join([mouse_id, 'distance', bp1, bp2])
-                    features_df[f_new] = \
-                        np.sqrt((features_df[f1x] - features_df[f2x])**2 + 
-                                (features_df[f1y] - features_df[f2y])**2)
-
-            #Inter-mouse difference
-            for animal_i in range(len(mouse_ids)):
-                for animal_j in range(animal_i):
-                    f1x = '_'.join([mouse_ids[animal_i], 'x', bp1])
-                    f2x = '_'.join([mouse_ids[animal_j], 'x', bp2])
-                    f1y = '_'.join([mouse_ids[animal_i], 'y', bp1])
-                    f2y = '_'.join([mouse_ids[animal_j], 'y', bp2])
-                    f_new = '_'.join([f'M{animal_i}_M{animal_j}', 'distance', bp1, bp2])
-                    features_df[f_new] = \
-                                np.sqrt((features_df[f1x] - features_df[f2x])**2 + 
-                                        (features_df[f1y] - features_df[f2y])**2)
-
-    #Remove base features
-    features_df = features_df.drop(columns = orig_cols)
-
-    return features_df
\ No newline at end of file
+    ##Make the distance features, all pairs at once
+    dists = (tracks[:,a1,b1,0] - tracks[:,a2,b2,0])**2
+    dists += (tracks[:,a1,b1,1] - tracks[:,a2,b2,1])**2
+    np.sqrt(dists, out = dists)
+
+    features_df = pd.DataFrame(dists, index = df.index, columns = col_names)
+    return features_df
+
+#Number of past and future frames each row of the features above depends on, for streaming
+def differences_context(n_shifts = 5, **kwargs) -> tuple:
+    """Context of features made from differences over n_shifts frames (speeds, velocities)"""
+    return (n_shifts, 0)
+
+def centerofmass_interanimal_speed_context(n_shifts = 5, **kwargs) -> tuple:
+    """Context of compute_centerofmass_interanimal_speed, made from differences of differences"""
+    return (2*n_shifts, 0)
@@ -1,6 +1,7 @@
 import pandas as pd 
 import numpy as np
-from behaveml.video import VideosetDataFrame
+from behaveml.video import VideosetDataFrame, MemmapVideosetDataFrame
+from behaveml.utils import segment_offsets, rolling_mean_within_segments
 
 def interpolate_lowconf_points(vdf : VideosetDataFrame,
                                conf_threshold : float = 0.9,
@@ -20,38 +21,50 @@ def interpolate_lowconf_points(vdf : VideosetDataFrame,
         Pandas dataframe with the filtered raw columns. Returns None if opted for in_place modification
     """
 
-    df_filtered = []
+    if isinstance(vdf, MemmapVideosetDataFrame):
+        raise RuntimeError("Interpolating the tracks is not supported on memory-mapped datasets. Interpolate "
+                           "before saving the dataset with `save_memmap`.")
 
-    for fn_in in vdf.videos:
-        print("processing", fn_in)
+    #Only the table holding the tracks is needed, the feature blocks are left alone
+    table = vdf._table()
+    cols = list(vdf.raw_track_columns)
+    track_dtypes = table[cols].dtypes.to_dict()
+    values = table[cols].to_numpy(dtype = float)
 
-        if not in_place:
-            df_filter_low_conf = vdf.data.loc[vdf.data.filename == fn_in].copy()
-        else:
-            df_filter_low_conf = vdf.data
-        
-        for m in vdf.animals:
-            for bp in vdf.body_parts:
-                low_conf = df_filter_low_conf.loc[vdf.data.filename == fn_in, '_'.join(['likelihood', m, bp])] < conf_threshold
-                df_filter_low_conf.loc[(vdf.data.filename == fn_in) & low_conf,'_'.join([m, 'x', bp])] = np.nan
-                df_filter_low_conf.loc[(vdf.data.filename == fn_in) & low_conf,'_'.join([m, 'y', bp])] = np.nan
-                
-        df_filter_low_conf.loc[(vdf.data.filename == fn_in)] = \
-            df_filter_low_conf.loc[(vdf.data.filename == fn_in)].\
-            interpolate(axis = 0, method = 'linear', limit_direction = 'both')            
+    #Mask the low confidence points of all videos at once. The likelihoods are the (frame, animal, body part) 
+    #tensor, with the animal and body part axes flattened
+    parts = [(m, bp) for m in vdf.animals for bp in vdf.body_parts if '_'.join(['likelihood', m, bp]) in table.columns]
+    if len(parts) > 0:
+        likelihood = table[['_'.join(['likelihood', m, bp]) for m, bp in parts]].to_numpy(dtype = float)
+        low_conf = likelihood < conf_threshold
+        for coord in ['x', 'y']:
+            pos = [cols.index('_'.join([m, coord, bp])) for m, bp in parts]
+            values[:, pos] = np.where(low_conf, np.nan, values[:, pos])
 
-        if rolling_window:
-            df_filter_low_conf.loc[(vdf.data.filename == fn_in), vdf.raw_track_columns] = \
-                df_filter_low_conf.loc[(vdf.data.filename == fn_in), vdf.raw_track_columns].rolling(window = window_size, min_periods = 1).mean()
-            
-        df_filter_low_conf = df_filter_low_conf[vdf.raw_track_columns + ['filename', 'frame']]
-        df_filtered.append(df_filter_low_conf)
+    #Interpolate each video's contiguous rows
+    offsets = segment_offsets(table['filename'])
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        video = pd.DataFrame(values[start:end], columns = cols)
+        values[start:end] = video.interpolate(axis = 0, method = 'linear', limit_direction = 'both').to_numpy()
+    #Smooth all videos at once, without windows extending across videos
+    if rolling_window:
+        values = rolling_mean_within_segments(values, window_size, offsets)
 
-    df_filtered = pd.concat(df_filtered, axis = 0)
+    df_filtered = pd.DataFrame(values, index = table.index, columns = cols).astype(track_dtypes)
 
     if not in_place:
-        return df_filtered
+        return pd.concat([df_filtered, table[['filename', 'frame']]], axis = 1)
     else:
+        for col in cols:
+            table[col] = df_filtered[col]
+        #Features computed from the old tracks can't be reused
+        if hasattr(vdf, 'feature_cache'):
+            vdf.feature_cache.invalidate()
+        #Record the step, so it can be replayed on videos added later
+        if hasattr(vdf, 'history'):
+            vdf.history.append({'step': 'interpolate_lowconf_points', 
+                                'kwargs': {'conf_threshold': conf_threshold, 'rolling_window': rolling_window, 
+                                           'window_size': window_size}})
         return None
 
 #TODO
@@ -7,9 +7,24 @@ from joblib import dump, load
 import os
 from glob import glob
 import warnings
+import csv
+
+def _pandas_version() -> tuple:
+    return tuple(int(v) for v in pd.__version__.split('.')[:2] if v.isdigit())
+
+#Optional: multithreaded csv reading, and Parquet storage of datasets
+try:
+    import pyarrow
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+#read_csv has a pyarrow engine from pandas 1.4
+_CSV_ENGINE = 'pyarrow' if has_pyarrow and _pandas_version() >= (1, 4) else 'c'
 
 XY_IDS = ['x', 'y']
 XYLIKELIHOOD_IDS = ['x', 'y', 'likelihood']
+H5_EXTENSIONS = ['.h5', '.hdf5', '.hdf']
 
 def uniquifier(seq):
     """Return a sequence (e.g. list) with unique elements only, but maintaining original list order"""
@@ -45,69 +60,108 @@ def load_sklearn_model(fn_in):
     model = load(fn_in)
     return model 
 
-def read_DLC_tracks(fn_in : str, 
-                    part_renamer : dict = None, 
-                    animal_renamer : dict = None,
-                    read_likelihoods : bool = True) -> tuple:
-    """Read in tracks from DLC.
+def _is_h5(fn_in : str) -> bool:
+    return os.path.splitext(fn_in)[1].lower() in H5_EXTENSIONS
+
+def _sniff_dlc_header(fn_in : str) -> list:
+    """Read the header rows of a DLC csv file in a single pass.
+
+    Multi-animal projects have four header rows (scorer, individuals, bodyparts, coords), 
+    single-animal projects have three (scorer, bodyparts, coords).
 
     Args:
         fn_in: csv file that has DLC tracks
-        part_renamer: dictionary to rename body parts, if needed 
-        animal_renamer: dictionary to rename animals, if needed
-        read_likelihoods: default True. Whether to attach DLC likelihoods to table
 
     Returns:
-        Pandas DataFrame with (n_animals*2*n_body_parts) columns plus with filename and frame, 
-            List of body parts,
-            List of animals,
-            Columns names for DLC tracks (excluding likelihoods, if read in),
-            Scorer
+        List of header rows, each a list of strings (including the index column)
     """
+    with open(fn_in, newline = '') as handle:
+        reader = csv.reader(handle)
+        header = [next(reader) for _ in range(3)]
+        if header[1][0] == 'individuals':
+            header.append(next(reader))
+    return header
 
-    df = pd.read_csv(fn_in, header = [0,1,2,3], index_col = 0)
-
-    if 'individuals' in df.columns.names:
-        df.columns = df.columns.set_names(['scorer', 'individuals', 'bodyparts', 'coords'])
-        multi_animal = True
-    else:
-        df = pd.read_csv(fn_in, header = [0,1,2], index_col = 0)
-        df.columns = df.columns.set_names(['scorer', 'bodyparts', 'coords'])
-        multi_animal = False
+def _read_dlc_csv_body(fn_in : str, n_header_rows : int, n_columns : int, dtype = np.float64) -> np.ndarray:
+    """Bulk load the numeric block of a DLC csv file, skipping the header rows and index column.
 
-    scorer = df.columns.get_level_values(0)[0]
+    Uses the multithreaded pyarrow csv engine if it is installed and pandas supports it (pandas >= 1.4), 
+    otherwise pandas' C engine. The index column isn't parsed, as it may hold e.g. image paths.
 
-    cols = list(df.columns)
+    Args:
+        fn_in: csv file that has DLC tracks
+        n_header_rows: number of header rows to skip
+        n_columns: number of columns, including the index column
+        dtype: default np.float64. Floating point type of the returned array
 
-    if multi_animal:
-        animals = uniquifier([i[1] for i in cols])
-        body_parts = uniquifier([i[2] for i in cols])
+    Returns:
+        Numpy array of shape (n_frames, n_columns - 1), excluding the index column
+    """
+    usecols = list(range(1, n_columns))
+    try:
+        body = pd.read_csv(fn_in, skiprows = n_header_rows, header = None, usecols = usecols, dtype = dtype, 
+                           engine = _CSV_ENGINE)
+    except ValueError:
+        if _CSV_ENGINE == 'c':
+            raise
+        #Options the installed pyarrow engine doesn't support
+        body = pd.read_csv(fn_in, skiprows = n_header_rows, header = None, usecols = usecols, dtype = dtype, 
+                           engine = 'c')
+    return body.to_numpy()
+
+def _dlc_csv_labels(header : list) -> tuple:
+    """Scorer, animals and body parts from the header rows of a DLC csv file"""
+    scorer = header[0][1]
+    if len(header) == 4:
+        animals = uniquifier(header[1][1:])
+        body_parts = uniquifier(header[2][1:])
     else:
         animals = ['ind1']
-        body_parts = uniquifier([i[1] for i in cols])
+        body_parts = uniquifier(header[1][1:])
+    return scorer, animals, body_parts
+
+def _dlc_h5_labels(cols : pd.MultiIndex) -> tuple:
+    """Scorer, animals and body parts from the column index of a DLC h5 file"""
+    scorer = cols.get_level_values('scorer')[0]
+    if 'individuals' in cols.names:
+        animals = uniquifier(cols.get_level_values('individuals'))
+    else:
+        animals = ['ind1']
+    body_parts = uniquifier(cols.get_level_values('bodyparts'))
+    return scorer, animals, body_parts
 
-    n_body_parts = len(body_parts)
-    n_animals = len(animals)
+def _read_dlc_csv(fn_in : str, dtype = np.float64) -> tuple:
+    """Read the numeric block and column labels of a DLC csv file.
 
-    dlc_tracks = np.array(df)
-    n_rows = dlc_tracks.shape[0]
-    selected_cols = [[3*i, 3*i+1] for i in range(n_body_parts*n_animals)]
-    #This line flattens the array here... may be clearer using numpy reshape?
-    selected_cols = [j for i in selected_cols for j in i]
+    Args:
+        fn_in: csv file that has DLC tracks
+        dtype: default np.float64. Floating point type of the returned array
 
-    prob_cols = [3*i+2 for i in range(n_body_parts*n_animals)]
-    dlc_probs = dlc_tracks[:,prob_cols]
-    dlc_tracks = dlc_tracks[:,selected_cols]
+    Returns:
+        Numpy array of shape (n_frames, n_columns), scorer, list of animals, list of body parts
+    """
+    header = _sniff_dlc_header(fn_in)
+    scorer, animals, body_parts = _dlc_csv_labels(header)
+    dlc_data = _read_dlc_csv_body(fn_in, len(header), len(header[0]), dtype)
+    return dlc_data, scorer, animals, body_parts
 
-    #Put in shape:
-    # (frame, animal, x/y coord, body part)
-    dlc_tracks = dlc_tracks.reshape((n_rows, n_animals, n_body_parts, 2))
-    dlc_tracks = dlc_tracks.transpose([0, 1, 3, 2])
+def _read_dlc_h5(fn_in : str, dtype = np.float64) -> tuple:
+    """Read the numeric block and column labels of a DLC h5 file.
 
-    dlc_probs = dlc_probs.reshape((n_rows, n_animals, n_body_parts, 1))
-    dlc_probs = dlc_probs.transpose([0, 3, 1, 2])
+    Args:
+        fn_in: h5 file that has DLC tracks
+        dtype: default np.float64. Floating point type of the returned array
 
-    #If we're going to rename items in the list, do it here
+    Returns:
+        Numpy array of shape (n_frames, n_columns), scorer, list of animals, list of body parts
+    """
+    df = pd.read_hdf(fn_in)
+    scorer, animals, body_parts = _dlc_h5_labels(df.columns)
+    dlc_data = df.to_numpy(dtype = dtype)
+    return dlc_data, scorer, animals, body_parts
+
+def _rename_dlc_labels(animals, body_parts, part_renamer, animal_renamer):
+    """Rename animals and body parts, and make the track column names"""
     if part_renamer:
         body_parts = _list_replace(body_parts, part_renamer)
 
@@ -115,22 +169,135 @@ def read_DLC_tracks(fn_in : str,
         animals = _list_replace(animals, animal_renamer)
 
     colnames = ['_'.join(a) for a in product(animals, XY_IDS, body_parts)]
-    prob_colnames = ['_'.join(a) for a in product(['likelihood'], animals, body_parts)]
+    return animals, body_parts, colnames
+
+def _dlc_array_to_df(dlc_data : np.ndarray, animals : list, body_parts : list, 
+                     colnames : list, read_likelihoods : bool = True, start_frame : int = 0) -> pd.DataFrame:
+    """Rearrange the numeric block of a DLC file into the table layout used by VideosetDataFrame.
+
+    Args:
+        dlc_data: Numpy array of shape (n_frames, n_animals*n_body_parts*3), as stored in the DLC file
+        animals: list of (renamed) animals
+        body_parts: list of (renamed) body parts
+        colnames: track column names, product(animals, XY_IDS, body_parts)
+        read_likelihoods: default True. Whether to attach DLC likelihoods to table
+        start_frame: default 0. Frame number of the first row
 
-    dlc_probs = dlc_probs.reshape((n_rows, -1))
-    final_probs = pd.DataFrame(dlc_probs, columns = prob_colnames)
+    Returns:
+        Pandas DataFrame with track columns, likelihood columns (if read) and frame. Index is the frame number.
+    """
+    n_body_parts = len(body_parts)
+    n_animals = len(animals)
+    n_rows = dlc_data.shape[0]
+
+    #Put in shape:
+    # (frame, animal, body part, x/y/likelihood)
+    dlc_data = dlc_data.reshape((n_rows, n_animals, n_body_parts, 3))
 
-    dlc_tracks = dlc_tracks.reshape((n_rows, -1))
-    final_df = pd.DataFrame(dlc_tracks, columns = colnames)
+    #Then tracks in shape (frame, animal, x/y coord, body part), and likelihoods in (frame, animal, body part)
+    dlc_tracks = dlc_data[:,:,:,:2].transpose([0, 1, 3, 2]).reshape((n_rows, -1))
+    dlc_probs = dlc_data[:,:,:,2].reshape((n_rows, -1))
 
+    index = pd.RangeIndex(start_frame, start_frame + n_rows)
     if read_likelihoods:
-        final_df = pd.concat([final_df, final_probs], axis = 1)
+        prob_colnames = ['_'.join(a) for a in product(['likelihood'], animals, body_parts)]
+        final_df = pd.DataFrame(np.concatenate([dlc_tracks, dlc_probs], axis = 1), 
+                                columns = colnames + prob_colnames, index = index)
+    else:
+        final_df = pd.DataFrame(dlc_tracks, columns = colnames, index = index)
+    return final_df
+
+def read_DLC_tracks(fn_in : str, 
+                    part_renamer : dict = None, 
+                    animal_renamer : dict = None,
+                    read_likelihoods : bool = True,
+                    dtype = np.float64) -> tuple:
+    """Read in tracks from DLC.
+
+    Args:
+        fn_in: csv or h5 file that has DLC tracks. The format is chosen from the file extension
+        part_renamer: dictionary to rename body parts, if needed 
+        animal_renamer: dictionary to rename animals, if needed
+        read_likelihoods: default True. Whether to attach DLC likelihoods to table
+        dtype: default np.float64. Floating point type to store tracks and likelihoods as
+
+    Returns:
+        Pandas DataFrame with (n_animals*2*n_body_parts) columns plus with filename and frame, 
+            List of body parts,
+            List of animals,
+            Columns names for DLC tracks (excluding likelihoods, if read in),
+            Scorer
+    """
+
+    if _is_h5(fn_in):
+        dlc_data, scorer, animals, body_parts = _read_dlc_h5(fn_in, dtype)
+    else:
+        dlc_data, scorer, animals, body_parts = _read_dlc_csv(fn_in, dtype)
+
+    #If we're going to rename items in the list, do it here
+    animals, body_parts, colnames = _rename_dlc_labels(animals, body_parts, part_renamer, animal_renamer)
+
+    final_df = _dlc_array_to_df(dlc_data, animals, body_parts, colnames, read_likelihoods)
 
     final_df['filename'] = fn_in
     final_df['frame'] = final_df.index.copy()
 
     return final_df, body_parts, animals, colnames, scorer
 
+def iter_DLC_tracks(fn_in : str, 
+                    chunk_size : int = 100000,
+                    part_renamer : dict = None, 
+                    animal_renamer : dict = None,
+                    read_likelihoods : bool = True,
+                    dtype = np.float64):
+    """Read in tracks from DLC in chunks of frames, for recordings too long to hold in memory at once.
+
+    Each chunk has the same columns as the table returned by `read_DLC_tracks`. Frame numbers (and the index)
+    continue from one chunk to the next.
+
+    Args:
+        fn_in: csv or h5 file that has DLC tracks. The format is chosen from the file extension
+        chunk_size: default 100000. Number of frames per chunk
+        part_renamer: dictionary to rename body parts, if needed 
+        animal_renamer: dictionary to rename animals, if needed
+        read_likelihoods: default True. Whether to attach DLC likelihoods to table
+        dtype: default np.float64. Floating point type to store tracks and likelihoods as
+
+    Returns:
+        Generator of Pandas DataFrames, each with at most chunk_size rows
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+
+    def _make_chunk(dlc_data, start_frame):
+        chunk_df = _dlc_array_to_df(dlc_data, animals, body_parts, colnames, read_likelihoods, start_frame)
+        chunk_df['filename'] = fn_in
+        chunk_df['frame'] = chunk_df.index.copy()
+        return chunk_df
+
+    if _is_h5(fn_in):
+        with pd.HDFStore(fn_in, mode = 'r') as store:
+            key = store.keys()[0]
+            _, animals, body_parts = _dlc_h5_labels(store.select(key, start = 0, stop = 0).columns)
+            animals, body_parts, colnames = _rename_dlc_labels(animals, body_parts, part_renamer, animal_renamer)
+            start_frame = 0
+            while True:
+                chunk = store.select(key, start = start_frame, stop = start_frame + chunk_size)
+                if len(chunk) == 0:
+                    break
+                yield _make_chunk(chunk.to_numpy(dtype = dtype), start_frame)
+                start_frame += len(chunk)
+    else:
+        header = _sniff_dlc_header(fn_in)
+        _, animals, body_parts = _dlc_csv_labels(header)
+        animals, body_parts, colnames = _rename_dlc_labels(animals, body_parts, part_renamer, animal_renamer)
+        start_frame = 0
+        reader = pd.read_csv(fn_in, skiprows = len(header), header = None, dtype = dtype, chunksize = chunk_size)
+        with reader:
+            for chunk in reader:
+                yield _make_chunk(chunk.to_numpy()[:,1:], start_frame)
+                start_frame += len(chunk)
+
 def rename_df_cols(df : pd.DataFrame, renamer : dict) -> pd.DataFrame:
     """Rename dataframe columns 
     
@@ -212,7 +379,36 @@ def get_sample_data():
         b = pickle.load(handle)
     return b['dataset']
 
-def read_boris_annotation(fn_in : str, fps : int, duration : float, behav_labels : dict = None) -> tuple:
+def read_boris_events(fn_in : str) -> pd.DataFrame:
+    """Read the table of behavior events from a BORIS exported csv file.
+
+    Args:
+        fn_in: The filename with BORIS behavior annotations to load
+
+    Returns:
+        Pandas DataFrame with one row per START/STOP event
+    """
+    return pd.read_csv(fn_in, skiprows = 15)
+
+def _paint_intervals(ground_truth : np.ndarray, starts : np.ndarray, ends : np.ndarray, value) -> None:
+    """Set ground_truth[start:end] = value for all (start, end) pairs, without a Python loop over the pairs.
+
+    Each interval adds +1 at its start and -1 at its end in a difference array. Frames with a positive 
+    cumulative sum are covered by at least one interval.
+    """
+    n_bins = len(ground_truth)
+    starts = np.clip(starts, 0, n_bins)
+    ends = np.clip(ends, 0, n_bins)
+    valid = ends > starts
+    if not valid.any():
+        return
+    counts = np.zeros(n_bins + 1, dtype = np.int64)
+    np.add.at(counts, starts[valid], 1)
+    np.add.at(counts, ends[valid], -1)
+    ground_truth[np.cumsum(counts[:-1]) > 0] = value
+
+def read_boris_annotation(fn_in : str, fps : int, duration : float, behav_labels : dict = None, 
+                          events : pd.DataFrame = None) -> tuple:
     """Read behavior annotation from BORIS exported csv file. 
 
     This will import behavior types specified (or all types, if behavior_list is None) and assign a numerical label to each. Overlapping annotations (those occurring simulataneously) are not supported. Any time the video is annotated as being in multiple states, the last state will be the one labeled.
@@ -222,13 +418,14 @@ def read_boris_annotation(fn_in : str, fps : int, duration : float, behav_labels
         fps: The frames per second of the video
         duration: The duration of the video in seconds
         behav_labels: If provided, only import behaviors with these names. Default = None = import everything. 
+        events: If provided, the already parsed events table (from `read_boris_events`), and fn_in is not read again. 
     
     Returns:
         A numpy array which indicates, for all frames, which behavior is occuring. 0 = no behavior, 1 and above are the labels of the behaviors.
         A dictionary with keys the numerical labels and values the names of the behaviors. 
     """
 
-    boris_labels = pd.read_csv(fn_in, skiprows = 15)
+    boris_labels = events if events is not None else read_boris_events(fn_in)
     if len(boris_labels) == 0:
         print("No data found in BORIS file,", fn_in)
         return np.array([]), {}
@@ -246,16 +443,19 @@ def read_boris_annotation(fn_in : str, fps : int, duration : float, behav_labels
         behaviors = boris_labels['Behavior'].unique()
         behav_labels = {i+1:k for i,k in enumerate(behaviors)}
 
-    for behav_idx, behavior in behav_labels.items():
-        labels = boris_labels[boris_labels['Behavior'] == behavior]
-        starts = labels.loc[labels['Status'] == 'START', 'Time']
-        ends = labels.loc[labels['Status'] == 'STOP', 'Time']
+    behavior = boris_labels['Behavior'].to_numpy()
+    status = boris_labels['Status'].to_numpy()
+    times = boris_labels['Time'].to_numpy()
+    for behav_idx, behavior_name in behav_labels.items():
+        is_behavior = behavior == behavior_name
+        starts = times[is_behavior & (status == 'START')]
+        ends = times[is_behavior & (status == 'STOP')]
         if len(ends) > len(starts)+1:
-            raise ValueError(f"Too many {behavior} behaviors started and not stopped.")
-        elif len(ends) == len(starts) + 1:
-            ends.append(duration)
-        for start, end in zip(starts, ends):
-            ground_truth[int(start*fps):int(end*fps)] = behav_idx
+            raise ValueError(f"Too many {behavior_name} behaviors started and not stopped.")
+        n_pairs = min(len(starts), len(ends))
+        starts = (starts[:n_pairs]*fps).astype(int)
+        ends = (ends[:n_pairs]*fps).astype(int)
+        _paint_intervals(ground_truth, starts, ends, behav_idx)
 
     return ground_truth, behav_labels
 
@@ -263,14 +463,14 @@ def create_behavior_labels(boris_files):
     """Create behavior labels from BORIS exported csv files.
     
     Args:
-        boris_files: List of BORIS exported csv files
+        boris_files: List of BORIS exported csv files, or of their already parsed events tables (from `read_boris_events`)
         
     Returns:
         A dictionary with keys the numerical labels and values the names of the behaviors.
     """
     behaviors = set()
     for fn in boris_files:
-        boris_labels = pd.read_csv(fn, skiprows = 15)
+        boris_labels = fn if isinstance(fn, pd.DataFrame) else read_boris_events(fn)
         behaviors = behaviors | set(boris_labels['Behavior'].unique())
     behavior_labels = {i+1:k for i,k in enumerate(behaviors)}
-    return behavior_labels
\ No newline at end of file
+    return behavior_labels
@@ -1,24 +1,50 @@
 import pandas as pd 
 from behaveml.dl.feature_engineering import make_features_mars_distr, make_features_social, \
                                             make_features_distances, make_features_velocities, \
-                                            make_features_mars_reduced
+                                            make_features_mars_reduced, make_feature_sets, feature_set_context
+from behaveml.utils import video_offsets
+
+#Number of past and future frames each row of features depends on, for streaming
+MARS_CONTEXT = feature_set_context('mars', n_shifts = 3, mode = 'distr')
+MARS_REDUCED_CONTEXT = feature_set_context('mars_reduced', n_shifts = 2, mode = 'diff')
+SOCIAL_CONTEXT = feature_set_context('social', n_shifts = 3, mode = 'shift')
+
+def feature_sets_context(feature_sets = ('mars_reduced', 'social'), n_shifts = 3, mode = 'shift', **kwargs) -> tuple:
+    contexts = [feature_set_context(name, n_shifts = n_shifts, mode = mode) for name in feature_sets]
+    return tuple(max(c[i] for c in contexts) for i in range(2))
 
 def compute_mars_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
-    features_df = make_features_mars_distr(df[raw_col_names], animal_setup) 
+    features_df = make_features_mars_distr(df[raw_col_names], animal_setup, offsets = video_offsets(df), 
+                                           cache = kwargs.get('cache', None), columns = kwargs.get('columns', None), 
+                                           impute = kwargs.get('impute', True))
     return features_df
 
 def compute_distance_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
-    features_df = make_features_distances(df[raw_col_names], animal_setup) 
+    features_df = make_features_distances(df[raw_col_names], animal_setup)
     return features_df
 
 def compute_mars_reduced_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
-    features_df = make_features_mars_reduced(df[raw_col_names], animal_setup) 
+    features_df = make_features_mars_reduced(df[raw_col_names], animal_setup, offsets = video_offsets(df), 
+                                             cache = kwargs.get('cache', None), columns = kwargs.get('columns', None), 
+                                             impute = kwargs.get('impute', True))
     return features_df
 
 def compute_social_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
-    features_df = make_features_social(df[raw_col_names], animal_setup) 
+    features_df = make_features_social(df[raw_col_names], animal_setup, offsets = video_offsets(df), 
+                                       cache = kwargs.get('cache', None), columns = kwargs.get('columns', None), 
+                                       impute = kwargs.get('impute', True))
     return features_df
 
 def compute_velocity_features(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, **kwargs) -> pd.DataFrame:
-    features_df = make_features_velocities(df[raw_col_names], animal_setup) 
+    features_df = make_features_velocities(df[raw_col_names], animal_setup, offsets = video_offsets(df))
     return features_df
+
+def compute_feature_sets(df : pd.DataFrame, raw_col_names : list, animal_setup : dict, 
+                         feature_sets = ('mars_reduced', 'social'), n_shifts = 3, mode = 'shift', **kwargs) -> pd.DataFrame:
+    """Several feature sets of the feature graph, with the nodes they share computed once. Columns in more 
+    than one set are only returned once."""
+    tables = make_feature_sets(df[raw_col_names], animal_setup, list(feature_sets), n_shifts = n_shifts, mode = mode, 
+                               offsets = video_offsets(df), cache = kwargs.get('cache', None), 
+                               columns = kwargs.get('columns', None), impute = kwargs.get('impute', True))
+    features_df = pd.concat(list(tables.values()), axis = 1)
+    return features_df.loc[:,~features_df.columns.duplicated()]
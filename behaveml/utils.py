@@ -1,5 +1,7 @@
 """Small helper utilities"""
 
+import numpy as np
+
 #TODO
 # Make ffmpeg support windows friendly
 
@@ -21,4 +23,219 @@ def checkFFMPEG() -> bool:
     except Exception:
         pass
 
-    return False 
\ No newline at end of file
+    return False 
+
+
+def segment_offsets(groups) -> np.ndarray:
+    """Offsets of the contiguous segments (e.g. videos) of a table
+
+    Args:
+        groups: array-like with the group (e.g. filename) of each row
+
+    Returns:
+        Integer array [0, end of segment 1, end of segment 2, ..., n_rows]. Rows offsets[i] to offsets[i+1]
+            form segment i
+    """
+    groups = np.asarray(groups)
+    starts = np.flatnonzero(groups[1:] != groups[:-1]) + 1
+    return np.concatenate([[0], starts, [len(groups)]]).astype(int)
+
+def _segment_positions(n_rows : int, offsets : np.ndarray) -> tuple:
+    """Position of each row from the start and from the end of its segment"""
+    if offsets is None:
+        offsets = np.array([0, n_rows])
+    lengths = np.diff(offsets)
+    rows = np.arange(n_rows)
+    from_start = rows - np.repeat(offsets[:-1], lengths)
+    to_end = np.repeat(offsets[1:], lengths) - rows
+    return from_start, to_end
+
+def shift_within_segments(data : np.ndarray, periods : int, offsets : np.ndarray = None) -> np.ndarray:
+    """Shift the columns of an array, without moving values between segments
+
+    Same as pandas' shift, but applied to all columns at once and separately within each segment 
+    (e.g. video). Entries shifted in from outside a segment are NaN.
+
+    Args:
+        data: array of shape (n_rows,) or (n_rows, n_cols)
+        periods: number of rows to shift by. Can be negative
+        offsets: segment offsets, as returned by `segment_offsets`. If None, the whole array is one segment
+
+    Returns:
+        Shifted array, same shape as data
+    """
+    data = np.asarray(data)
+    dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    out = np.full(data.shape, np.nan, dtype = dtype)
+    n_rows = data.shape[0]
+    if abs(periods) >= n_rows:
+        return out
+    if periods > 0:
+        out[periods:] = data[:-periods]
+    elif periods < 0:
+        out[:periods] = data[-periods:]
+    else:
+        out[:] = data
+    from_start, to_end = _segment_positions(n_rows, offsets)
+    if periods > 0:
+        out[from_start < periods] = np.nan
+    elif periods < 0:
+        out[to_end <= -periods] = np.nan
+    return out
+
+def diff_within_segments(data : np.ndarray, periods : int = 1, offsets : np.ndarray = None) -> np.ndarray:
+    """Difference the columns of an array, without differencing across segments
+
+    Same as pandas' diff, but applied to all columns at once and separately within each segment (e.g. video).
+
+    Args:
+        data: array of shape (n_rows,) or (n_rows, n_cols)
+        periods: number of rows to difference over. Can be negative
+        offsets: segment offsets, as returned by `segment_offsets`. If None, the whole array is one segment
+
+    Returns:
+        Differenced array, same shape as data
+    """
+    data = np.asarray(data)
+    return data - shift_within_segments(data, periods, offsets)
+
+def rolling_mean_within_segments(data : np.ndarray, window : int, offsets : np.ndarray = None, 
+                                 min_periods : int = 1) -> np.ndarray:
+    """Trailing rolling mean of the columns of an array, with windows not extending across segments
+
+    Same as pandas' rolling(window, min_periods).mean(), applied to all columns at once and separately 
+    within each segment (e.g. video). NaNs are ignored.
+
+    Args:
+        data: array of shape (n_rows,) or (n_rows, n_cols)
+        window: size of the rolling window
+        offsets: segment offsets, as returned by `segment_offsets`. If None, the whole array is one segment
+        min_periods: default 1. Minimum number of non-NaN values in a window to give a value
+
+    Returns:
+        Rolling mean, same shape as data
+    """
+    data = np.asarray(data)
+    n_rows = data.shape[0]
+    present = ~np.isnan(data)
+    #Running sums with a leading zero row, so the sum of rows a to b-1 is cumulative[b] - cumulative[a]
+    total = np.zeros((n_rows + 1,) + data.shape[1:], dtype = np.float64)
+    np.cumsum(np.where(present, data, 0), axis = 0, out = total[1:])
+    count = np.zeros((n_rows + 1,) + data.shape[1:], dtype = np.int64)
+    np.cumsum(present, axis = 0, out = count[1:])
+    #Each window starts at most window - 1 rows back, and not before its segment starts
+    from_start, _ = _segment_positions(n_rows, offsets)
+    ends = np.arange(1, n_rows + 1)
+    starts = ends - 1 - np.minimum(window - 1, from_start)
+    total = total[ends] - total[starts]
+    count = count[ends] - count[starts]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        out = total / count
+    out[count < max(min_periods, 1)] = np.nan
+    return out.astype(data.dtype if data.dtype.kind == 'f' else np.float64)
+
+def video_offsets(df, key : str = 'filename') -> np.ndarray:
+    """Segment offsets of the videos in a table, or None if the table has no `key` column"""
+    if key not in df.columns:
+        return None
+    return segment_offsets(df[key])
+
+def _window_reduce(data : np.ndarray, length : int, ufunc) -> np.ndarray:
+    """Reduce every window of `length` consecutive rows with `ufunc` (np.minimum, np.maximum or np.add)
+
+    Uses the van Herk/Gil-Werman scheme: the rows are split into blocks of `length`, and the running 
+    reduction from the start and from the end of each block is computed. Every window is then covered by 
+    the end of one block and the start of the next, so each window takes one operation, whatever its length.
+
+    Returns:
+        Array with n_rows - length + 1 rows. Row i is the reduction over rows i to i + length - 1
+    """
+    n_rows = data.shape[0]
+    n_blocks = -(-n_rows // length)
+    padded = np.zeros((n_blocks*length,) + data.shape[1:], dtype = data.dtype)
+    padded[:n_rows] = data
+    blocks = padded.reshape((n_blocks, length) + data.shape[1:])
+    prefix = ufunc.accumulate(blocks, axis = 1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[:,::-1], axis = 1)[:,::-1].reshape(padded.shape)
+    n_windows = n_rows - length + 1
+    if ufunc is np.add:
+        #Windows that exactly match a block are covered by its prefix alone
+        out = suffix[:n_windows] + prefix[length-1:n_rows]
+        aligned = np.arange(n_windows) % length == 0
+        out[aligned] = prefix[length-1:n_rows][aligned]
+        return out
+    return ufunc(suffix[:n_windows], prefix[length-1:n_rows])
+
+def window_stats_within_segments(data : np.ndarray, half_widths : list, offsets : np.ndarray = None, 
+                                 max_cols : int = 64) -> dict:
+    """Min, max, std and mean over centered windows, without windows extending across segments
+
+    Same as stacking the shifts -w, ..., w of each column (see `shift_within_segments`) and reducing over 
+    the shifts with np.min, np.max, np.std and np.mean, but in O(n_rows) time and memory for each window 
+    size. Windows that extend past the ends of a segment, or contain a NaN, give NaN.
+
+    Args:
+        data: array of shape (n_rows, n_cols)
+        half_widths: the window sizes w, each window covers rows i-w to i+w
+        offsets: segment offsets, as returned by `segment_offsets`. If None, the whole array is one segment
+        max_cols: default 64. Number of columns processed at a time, to bound the memory used
+
+    Returns:
+        Dictionary with, for each w in half_widths, a tuple of arrays (min, max, std, mean), each the same 
+        shape as data
+    """
+    data = np.asarray(data)
+    dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    n_rows, n_cols = data.shape
+    from_start, to_end = _segment_positions(n_rows, offsets)
+    stats = {w:tuple(np.full(data.shape, np.nan, dtype = dtype) for _ in range(4)) for w in half_widths}
+    for start in range(0, n_cols, max_cols):
+        cols = slice(start, start + max_cols)
+        values = data[:,cols].astype(np.float64)
+        missing = np.isnan(values)
+        #Center the values, so the sums of squares don't lose precision
+        center = np.nanmean(values, axis = 0) if not missing.all() else np.zeros(values.shape[1])
+        center[np.isnan(center)] = 0
+        values = np.where(missing, 0, values - center)
+        for w in half_widths:
+            length = 2*w + 1
+            if length > n_rows:
+                continue
+            rows = slice(w, n_rows - w)
+            valid = (from_start[rows] >= w) & (to_end[rows] > w)
+            valid = valid[:,None] & (_window_reduce(missing.astype(np.int32), length, np.add) == 0)
+            mean = _window_reduce(values, length, np.add)/length
+            var = np.maximum(_window_reduce(values**2, length, np.add)/length - mean**2, 0)
+            w_min = _window_reduce(values, length, np.minimum)
+            w_max = _window_reduce(values, length, np.maximum)
+            #Constant windows have no spread, don't leave a rounding error there
+            var[w_min == w_max] = 0
+            for out, result in zip(stats[w], [w_min + center, w_max + center, np.sqrt(var), mean + center]):
+                out[rows, cols] = np.where(valid, result, np.nan)
+    return stats
+
+def parallel_imap(function, args, n_jobs : int = -1, backend : str = 'loky'):
+    """Apply a function to each item in a pool of worker processes, yielding the results in order.
+
+    Items are sent to the workers a batch of n_jobs at a time, so only one batch of results is held in 
+    memory. The workers are kept alive between batches.
+
+    Args:
+        function: function of one item
+        args: iterable of items
+        n_jobs: Default -1. Number of worker processes. -1 uses all cores.
+        backend: Default 'loky'. joblib backend.
+
+    Returns:
+        Generator of the results
+    """
+    from itertools import islice
+    from joblib import Parallel, delayed, effective_n_jobs
+    batch_size = effective_n_jobs(n_jobs)
+    args = iter(args)
+    with Parallel(n_jobs = n_jobs, backend = backend) as parallel:
+        while True:
+            batch = list(islice(args, batch_size))
+            if len(batch) == 0:
+                break
+            yield from parallel(delayed(function)(arg) for arg in batch)
@@ -21,12 +21,15 @@ import os
 import numpy as np
 import re
 from glob import glob
+from itertools import product
+from functools import partial
 from sklearn.model_selection import PredefinedSplit
+from joblib import Parallel, delayed
 
-from behaveml.features import Features
+from behaveml.features import Features, FeatureCache, DiskFeatureCache
 
-from behaveml.io import read_DLC_tracks, read_boris_annotation, uniquifier, create_behavior_labels
-from behaveml.utils import checkFFMPEG
+from behaveml.io import XYLIKELIHOOD_IDS, has_pyarrow, read_DLC_tracks, read_boris_annotation, read_boris_events, uniquifier, create_behavior_labels
+from behaveml.utils import checkFFMPEG, parallel_imap
 
 from behaveml.config import global_config
 
@@ -37,6 +40,10 @@ UNIT_DICT = {'mm':1, 'cm':10, 'm':1000, 'in':25.4, 'ft':304.8,
              'millimetres':1, 'centimetres':10, 'metres':1000,
              'millimetre':1, 'centimetre':10, 'metre':1000}
 
+PARQUET_SIDECAR = 'dataset.pkl'
+MEMMAP_SIDECAR = 'dataset.pkl'
+MEMMAP_TRACK_BLOCK = 'tracks'
+
 class MLDataFrame(object): # pragma: no cover
     """
     DataFrame useful for interfacing between pandas and sklearn. Stores a data
@@ -101,6 +108,29 @@ class MLDataFrame(object): # pragma: no cover
     def __repr__(self):
         return str(self.data)
 
+def _write_dlc_table(df : pd.DataFrame, fn_out : str, save_csv : bool = True, save_h5 : bool = False) -> None:
+    """Write a table in DLC format to csv and/or h5. fn_out is the path without extension."""
+    if save_csv:
+        df.to_csv(fn_out + '.csv')
+    if save_h5:
+        df.to_hdf(fn_out + '.h5', "df_with_missing", format = 'table', mode="w")
+
+def _range_indexed(df : pd.DataFrame) -> pd.DataFrame:
+    """The table with a default (0, ..., n-1) index. Only copies if the index needs resetting"""
+    if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        return df
+    return df.reset_index(drop = True)
+
+def _downcast_floats(df : pd.DataFrame) -> pd.DataFrame:
+    """Cast the float64 columns of a table to float32"""
+    float_cols = [col for col in df.columns if df[col].dtype == np.float64]
+    return df.astype({col:np.float32 for col in float_cols})
+
+def _strip_featureset_name(columns : list, featureset_name : str) -> list:
+    """Feature names without the 'featureset_name__' prefix added by add_features"""
+    prefix = str(featureset_name) + '__'
+    return [c[len(prefix):] if c.startswith(prefix) else c for c in columns]
+
 def _add_item_to_dict(tracking_files, metadata, k, item):
     for fn in tracking_files:
         metadata[fn][k] = item
@@ -148,19 +178,36 @@ class VideosetDataFrame(MLDataFrame):
     def __init__(self, metadata : dict, 
                        label_key : dict = None, 
                        part_renamer : dict = None,
-                       animal_renamer : dict = None):
+                       animal_renamer : dict = None,
+                       n_jobs : int = 1,
+                       backend : str = 'loky',
+                       compact_dtypes : bool = False):
         """Houses DLC tracking data and behavior annotations in pandas DataFrame for ML, along with relevant metadata, features and behavior annotation labels.
 
         Args:
-            metadata: Dictionary whose keys are DLC tracking csvs, and value is a dictionary of associated metadata
+            metadata: Dictionary whose keys are DLC tracking csvs (or h5 files), and value is a dictionary of associated metadata
                 for that video. Most easiest to create with 'clone_metadata'. 
                 Required keys are: ['fps']
             label_key: Default None. Dictionary whose keys are positive integers and values are behavior labels. If none, then this is inferred from the behavior annotation files provided.  
             part_renamer: Default None. Dictionary that can rename body parts from tracking files if needed (for feature creation, e.g.)
             animal_renamer: Default None. Dictionary that can rename animals from tracking files if needed
+            n_jobs: Default 1. Number of worker processes used to read tracking files. If 1, files are read serially. -1 uses all cores.
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1.
+            compact_dtypes: Default False. If True, store tracks and features as float32, 'filename' as a 
+                categorical, and 'frame' and labels as the smallest integer type that fits. Roughly halves memory use. 
+                'time' stays float64, as float32 can't resolve frame intervals in long recordings.
         """
 
         self.req_cols = ['fps']
+        self.compact_dtypes = compact_dtypes
+        self.part_renamer = part_renamer
+        self.animal_renamer = animal_renamer
+        #Processing steps applied to the dataset, replayed when new videos are added
+        self.history = []
+        #Intermediate results shared between feature makers
+        self.feature_cache = FeatureCache()
+        #Computed features saved across sessions, see use_disk_cache
+        self.disk_cache = None
 
         self.data = pd.DataFrame()
         self.label_key = label_key
@@ -170,9 +217,11 @@ class VideosetDataFrame(MLDataFrame):
             self.metadata = metadata
         else:
             raise ValueError("Metadata not properly formatted. See docstring.")
+        self.rescaled = should_rescale
     
         if len(metadata) > 0:
-            self._load_tracks(part_renamer, animal_renamer, rescale = should_rescale) 
+            self._load_tracks(part_renamer, animal_renamer, rescale = should_rescale, 
+                              n_jobs = n_jobs, backend = backend)
             self._load_labels(set_as_label = True)
         else:
             self.raw_track_columns = None
@@ -200,7 +249,7 @@ class VideosetDataFrame(MLDataFrame):
                     is_dlc_feature = True
                     break
             if is_dlc_feature:
-                self.data[col] = self.data[col]*self.data['scale_factor']
+                self.data[col] = (self.data[col]*self.data['scale_factor']).astype(self.data[col].dtype)
         self.data = self.data.drop(columns = 'scale_factor')
 
     def _setup_default_cv_folds(self):
@@ -266,9 +315,93 @@ class VideosetDataFrame(MLDataFrame):
     def n_videos(self):
         return len(self.metadata)
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """The full data table: tracks, labels and all computed features"""
+        self._table()
+        if len(self._feature_blocks) > 0:
+            self._merge_feature_blocks()
+        return self._data
+
+    @data.setter
+    def data(self, df : pd.DataFrame):
+        self._data = df
+        self._feature_blocks = {}
+        #Intermediates computed from the previous table can't be reused
+        if getattr(self, 'feature_cache', None) is not None:
+            self.feature_cache.invalidate()
+
     @property
     def group(self):
-        return self.data.filename.to_numpy()
+        return self._select('filename').to_numpy()
+
+    @property
+    def features(self):
+        if self.feature_cols is None:
+            return None
+        return self._select(self.feature_cols).to_numpy()
+
+    @property
+    def labels(self):
+        if self.label_cols is None:
+            return None
+        return self._select(self.label_cols).to_numpy()
+
+    def _table(self) -> pd.DataFrame:
+        """The data table, without the feature blocks not yet merged into it"""
+        if '_data' not in self.__dict__:
+            #Datasets saved by earlier versions keep the table under `data`
+            self._data = self.__dict__.pop('data', pd.DataFrame())
+        if '_feature_blocks' not in self.__dict__:
+            self._feature_blocks = {}
+        return self._data
+
+    def _columns(self) -> list:
+        """Names of all columns of the full table, without merging the feature blocks into it"""
+        cols = list(self._table().columns)
+        for block in self._feature_blocks.values():
+            cols += list(block.columns)
+        return cols
+
+    def _select(self, cols):
+        """Columns of the full table, taken from the table and the feature blocks without merging them.
+
+        Args:
+            cols: column name, or list of column names
+
+        Returns:
+            DataFrame with the columns, or Series if a single name is given
+        """
+        if type(cols) is str:
+            return self._select([cols])[cols]
+        table = self._table()
+        cols = list(cols)
+        in_table = [col for col in cols if col in table.columns]
+        if len(in_table) == len(cols):
+            return table[cols]
+        parts = [_range_indexed(table[in_table])]
+        for block in self._feature_blocks.values():
+            in_block = [col for col in cols if col in block.columns]
+            if len(in_block) > 0:
+                parts.append(block[in_block])
+        return pd.concat(parts, axis = 1, copy = False)[cols]
+
+    def _add_feature_block(self, featureset_name : str, new_features : pd.DataFrame) -> None:
+        """Store newly computed features as their own block, without touching the rest of the table"""
+        self._table()
+        block = str(featureset_name)
+        suffix = 1
+        while block in self._feature_blocks:
+            block = f'{featureset_name}_{suffix}'
+            suffix += 1
+        #Copying consolidates the columns into one contiguous array (per dtype)
+        self._feature_blocks[block] = _range_indexed(new_features).copy()
+
+    def _merge_feature_blocks(self) -> None:
+        """Merge the feature blocks into the data table, in one go and without copying the table"""
+        self._data = pd.concat([_range_indexed(self._data)] + list(self._feature_blocks.values()), 
+                               axis = 1, copy = False)
+        self._feature_blocks = {}
 
     def activate_features_by_name(self, name : str) -> list:
         """Add already present columns in data frame to the feature set. 
@@ -280,7 +413,7 @@ class VideosetDataFrame(MLDataFrame):
             List of matched columns (may include columns that were already activated).
         """
 
-        matched_cols = [l for l in self.data.columns if re.match(f"^{name}", l)]
+        matched_cols = [l for l in self._columns() if re.match(f"^{name}", l)]
         if self.feature_cols is not None:
             self.feature_cols = uniquifier(list(self.feature_cols) + list(matched_cols))
         else:
@@ -300,7 +433,7 @@ class VideosetDataFrame(MLDataFrame):
             compiled = re.compile(pattern)
         except re.error:
             raise ValueError("Couldn't parse re pattern.")
-        matched_cols = [l for l in self.data.columns if compiled.search(l) is not None]
+        matched_cols = [l for l in self._columns() if compiled.search(l) is not None]
         return matched_cols
 
     def remove_features_by_name(self, name : str) -> list:
@@ -317,9 +450,28 @@ class VideosetDataFrame(MLDataFrame):
         return removed_cols
 
     #Set features by individual or by group names
+    def use_disk_cache(self, path : str = None, max_size : int = 2**30) -> None:
+        """Save the features computed by `add_features` to disk, and load them instead of computing them again, 
+        e.g. when a notebook is re-run. 
+        
+        Features are saved per video, keyed on the video's tracks, the feature maker and its arguments. If only 
+        some videos' tracks changed, or videos were added, only their features are computed. With the cache 
+        on, features are always computed one video at a time, see `Features.make_per_video`. See 
+        `DiskFeatureCache`.
+
+        Args:
+            path: Default None. Directory to store the features in. If None, turns the cache off
+            max_size: Default 2**30 (1 GB). Maximum size of the cache, in bytes. The least recently used 
+                features are deleted to stay below it.
+        """
+        self.disk_cache = None if path is None else DiskFeatureCache(path, max_size = max_size)
+
     def add_features(self, feature_maker : Features, 
                            featureset_name : str, 
                            add_to_features = False, 
+                           n_jobs : int = 1,
+                           backend : str = 'loky',
+                           columns : list = None,
                            **kwargs) -> list:
         """Compute features to dataframe using Feature object. 'featureset_name' will be prepended to new columns, followed by a double underscore. 
 
@@ -327,10 +479,17 @@ class VideosetDataFrame(MLDataFrame):
             featuremaker: A Feature object that houses the feature-making function to be executed and a list of required columns that must in the dataframe for this to work
             featureset_name: Name to prepend to the added features 
             add_to_features: Whether to add to list of active features (i.e. will be returned by the .features property)
+            n_jobs: Default 1. If not 1, the features of each video are computed separately, by this many worker 
+                processes. -1 uses all cores. See `Features.make_per_video`.
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1.
+            columns: Default None. Names of the features to compute, with or without the 'featureset_name__' 
+                prefix. If None, all the features the feature maker makes are computed.
         Returns:
             List of new columns that are computed
         """
-        new_features = feature_maker.make(self, **kwargs)
+        if columns is not None:
+            kwargs['columns'] = _strip_featureset_name(columns, featureset_name)
+        new_features = feature_maker.make(self, n_jobs = n_jobs, backend = backend, **kwargs)
 
         #Prepend these column names w featureset-name__feature-name
         new_feat_cols = list(new_features.columns)
@@ -338,11 +497,20 @@ class VideosetDataFrame(MLDataFrame):
         new_features.columns = new_feat_cols
 
         #Don't add duplicated columns:
-        notdupcols = [col for col in new_feat_cols if col not in self.data.columns]
+        existing_cols = set(self._columns())
+        notdupcols = [col for col in new_feat_cols if col not in existing_cols]
         new_features = new_features[notdupcols]
-
-        self.data = pd.concat([self.data.reset_index(drop = True), 
-                               new_features.reset_index(drop = True)], axis = 1)
+        if getattr(self, 'compact_dtypes', False):
+            new_features = _downcast_floats(new_features)
+
+        #Only the new block is stored, the rest of the table is left as is
+        if len(notdupcols) > 0:
+            self._add_feature_block(featureset_name, new_features)
+        if not hasattr(self, 'history'):
+            self.history = []
+        self.history.append({'step': 'add_features', 'feature_maker': feature_maker, 
+                             'featureset_name': featureset_name, 'kwargs': kwargs, 
+                             'n_jobs': n_jobs, 'backend': backend})
         if add_to_features:
             if self.feature_cols is not None:
                 self.feature_cols = list(self.feature_cols) + list(new_features.columns)
@@ -350,6 +518,85 @@ class VideosetDataFrame(MLDataFrame):
                 self.feature_cols = new_features.columns
         return list(new_features.columns)
 
+    def add_videos(self, metadata : dict, n_jobs : int = 1, backend : str = 'loky') -> list:
+        """Add new videos to the dataset, without reloading or recomputing anything for the videos already in it.
+
+        Only the new tracking (and label) files are loaded. They must have the same animals and body parts 
+        as the existing dataset, and be rescaled (or not) in the same way. The processing steps already applied 
+        to the dataset (`interpolate_lowconf_points` run in place, and `add_features`, with their arguments) are 
+        then replayed, in order, on the new videos only, and their rows are appended to the table.
+
+        Statistics a feature maker computes over the whole table, e.g. the column means used to fill missing 
+        values in the MARS and social features, are computed over the new videos only. The appended rows are 
+        then the same as the new videos' rows in a dataset of only the new videos, which can differ from a 
+        dataset built with all the videos at once.
+
+        The new label files can only contain behaviors already in the dataset's `label_key`.
+
+        Args:
+            metadata: Dictionary whose keys are DLC tracking csvs (or h5 files), and value is a dictionary of 
+                associated metadata for that video, as in the constructor.
+            n_jobs: Default 1. Number of worker processes used to read tracking files.
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1.
+
+        Returns:
+            List of videos added
+        """
+        from behaveml.interpolation import interpolate_lowconf_points
+
+        duplicates = [vid for vid in metadata if vid in self.metadata]
+        if len(duplicates) > 0:
+            raise ValueError(f"Videos already in dataset: {', '.join(duplicates)}")
+        if len(metadata) == 0:
+            return []
+        if self.label_key:
+            #Otherwise behaviors only in the new files would be labelled 0
+            known = set(self.label_key.values())
+            unknown = set()
+            for vid in metadata:
+                if 'label_files' in metadata[vid]:
+                    unknown |= set(read_boris_events(metadata[vid]['label_files'])['Behavior'].unique()) - known
+            if len(unknown) > 0:
+                raise ValueError(f"Behaviors not in the dataset's label_key: {', '.join(sorted(unknown))}. Build "
+                                 "the dataset again, with a label_key that includes them.")
+
+        new_vdf = VideosetDataFrame(metadata, label_key = self.label_key, 
+                                    part_renamer = getattr(self, 'part_renamer', None),
+                                    animal_renamer = getattr(self, 'animal_renamer', None),
+                                    n_jobs = n_jobs, backend = backend,
+                                    compact_dtypes = getattr(self, 'compact_dtypes', False))
+
+        if self.raw_track_columns is not None:
+            if new_vdf.raw_track_columns != self.raw_track_columns or new_vdf.animal_setup != self.animal_setup:
+                raise RuntimeError("DLC files have different columns. Must all be from same project")
+            if new_vdf.rescaled != getattr(self, 'rescaled', False):
+                raise ValueError("New videos must be rescaled in the same way as the existing dataset. See docstring.")
+
+        for step in getattr(self, 'history', []):
+            if step['step'] == 'interpolate_lowconf_points':
+                interpolate_lowconf_points(new_vdf, **step['kwargs'])
+            elif step['step'] == 'add_features':
+                new_vdf.add_features(step['feature_maker'], step['featureset_name'], 
+                                     n_jobs = step.get('n_jobs', 1), backend = step.get('backend', 'loky'), 
+                                     **step['kwargs'])
+
+        if self.raw_track_columns is None:
+            self.body_parts = new_vdf.body_parts
+            self.animals = new_vdf.animals
+            self.animal_setup = new_vdf.animal_setup
+            self.raw_track_columns = new_vdf.raw_track_columns
+            self.rescaled = new_vdf.rescaled
+        if self.label_key is None and new_vdf.label_key:
+            self.label_key = new_vdf.label_key
+            self.reverse_label_key = new_vdf.reverse_label_key
+            self.label_cols = new_vdf.label_cols
+
+        self.data = pd.concat([self.data, new_vdf.data], axis = 0).reset_index(drop = True)
+        self.metadata.update(new_vdf.metadata)
+        if getattr(self, 'compact_dtypes', False):
+            self.data['filename'] = pd.Categorical(self.data['filename'], categories = self.videos)
+        return list(new_vdf.metadata.keys())
+
     def remove_feature_cols(self, col_names : list) -> list:
         """Remove provided columns from set of feature columns.
         
@@ -363,20 +610,27 @@ class VideosetDataFrame(MLDataFrame):
         self.feature_cols = new_col_names
         return removed
 
-    def _load_tracks(self, part_renamer, animal_renamer, rescale = False):
+    def _load_tracks(self, part_renamer, animal_renamer, rescale = False, n_jobs = 1, backend = 'loky'):
         #For the moment only supports DLC
-        return self._load_dlc_tracks(part_renamer, animal_renamer, rescale = rescale)
+        return self._load_dlc_tracks(part_renamer, animal_renamer, rescale = rescale, 
+                                     n_jobs = n_jobs, backend = backend)
 
-    def _load_dlc_tracks(self, part_renamer, animal_renamer, rescale = False):
+    def _load_dlc_tracks(self, part_renamer, animal_renamer, rescale = False, n_jobs = 1, backend = 'loky'):
         """Add DLC tracks to DataFrame"""
         df = pd.DataFrame()
         dfs = []
         col_names_old = None
-        #Go through each video file and load DLC tracks
-        for fn in self.metadata.keys():
-            df_fn, body_parts, animals, col_names, scorer = read_DLC_tracks(fn, 
-                                                                            part_renamer, 
-                                                                            animal_renamer)
+        fns = list(self.metadata.keys())
+        compact = getattr(self, 'compact_dtypes', False)
+        dtype = np.float32 if compact else np.float64
+        #Read and reshape each tracking file, in a process pool if requested
+        if n_jobs == 1:
+            loaded = [read_DLC_tracks(fn, part_renamer, animal_renamer, dtype = dtype) for fn in fns]
+        else:
+            loaded = Parallel(n_jobs = n_jobs, backend = backend)(
+                delayed(read_DLC_tracks)(fn, part_renamer, animal_renamer, dtype = dtype) for fn in fns)
+        #Go through each video file and attach its metadata
+        for fn, (df_fn, body_parts, animals, col_names, scorer) in zip(fns, loaded):
             n_rows = len(df_fn)
             df_fn['time'] = df_fn['frame']/self.metadata[fn]['fps']
     
@@ -400,6 +654,9 @@ class VideosetDataFrame(MLDataFrame):
 
         df = pd.concat(dfs, axis = 0)
         df = df.reset_index(drop = True)
+        if compact:
+            df['filename'] = pd.Categorical(df['filename'], categories = fns)
+            df['frame'] = pd.to_numeric(df['frame'], downcast = 'integer')
         self.body_parts = body_parts
         self.animals = animals
         self.animal_setup = {'mouse_ids': animals, 'bodypart_ids': body_parts, 'colnames': col_names}
@@ -416,23 +673,49 @@ class VideosetDataFrame(MLDataFrame):
     def _load_labels_boris(self, col_name = 'label', set_as_label = False):
         """Add behavior label data to DataFrame"""
 
-        if self.label_key is None:
-            label_files = []
-            for fn in self.metadata.keys():
-                if 'label_files' in self.metadata[fn]:
-                    label_files.append(self.metadata[fn]['label_files'])
-            self.label_key = create_behavior_labels(label_files)
-
+        #Parse each annotation file once, and reuse for both label discovery and labelling
+        events = {}
         for vid in self.metadata:
             if 'label_files' in self.metadata[vid]:
+                events[vid] = read_boris_events(self.metadata[vid]['label_files'])
 
-                fn_in = self.metadata[vid]['label_files']
-                fps = self.metadata[vid]['fps']
-                duration = self.metadata[vid]['duration']
+        if self.label_key is None:
+            self.label_key = create_behavior_labels(list(events.values()))
 
-                ground_truth, _ = read_boris_annotation(fn_in, fps, duration, self.label_key)
+        if len(events) == 0:
+            return
 
-                self.data.loc[self.data['filename'] == vid, col_name] = ground_truth
+        table = self._table()
+        if col_name in self._columns():
+            label_values = self._select(col_name).to_numpy(dtype = float, copy = True)
+        else:
+            label_values = np.full(len(table), np.nan)
+        row_indices = table.groupby('filename', sort = False, observed = True).indices
+
+        for vid, vid_events in events.items():
+            fn_in = self.metadata[vid]['label_files']
+            fps = self.metadata[vid]['fps']
+            duration = self.metadata[vid]['duration']
+
+            ground_truth, _ = read_boris_annotation(fn_in, fps, duration, self.label_key, events = vid_events)
+            if len(ground_truth) == 0:
+                continue
+
+            rows = row_indices[vid]
+            if len(ground_truth) != len(rows):
+                raise ValueError(f"Number of labelled frames ({len(ground_truth)}) doesn't match number of tracked frames ({len(rows)}) for {vid}")
+            #Rows of a video are normally contiguous, so write into a slice
+            if rows[-1] - rows[0] + 1 == len(rows):
+                label_values[rows[0]:rows[-1]+1] = ground_truth
+            else:
+                label_values[rows] = ground_truth
+
+        if getattr(self, 'compact_dtypes', False):
+            if np.isnan(label_values).any():
+                label_values = label_values.astype(np.float32)
+            else:
+                label_values = pd.to_numeric(label_values, downcast = 'integer')
+        self.data[col_name] = label_values
 
         if set_as_label:
             self.label_cols = col_name
@@ -446,10 +729,96 @@ class VideosetDataFrame(MLDataFrame):
         Returns:
             None. File is saved to path.
         """
+        #Saved with the feature blocks merged into the table, as `data`
+        state = {k:v for k,v in self.__dict__.items() if k not in ['_data', '_feature_blocks']}
+        state['data'] = self.data
         with open(fn_out,'wb') as file:
-            file.write(pickle.dumps(self.__dict__, protocol = 4))
+            file.write(pickle.dumps(state, protocol = 4))
+
+    def save_parquet(self, path_out : str) -> None:
+        """Save VideosetDataFrame object in a columnar format, partitioned by video.
+
+        Each video's rows are written to their own Parquet file, and the remaining attributes 
+        (metadata, feature_cols, label_key, animal_setup, etc) are pickled to a small sidecar file. 
+        Use `load_videodataset_parquet` to load all or part of the dataset back.
+
+        Args:
+            path_out: directory to write the dataset to. Created if it doesn't exist.
 
-    def to_dlc_csv(self, base_dir : str, save_h5_too = False) -> None:
+        Returns:
+            None. Files are saved to path.
+        """
+        if not has_pyarrow:
+            raise RuntimeError("pyarrow not found. Saving datasets as Parquet files is not available")
+        os.makedirs(path_out, exist_ok = True)
+        #Each video is put together from the table and the feature blocks, without merging them
+        table = _range_indexed(self._table())
+        blocks = list(self._feature_blocks.values())
+        columns = self._columns()
+        partitions = {}
+        row_indices = table.groupby('filename', sort = False, observed = True).indices
+        for idx, vid in enumerate(self.videos):
+            fn_part = f'video_{idx:05d}.parquet'
+            rows = row_indices.get(vid, [])
+            df_vid = pd.concat([table.iloc[rows]] + [block.iloc[rows] for block in blocks], axis = 1)
+            df_vid[columns].reset_index(drop = True).to_parquet(os.path.join(path_out, fn_part), index = False)
+            partitions[vid] = fn_part
+        sidecar = {k:v for k,v in self.__dict__.items() if k not in ['data', '_data', '_feature_blocks']}
+        sidecar['_partitions'] = partitions
+        sidecar['_columns'] = columns
+        with open(os.path.join(path_out, PARQUET_SIDECAR), 'wb') as file:
+            file.write(pickle.dumps(sidecar, protocol = 4))
+
+    def save_memmap(self, path_out : str) -> None:
+        """Save VideosetDataFrame object as a set of .npy files that can be memory-mapped, one per video and block of columns.
+
+        The tracks (along with frame, time and labels) form one block. Each featureset (columns named 
+        'featureset_name__feature_name') forms its own block. Open the result with `MemmapVideosetDataFrame`.
+
+        Args:
+            path_out: directory to write the dataset to. Created if it doesn't exist.
+
+        Returns:
+            None. Files are saved to path.
+        """
+        #Each video is put together from the table and the feature blocks, without merging them
+        table = _range_indexed(self._table())
+        sources = {col:table for col in table.columns}
+        for feature_block in self._feature_blocks.values():
+            sources.update({col:feature_block for col in feature_block.columns})
+        columns = self._columns()
+        blocks = {}
+        for col in columns:
+            if col == 'filename':
+                continue
+            if not np.issubdtype(sources[col][col].dtype, np.number):
+                raise ValueError(f"Column {col} is not numeric, cannot be saved as a memory-mapped array.")
+            block = col.split('__')[0] if '__' in col else MEMMAP_TRACK_BLOCK
+            blocks.setdefault(block, []).append(col)
+
+        os.makedirs(path_out, exist_ok = True)
+        n_rows = {}
+        row_indices = table.groupby('filename', sort = False, observed = True).indices
+        for idx, vid in enumerate(self.videos):
+            rows = row_indices.get(vid, [])
+            n_rows[vid] = len(rows)
+            for block, cols in blocks.items():
+                block_data = np.empty((len(rows), len(cols)))
+                for source in {id(sources[col]):sources[col] for col in cols}.values():
+                    positions = [pos for pos, col in enumerate(cols) if sources[col] is source]
+                    block_data[:,positions] = source[[cols[pos] for pos in positions]].iloc[rows].to_numpy(dtype = float)
+                np.save(os.path.join(path_out, _memmap_block_fn(idx, block)), block_data)
+
+        sidecar = {k:v for k,v in self.__dict__.items() if k not in ['data', '_data', '_feature_blocks']}
+        sidecar['_blocks'] = blocks
+        sidecar['_columns_order'] = columns
+        sidecar['_n_rows'] = n_rows
+        sidecar['_dtypes'] = {col:sources[col][col].dtype for col in blocks.get(MEMMAP_TRACK_BLOCK, [])}
+        with open(os.path.join(path_out, MEMMAP_SIDECAR), 'wb') as file:
+            file.write(pickle.dumps(sidecar, protocol = 4))
+
+    def to_dlc_csv(self, base_dir : str, save_h5_too = False, h5_only = False, 
+                   n_jobs : int = 1, backend : str = 'loky') -> None:
         """Save VideosetDataFrame tracking files to DLC csv format.
 
         Only save tracking data, not other computed features.
@@ -457,31 +826,41 @@ class VideosetDataFrame(MLDataFrame):
         Args:
             base_dir: base_dir to write DLC csv files to
             save_h5_too: if True, also save the data as an h5 file
+            h5_only: if True, only save the data as an h5 file (e.g. to load back into DeepLabCut)
+            n_jobs: Default 1. Number of workers used to write the files. -1 uses all cores.
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1.
             
         Returns:
             None. Files are saved to path.
         """
-        from itertools import product
-        fns = list(self.metadata.keys())
-        for fn in fns:
-            df = self.data.loc[self.data['filename'] == fn].copy().reset_index(drop = True)
-            #Make a multi column object and rearrange table to be in DLC format
-            scorer = self.metadata[fn]['scorer']
-            selected_cols = []
-            for animal, bp, component in product(self.animals, self.body_parts, ['x', 'y', 'likelihood']):
-                if component == 'likelihood':
-                    old_col_name = f"{component}_{animal}_{bp}"
-                else:
-                    old_col_name = f"{animal}_{component}_{bp}"
-                new_col_name = (scorer, animal, bp, component)
-                df = df.rename(columns = {old_col_name: new_col_name})
-                selected_cols.append(new_col_name)
-            df = df[selected_cols]
-            df.columns = pd.MultiIndex.from_tuples(df.columns, names=['scorer', 'individuals', 'bodyparts', 'coords'])
-            fn_out = os.path.join(base_dir, os.path.basename(fn))
-            df.to_csv(fn_out)
-            if save_h5_too:
-                df.to_hdf(fn_out.replace('.csv', '.h5'), "df_with_missing", format = 'table', mode="w")
+        n_animals = len(self.animals)
+        n_body_parts = len(self.body_parts)
+        prob_cols = ['_'.join(a) for a in product(['likelihood'], self.animals, self.body_parts)]
+        tracks = self._select(self.raw_track_columns).to_numpy()
+        probs = self._select(prob_cols).to_numpy()
+        row_indices = self._table().groupby('filename', sort = False, observed = True).indices
+
+        def _make_dlc_table(fn):
+            rows = row_indices[fn]
+            n_rows = len(rows)
+            #Rearrange from (frame, animal, x/y coord, body part) to (frame, animal, body part, x/y/likelihood)
+            vid_tracks = tracks[rows].reshape((n_rows, n_animals, 2, n_body_parts)).transpose([0, 1, 3, 2])
+            vid_probs = probs[rows].reshape((n_rows, n_animals, n_body_parts, 1))
+            vid_data = np.concatenate([vid_tracks, vid_probs], axis = 3).reshape((n_rows, -1))
+            columns = pd.MultiIndex.from_product([[self.metadata[fn]['scorer']], self.animals, self.body_parts, XYLIKELIHOOD_IDS], 
+                                                 names = ['scorer', 'individuals', 'bodyparts', 'coords'])
+            fn_out = os.path.join(base_dir, os.path.splitext(os.path.basename(fn))[0])
+            return pd.DataFrame(vid_data, columns = columns), fn_out
+
+        tables = (_make_dlc_table(fn) for fn in self.metadata.keys())
+        save_csv = not h5_only
+        save_h5 = save_h5_too or h5_only
+        if n_jobs == 1:
+            for df, fn_out in tables:
+                _write_dlc_table(df, fn_out, save_csv, save_h5)
+        else:
+            Parallel(n_jobs = n_jobs, backend = backend)(
+                delayed(_write_dlc_table)(df, fn_out, save_csv, save_h5) for df, fn_out in tables)
 
     def load(self, fn_in : str) -> None:
         """Load VideosetDataFrame object from pickle file.
@@ -560,6 +939,290 @@ def load_videodataset(fn_in : str) -> VideosetDataFrame:
     new_obj.__dict__ = pickle.loads(dataPickle)
     return new_obj
 
+def load_videodataset_parquet(path_in : str, columns : list = None, 
+                              columns_regex : str = None, videos : list = None) -> VideosetDataFrame:
+    """Load VideosetDataFrame saved with `save_parquet`, optionally only some of its columns and videos.
+
+    The 'filename', 'frame' and 'time' columns, and the label column if there is one, are always loaded.
+
+    Args:
+        path_in: directory the dataset was saved to
+        columns: Default None. List of columns to load. If None (and columns_regex is None), load all columns
+        columns_regex: Default None. Regex pattern, any column matching it is also loaded (e.g. '^MARS__')
+        videos: Default None. List of videos to load. If None, load all videos
+
+    Returns:
+        VideosetDataFrame object with the selected columns and videos
+    """
+    if not has_pyarrow:
+        raise RuntimeError("pyarrow not found. Loading datasets saved as Parquet files is not available")
+    with open(os.path.join(path_in, PARQUET_SIDECAR), 'rb') as file:
+        sidecar = pickle.loads(file.read())
+    partitions = sidecar.pop('_partitions')
+    all_columns = sidecar.pop('_columns')
+
+    if columns is None and columns_regex is None:
+        selected_cols = None
+    else:
+        requested = set(columns) if columns is not None else set()
+        if columns_regex is not None:
+            try:
+                compiled = re.compile(columns_regex)
+            except re.error:
+                raise ValueError("Couldn't parse re pattern.")
+            requested |= set(l for l in all_columns if compiled.search(l) is not None)
+        missing = requested.difference(all_columns)
+        if len(missing) > 0:
+            raise ValueError(f"Columns not found in saved dataset: {', '.join(sorted(missing))}")
+        required = ['filename', 'frame', 'time']
+        label_cols = sidecar.get('label_cols', None)
+        if label_cols is not None:
+            required += [label_cols] if type(label_cols) is str else list(label_cols)
+        selected_cols = [l for l in all_columns if l in requested or l in required]
+
+    if videos is None:
+        videos = list(partitions.keys())
+    else:
+        missing = [vid for vid in videos if vid not in partitions]
+        if len(missing) > 0:
+            raise ValueError(f"Videos not found in saved dataset: {', '.join(missing)}")
+
+    dfs = [pd.read_parquet(os.path.join(path_in, partitions[vid]), columns = selected_cols) for vid in videos]
+
+    new_obj = VideosetDataFrame({})
+    new_obj.__dict__ = sidecar
+    new_obj.metadata = {vid:sidecar['metadata'][vid] for vid in videos}
+    new_obj.data = pd.concat(dfs, axis = 0).reset_index(drop = True)
+    if selected_cols is not None and new_obj.feature_cols is not None:
+        new_obj.feature_cols = [l for l in new_obj.feature_cols if l in selected_cols]
+    return new_obj
+
+def _memmap_block_fn(idx, block):
+    return f'video_{idx:05d}__{block}.npy'
+
+class MemmapVideosetDataFrame(VideosetDataFrame):
+    def __init__(self, path_in : str, mmap_mode : str = 'r'):
+        """VideosetDataFrame backed by memory-mapped .npy files, as written by `VideosetDataFrame.save_memmap`.
+
+        Opening the dataset only reads the small sidecar file. Tracks and feature blocks are memory-mapped, 
+        and only the pages a method needs are read from disk. The `features`, `labels`, `group` and `videos` 
+        properties, and `add_features`, work as for VideosetDataFrame without building the full pandas table. 
+        New features are computed one video at a time and written to disk as new blocks.
+
+        The `data` property builds the full (read-only) pandas table, for compatibility with the rest of 
+        the package. Modifying it does not change the files on disk.
+
+        Args:
+            path_in: directory the dataset was saved to
+            mmap_mode: Default 'r'. Mode passed to `np.load` to memory-map the blocks
+        """
+        self.path = path_in
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path_in, MEMMAP_SIDECAR), 'rb') as file:
+            sidecar = pickle.loads(file.read())
+        self.__dict__.update(sidecar)
+
+    def _save_sidecar(self):
+        sidecar = {k:v for k,v in self.__dict__.items() if k not in ['path', 'mmap_mode']}
+        with open(os.path.join(self.path, MEMMAP_SIDECAR), 'wb') as file:
+            file.write(pickle.dumps(sidecar, protocol = 4))
+
+    def _load_block(self, vid, block):
+        idx = self.videos.index(vid)
+        return np.load(os.path.join(self.path, _memmap_block_fn(idx, block)), mmap_mode = self.mmap_mode)
+
+    def _columns(self):
+        return list(self._columns_order)
+
+    def _table(self):
+        raise RuntimeError("Memory-mapped datasets have no in-memory table. Use the `data` property to build it, "
+                           "or `add_features`, which computes features one video at a time.")
+
+    def _select(self, cols):
+        raise RuntimeError("Memory-mapped datasets have no in-memory table. Use the `data` property to build it, "
+                           "or `add_features`, which computes features one video at a time.")
+
+    def _video_data(self, vid, blocks = None):
+        """Build the pandas table for one video, from the given blocks (default all)."""
+        if blocks is None:
+            blocks = list(self._blocks.keys())
+        dfs = [pd.DataFrame(np.array(self._load_block(vid, block)), columns = self._blocks[block]) for block in blocks]
+        df = pd.concat(dfs, axis = 1)
+        for col, dtype in self._dtypes.items():
+            if col in df.columns:
+                df[col] = df[col].astype(dtype)
+        df['filename'] = vid
+        return df[[col for col in self._columns_order if col in df.columns]]
+
+    def _gather(self, cols, vid):
+        """Gather the given columns of one video into a numpy array."""
+        cols = [cols] if type(cols) is str else list(cols)
+        arrays = []
+        for block, block_cols in self._blocks.items():
+            col_idx = [block_cols.index(col) for col in cols if col in block_cols]
+            if len(col_idx) > 0:
+                arrays.append((col_idx, block))
+        out = np.empty((self._n_rows[vid], len(cols)))
+        col_pos = {col:i for i, col in enumerate(cols)}
+        for col_idx, block in arrays:
+            block_data = self._load_block(vid, block)
+            block_cols = self._blocks[block]
+            out[:,[col_pos[block_cols[i]] for i in col_idx]] = block_data[:,col_idx]
+        return out
+
+    @property
+    def data(self):
+        return pd.concat([self._video_data(vid) for vid in self.videos], axis = 0).reset_index(drop = True)
+
+    @data.setter
+    def data(self, df : pd.DataFrame):
+        raise RuntimeError("Assigning the data table is not supported on memory-mapped datasets. Load the dataset "
+                           "with `load_videodataset`, or build a VideosetDataFrame, to modify it.")
+
+    @property
+    def group(self):
+        return np.repeat(np.array(self.videos, dtype = object), [self._n_rows[vid] for vid in self.videos])
+
+    @property
+    def features(self):
+        if self.feature_cols is None:
+            return None
+        return np.concatenate([self._gather(self.feature_cols, vid) for vid in self.videos], axis = 0)
+
+    @property
+    def labels(self):
+        if self.label_cols is None:
+            return None
+        labels = np.concatenate([self._gather(self.label_cols, vid) for vid in self.videos], axis = 0)
+        return labels[:,0] if type(self.label_cols) is str else labels
+
+    def iter_features(self):
+        """Iterate over the videos, yielding the features and labels of one video at a time.
+        
+        Returns:
+            Generator of tuples (video, features, labels). Labels are None if no label column is set.
+        """
+        for vid in self.videos:
+            labels = None
+            if self.label_cols is not None:
+                labels = self._gather(self.label_cols, vid)
+                if type(self.label_cols) is str: 
+                    labels = labels[:,0]
+            yield vid, self._gather(self.feature_cols, vid), labels
+
+    def activate_features_by_name(self, name : str) -> list:
+        matched_cols = [l for l in self._columns() if re.match(f"^{name}", l)]
+        if self.feature_cols is not None:
+            self.feature_cols = uniquifier(list(self.feature_cols) + list(matched_cols))
+        else:
+            self.feature_cols = matched_cols
+        self._save_sidecar()
+        return matched_cols
+
+    def get_columns_regex(self, pattern : str) -> list:
+        try:
+            compiled = re.compile(pattern)
+        except re.error:
+            raise ValueError("Couldn't parse re pattern.")
+        return [l for l in self._columns() if compiled.search(l) is not None]
+
+    def remove_feature_cols(self, col_names : list) -> list:
+        removed = super().remove_feature_cols(col_names)
+        self._save_sidecar()
+        return removed
+
+    def add_videos(self, metadata : dict, n_jobs : int = 1, backend : str = 'loky') -> list:
+        raise RuntimeError("Adding videos is not supported on memory-mapped datasets. Add them before saving "
+                           "with `save_memmap`.")
+
+    def add_features(self, feature_maker : Features, 
+                           featureset_name : str, 
+                           add_to_features = False, 
+                           n_jobs : int = 1,
+                           backend : str = 'loky',
+                           columns : list = None,
+                           **kwargs) -> list:
+        """Compute features using Feature object, one video at a time, and save them as a new memory-mapped block. 
+        'featureset_name' will be prepended to new columns, followed by a double underscore. 
+
+        Args:
+            featuremaker: A Feature object that houses the feature-making function to be executed and a list of required columns that must in the dataframe for this to work
+            featureset_name: Name to prepend to the added features 
+            add_to_features: Whether to add to list of active features (i.e. will be returned by the .features property)
+            n_jobs: Default 1. Number of worker processes computing the videos' features. -1 uses all cores.
+            backend: Default 'loky'. joblib backend used when n_jobs is not 1.
+            columns: Default None. Names of the features to compute, with or without the 'featureset_name__' 
+                prefix. If None, all the features the feature maker makes are computed.
+        Returns:
+            List of new columns that are computed
+        """
+        if columns is not None:
+            kwargs['columns'] = _strip_featureset_name(columns, featureset_name)
+        existing_cols = set(self._columns())
+        input_blocks = [MEMMAP_TRACK_BLOCK] + [block for block, cols in self._blocks.items() \
+                        if block != MEMMAP_TRACK_BLOCK and len(set(cols).intersection(feature_maker.required_columns)) > 0]
+        block = str(featureset_name)
+        suffix = 1
+        while block in self._blocks:
+            block = f'{featureset_name}_{suffix}'
+            suffix += 1
+
+        #Missing values are filled with the means over all videos, once all videos are done
+        impute = feature_maker.fill_missing and kwargs.get('impute', True)
+        if feature_maker.fill_missing:
+            kwargs['impute'] = False
+        make = feature_maker.make_from_data
+        if getattr(self, 'disk_cache', None) is not None:
+            make = partial(feature_maker.make_cached, disk_cache = self.disk_cache)
+        if n_jobs == 1:
+            video_features = (make(self._video_data(vid, input_blocks), self.animal_setup, **kwargs) 
+                              for vid in self.videos)
+        else:
+            video_features = parallel_imap(partial(make, animal_setup = self.animal_setup, **kwargs), 
+                                           (self._video_data(vid, input_blocks) for vid in self.videos), 
+                                           n_jobs = n_jobs, backend = backend)
+
+        new_cols = None
+        if len(self.videos) == 0:
+            #The columns the feature maker makes from an empty table, as for a VideosetDataFrame without rows
+            empty = pd.concat([pd.DataFrame(np.empty((0, len(self._blocks[b]))), columns = self._blocks[b]) 
+                               for b in input_blocks] + [pd.DataFrame({'filename': []})], axis = 1)
+            new_features = feature_maker.make_from_data(empty, self.animal_setup, **kwargs)
+            new_cols = [col for col in [str(featureset_name) + '__' + str(i) for i in new_features.columns] 
+                        if col not in existing_cols]
+        sums, counts = 0, 0
+        for idx, new_features in enumerate(video_features):
+            new_features.columns = [str(featureset_name) + '__' + str(i) for i in new_features.columns]
+            #Don't add duplicated columns:
+            if new_cols is None:
+                new_cols = [col for col in new_features.columns if col not in existing_cols]
+            values = new_features[new_cols].to_numpy(dtype = float)
+            if impute:
+                sums = sums + np.nansum(values, axis = 0)
+                counts = counts + np.sum(~np.isnan(values), axis = 0)
+            np.save(os.path.join(self.path, _memmap_block_fn(idx, block)), values)
+
+        if impute:
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                means = sums/counts
+            for idx in range(len(self.videos)):
+                fn = os.path.join(self.path, _memmap_block_fn(idx, block))
+                values = np.load(fn)
+                rows, cols = np.nonzero(np.isnan(values))
+                if len(rows) > 0:
+                    values[rows, cols] = means[cols]
+                    np.save(fn, values)
+
+        self._blocks[block] = new_cols
+        self._columns_order = self._columns_order + new_cols
+        if add_to_features:
+            if self.feature_cols is not None:
+                self.feature_cols = list(self.feature_cols) + list(new_cols)
+            else:
+                self.feature_cols = new_cols
+        self._save_sidecar()
+        return list(new_cols)
+
 def get_sample_openfield_data():
     """Load a sample dataset of 1 mouse in openfield setup. The video is the sample that comes with DLC.
     
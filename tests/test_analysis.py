@@ -227,6 +227,21 @@ def test_save_to_dlc_csv(videodataset, tmp_path_factory):
     created_files = glob(os.path.join(fn, '*.csv'))
     assert len(created_files) > 0
 
+def test_save_to_dlc_h5_parallel(videodataset, tmp_path_factory):
+    pytest.importorskip('tables')
+    import os
+    from behaveml import read_DLC_tracks
+    fn = tmp_path_factory.mktemp('dlc_h5')
+    videodataset.to_dlc_csv(fn, h5_only = True, n_jobs = 2)
+    for vid in videodataset.videos:
+        stem = os.path.join(fn, os.path.splitext(os.path.basename(vid))[0])
+        assert not os.path.exists(stem + '.csv')
+        df, body_parts, animals, _, _ = read_DLC_tracks(stem + '.h5')
+        assert animals == videodataset.animals
+        assert body_parts == videodataset.body_parts
+        vid_data = videodataset.data.loc[videodataset.data.filename == vid].reset_index(drop = True)
+        pd.testing.assert_frame_equal(df[videodataset.raw_track_columns], vid_data[videodataset.raw_track_columns])
+
 ###########################
 ## Test generic features ##
 ###########################
@@ -277,4 +292,588 @@ def test_dist_features(videodataset):
                      featureset_name = 'dist', 
                      add_to_features = True)
     #Check we made the right amount of new columns
-    assert len(videodataset.feature_cols) == 91
\ No newline at end of file
+    assert len(videodataset.feature_cols) == 91
+
+def test_distance_feature_values(videodataset):
+    import numpy as np
+    from behaveml import distance_feature_maker
+    videodataset.add_features(distance_feature_maker, featureset_name = 'dist')
+    df = videodataset.data
+    m0, m1 = videodataset.animals
+    bp1, bp2 = videodataset.body_parts[:2]
+    intra = np.sqrt((df[f'{m0}_x_{bp1}'] - df[f'{m0}_x_{bp2}'])**2 + (df[f'{m0}_y_{bp1}'] - df[f'{m0}_y_{bp2}'])**2)
+    inter = np.sqrt((df[f'{m1}_x_{bp2}'] - df[f'{m0}_x_{bp1}'])**2 + (df[f'{m1}_y_{bp2}'] - df[f'{m0}_y_{bp1}'])**2)
+    np.testing.assert_array_equal(df[f'dist__{m0}_distance_{bp1}_{bp2}'], intra)
+    np.testing.assert_array_equal(df[f'dist__M1_M0_distance_{bp2}_{bp1}'], inter)
+
+def test_speed_feature_values(videodataset):
+    import numpy as np
+    from behaveml import speed_feature_maker
+    n_shifts = 5
+    videodataset.add_features(speed_feature_maker, featureset_name = 'speed', n_shifts = n_shifts)
+    df = videodataset.data
+    m0, m1 = videodataset.animals
+    bp1, bp2 = videodataset.body_parts[:2]
+    intra = np.full(len(df), np.nan)
+    inter = np.full(len(df), np.nan)
+    #Velocities within each video, so none span a video boundary
+    for vid in videodataset.videos:
+        rows = np.flatnonzero(df['filename'] == vid)
+        v = df.iloc[rows]
+        dt = v['time'].to_numpy()[n_shifts:] - v['time'].to_numpy()[:-n_shifts]
+        vel = lambda col: (v[col].to_numpy()[n_shifts:] - v[col].to_numpy()[:-n_shifts])/dt
+        intra[rows[n_shifts:]] = np.sqrt((vel(f'{m0}_x_{bp1}') - vel(f'{m0}_x_{bp2}'))**2 + 
+                                         (vel(f'{m0}_y_{bp1}') - vel(f'{m0}_y_{bp2}'))**2)
+        inter[rows[n_shifts:]] = np.sqrt((vel(f'{m1}_x_{bp2}') - vel(f'{m0}_x_{bp1}'))**2 + 
+                                         (vel(f'{m1}_y_{bp2}') - vel(f'{m0}_y_{bp1}'))**2)
+    np.testing.assert_allclose(df[f'speed__{m0}_speed_{bp1}_{bp2}'], intra)
+    np.testing.assert_allclose(df[f'speed__M1_M0_speed_{bp2}_{bp1}'], inter)
+
+def test_parallel_track_loading(metadata):
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    serial = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    parallel = VideosetDataFrame(metadata, animal_renamer = animal_renamer, n_jobs = 2)
+    pd.testing.assert_frame_equal(serial.data, parallel.data)
+    assert serial.metadata == parallel.metadata
+
+def test_save_load_parquet(videodataset, tmp_path_factory):
+    pytest.importorskip('pyarrow')
+    from behaveml import distance_feature_maker, load_videodataset_parquet
+    videodataset.add_features(distance_feature_maker, 
+                     featureset_name = 'distances', 
+                     add_to_features = True)
+    path = tmp_path_factory.mktemp('parquet')
+    videodataset.save_parquet(path)
+    #Saving doesn't merge the feature blocks into the table
+    assert len(videodataset._feature_blocks) > 0
+
+    full = load_videodataset_parquet(path)
+    pd.testing.assert_frame_equal(full.data, videodataset.data)
+    assert list(full.feature_cols) == list(videodataset.feature_cols)
+
+    vids = videodataset.videos[:2]
+    subset = load_videodataset_parquet(path, columns_regex = '^distances__', videos = vids)
+    assert subset.videos == vids
+    assert set(subset.data.filename) == set(vids)
+    assert list(subset.feature_cols) == list(videodataset.feature_cols)
+    assert 'likelihood_resident_nose' not in subset.data.columns
+    assert 'label' in subset.data.columns
+
+def test_memmap_videodataset(videodataset, tmp_path_factory):
+    import numpy as np
+    from behaveml import com_feature_maker, speed_feature_maker, MemmapVideosetDataFrame
+    path = tmp_path_factory.mktemp('memmap')
+    videodataset.save_memmap(path)
+    mm = MemmapVideosetDataFrame(path)
+    assert mm.videos == videodataset.videos
+    assert (mm.group == videodataset.group).all()
+    assert np.array_equal(mm.labels, videodataset.labels, equal_nan = True)
+
+    new_cols = videodataset.add_features(com_feature_maker, featureset_name = 'com', add_to_features = True)
+    mm_cols = mm.add_features(com_feature_maker, featureset_name = 'com', add_to_features = True)
+    assert new_cols == mm_cols
+    assert np.allclose(mm.features, videodataset.features)
+
+    #Reopening sees the new block
+    mm = MemmapVideosetDataFrame(path)
+    assert list(mm.feature_cols) == list(videodataset.feature_cols)
+
+    #Feature blocks are saved too
+    path = tmp_path_factory.mktemp('memmap_features')
+    videodataset.save_memmap(path)
+    mm = MemmapVideosetDataFrame(path)
+    assert mm._columns() == videodataset._columns()
+    assert np.allclose(mm.features, videodataset.features)
+
+    #The tracks on disk are read-only
+    with pytest.raises(RuntimeError):
+        mm.data = videodataset.data
+    with pytest.raises(RuntimeError):
+        interpolate_lowconf_points(mm)
+    with pytest.raises(RuntimeError):
+        mm.add_videos(videodataset.metadata)
+    #There is no in-memory table to compute features on
+    with pytest.raises(RuntimeError):
+        com_feature_maker.make(mm)
+
+    #Without videos, the new columns are still those of the feature maker
+    new_cols = videodataset.add_features(speed_feature_maker, featureset_name = 'speeds')
+    mm.metadata = {}
+    assert mm.add_features(speed_feature_maker, featureset_name = 'speeds') == new_cols
+
+def test_compact_dtypes(metadata):
+    import numpy as np
+    from behaveml import speed_feature_maker
+    import warnings
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    #Grouping by the categorical 'filename' column only uses the videos present
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer, compact_dtypes = True)
+    assert all(vdf.data[vdf.raw_track_columns].dtypes == np.float32)
+    assert vdf.data['filename'].dtype.name == 'category'
+    assert np.issubdtype(vdf.data['frame'].dtype, np.integer)
+    assert vdf.data['frame'].dtype.itemsize < 8
+    assert vdf.data['time'].dtype == np.float64
+
+    new_cols = vdf.add_features(speed_feature_maker, featureset_name = 'speeds')
+    assert all(vdf.data[new_cols].dtypes == np.float32)
+    #Same features as the default dtypes, also late in the recordings
+    default = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    default.add_features(speed_feature_maker, featureset_name = 'speeds')
+    assert np.array_equal(vdf.labels, default.labels, equal_nan = True)
+    late = np.flatnonzero(default.data['time'] > 0.9*default.data['time'].max())
+    assert np.array_equal(vdf.data['time'].iloc[late], default.data['time'].iloc[late])
+    np.testing.assert_allclose(vdf.data[new_cols].iloc[late], default.data[new_cols].iloc[late], 
+                               rtol = 1e-2, atol = 1e-3)
+
+    interpolate_lowconf_points(vdf)
+    assert all(vdf.data[vdf.raw_track_columns].dtypes == np.float32)
+
+def test_add_videos(metadata):
+    from behaveml import distance_feature_maker, com_velocity_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    videos = list(metadata.keys())
+    old_metadata = {k:v for k,v in metadata.items() if k != videos[-1]}
+    new_metadata = {videos[-1]: metadata[videos[-1]]}
+
+    full = VideosetDataFrame({k:dict(v) for k,v in metadata.items()}, animal_renamer = animal_renamer)
+    partial = VideosetDataFrame({k:dict(v) for k,v in old_metadata.items()}, animal_renamer = animal_renamer)
+    for vdf in [full, partial]:
+        interpolate_lowconf_points(vdf)
+        vdf.add_features(distance_feature_maker, featureset_name = 'distances', add_to_features = True)
+        vdf.add_features(com_velocity_feature_maker, featureset_name = 'com_vel', n_shifts = 3)
+
+    added = partial.add_videos({k:dict(v) for k,v in new_metadata.items()})
+    assert added == [videos[-1]]
+    assert partial.videos == full.videos
+    pd.testing.assert_frame_equal(partial.data, full.data)
+
+    with pytest.raises(ValueError):
+        partial.add_videos({k:dict(v) for k,v in new_metadata.items()})
+
+def test_add_videos_imputation(metadata):
+    from behaveml import social_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    videos = list(metadata.keys())
+    old_metadata = {k:dict(v) for k,v in metadata.items() if k != videos[-1]}
+    new_metadata = {videos[-1]: dict(metadata[videos[-1]])}
+
+    partial = VideosetDataFrame(old_metadata, animal_renamer = animal_renamer)
+    partial.add_features(social_feature_maker, featureset_name = 'social')
+    partial.add_videos(new_metadata)
+    #Missing values in the new rows are filled with the new videos' means
+    alone = VideosetDataFrame(new_metadata, animal_renamer = animal_renamer)
+    new_cols = alone.add_features(social_feature_maker, featureset_name = 'social')
+    added = partial.data.loc[partial.data['filename'] == videos[-1], new_cols].reset_index(drop = True)
+    pd.testing.assert_frame_equal(added, alone.data[new_cols])
+
+def test_add_videos_unknown_behavior(metadata, tmp_path_factory):
+    import os
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    videos = list(metadata.keys())
+    old_metadata = {k:dict(v) for k,v in metadata.items() if k != videos[-1]}
+    new_metadata = {videos[-1]: dict(metadata[videos[-1]])}
+    partial = VideosetDataFrame(old_metadata, animal_renamer = animal_renamer)
+
+    #A behavior the dataset's label_key doesn't have
+    fn = os.path.join(tmp_path_factory.mktemp('boris'), os.path.basename(new_metadata[videos[-1]]['label_files']))
+    with open(new_metadata[videos[-1]]['label_files']) as file:
+        lines = file.readlines()
+    row = lines[16].split(',')
+    row[5] = 'new_behavior'
+    lines[16] = ','.join(row)
+    with open(fn, 'w') as file:
+        file.writelines(lines)
+    new_metadata[videos[-1]]['label_files'] = fn
+    with pytest.raises(ValueError):
+        partial.add_videos(new_metadata)
+    assert partial.videos == list(old_metadata.keys())
+
+def test_feature_cache(metadata):
+    from behaveml import marsreduced_feature_maker, social_feature_maker, com_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    cached = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    uncached = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    uncached.feature_cache = None
+    for vdf in [cached, uncached]:
+        for name, maker in [('reduced', marsreduced_feature_maker), ('social', social_feature_maker), 
+                            ('com', com_feature_maker)]:
+            vdf.add_features(maker, featureset_name = name)
+    assert len(cached.feature_cache) > 0
+    pd.testing.assert_frame_equal(cached.data, uncached.data)
+
+    #Interpolating the tracks invalidates the cache
+    interpolate_lowconf_points(cached)
+    assert len(cached.feature_cache) == 0
+
+def test_feature_cache_track_edits(metadata):
+    import numpy as np
+    from behaveml import com_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    m0, m1 = vdf.animals
+    before = vdf.add_features(com_feature_maker, featureset_name = 'com_before')
+    before = vdf.data[before].to_numpy()
+
+    #Swapping the animals keeps the sum of the tracks
+    cols0 = [c for c in vdf.raw_track_columns if c.startswith(m0 + '_')]
+    cols1 = [c.replace(m0 + '_', m1 + '_', 1) for c in cols0]
+    df = vdf.data
+    df[cols0 + cols1] = df[cols1 + cols0].to_numpy()
+    after = vdf.add_features(com_feature_maker, featureset_name = 'com_after')
+    assert not np.allclose(vdf.data[after].to_numpy(), before, equal_nan = True)
+
+    #Assigning the table clears the cache
+    vdf.add_features(com_feature_maker, featureset_name = 'com_again')
+    assert len(vdf.feature_cache) > 0
+    vdf.data = vdf.data.copy()
+    assert len(vdf.feature_cache) == 0
+
+def test_feature_input_projection(videodataset):
+    from behaveml import distance_feature_maker
+    from behaveml.features import Features
+    videodataset.add_features(distance_feature_maker, featureset_name = 'distances')
+    received = {}
+    def record_columns(df, raw_col_names, animal_setup, **kwargs):
+        received['columns'] = list(df.columns)
+        return pd.DataFrame({'n_likelihood': df[raw_col_names].sum(axis = 1)}, index = df.index)
+    likelihood_cols = [c for c in videodataset.data.columns if c.startswith('likelihood_')]
+    new_cols = videodataset.add_features(Features(record_columns, likelihood_cols), featureset_name = 'custom')
+    assert new_cols == ['custom__n_likelihood']
+    assert not any(c.startswith('distances__') for c in received['columns'])
+    assert set(received['columns']) == set(likelihood_cols + videodataset.raw_track_columns + ['time', 'frame', 'filename'])
+
+def test_feature_blocks(videodataset, tmp_path_factory):
+    import os
+    import numpy as np
+    from behaveml import distance_feature_maker, speed_feature_maker, load_videodataset
+    table = videodataset._table()
+    dist_cols = videodataset.add_features(distance_feature_maker, featureset_name = 'distances', add_to_features = True)
+    speed_cols = videodataset.add_features(speed_feature_maker, featureset_name = 'speeds', add_to_features = True)
+    #The existing table isn't rebuilt when features are added
+    assert videodataset._table() is table
+    assert videodataset.get_columns_regex('^speeds__') == speed_cols
+    features = videodataset.features
+
+    data = videodataset.data
+    assert list(data.columns) == list(table.columns) + dist_cols + speed_cols
+    np.testing.assert_array_equal(features, data[dist_cols + speed_cols].to_numpy())
+
+    fn = os.path.join(tmp_path_factory.mktemp('blocks'), 'dataset.pkl')
+    videodataset.save(fn)
+    pd.testing.assert_frame_equal(load_videodataset(fn).data, data)
+
+def test_feature_graph(videodataset):
+    from behaveml.utils import video_offsets
+    from behaveml.dl import feature_engineering as fe
+    df = videodataset.data[videodataset.raw_track_columns]
+    animal_setup = videodataset.animal_setup
+    offsets = video_offsets(videodataset.data)
+
+    assert fe.resolve_feature_graph(['kinematics'])[-1] == 'kinematics'
+    assert set(fe.resolve_feature_graph(['relative_body_motions'])) == {'centroid_all', 'ellipsoid', 'relative_body_motions'}
+    with pytest.raises(ValueError):
+        fe.make_feature_sets(df, animal_setup, ['not_a_feature_set'])
+
+    #Count how often each node's function is called
+    calls = []
+    originals = {name: node.function for name, node in fe.FEATURE_GRAPH.items()}
+    def counted(name):
+        def f(*args, **kwargs):
+            calls.append(name)
+            return originals[name](*args, **kwargs)
+        return f
+    try:
+        for name, node in fe.FEATURE_GRAPH.items():
+            node.function = counted(name)
+        tables = fe.make_feature_sets(df, animal_setup, ['social', 'mars_reduced'], n_shifts = 2, mode = 'diff', 
+                                      offsets = offsets, n_jobs = 4)
+    finally:
+        for name, node in fe.FEATURE_GRAPH.items():
+            node.function = originals[name]
+    assert sorted(calls) == sorted(set(calls))
+
+    social = fe.make_features_social(df, animal_setup, n_shifts = 2, mode = 'diff', offsets = offsets)
+    pd.testing.assert_frame_equal(tables['social'], social)
+    reduced = fe.make_features_mars_reduced(df, animal_setup, offsets = offsets)
+    pd.testing.assert_frame_equal(tables['mars_reduced'], reduced)
+
+    #Nodes whose columns are already in the table are skipped
+    results = fe.compute_feature_graph(pd.concat([df, tables['mars_reduced']], axis = 1), animal_setup, ['iou'], 
+                                       n_shifts = 2, mode = 'diff', offsets = offsets)
+    assert len(results['iou'].columns) == 0
+
+def test_feature_sets_maker(videodataset):
+    from behaveml import feature_sets_maker, marsreduced_feature_maker
+    from behaveml.utils import video_offsets
+    from behaveml.dl import feature_engineering as fe
+    #Without the dataset's cache, so sharing can only come from the feature graph
+    videodataset.feature_cache = None
+    calls = []
+    originals = {name: node.function for name, node in fe.FEATURE_GRAPH.items()}
+    def counted(name):
+        def f(*args, **kwargs):
+            calls.append(name)
+            return originals[name](*args, **kwargs)
+        return f
+    try:
+        for name, node in fe.FEATURE_GRAPH.items():
+            node.function = counted(name)
+        new_cols = videodataset.add_features(feature_sets_maker, featureset_name = 'sets', 
+                                             feature_sets = ['mars_reduced', 'social'], n_shifts = 2, mode = 'diff')
+    finally:
+        for name, node in fe.FEATURE_GRAPH.items():
+            node.function = originals[name]
+    #The nodes both sets use, e.g. 'iou' and 'ellipsoid', are computed once
+    assert 'iou' in calls and 'ellipsoid' in calls
+    assert sorted(calls) == sorted(set(calls))
+    assert len(new_cols) == len(set(new_cols))
+
+    reduced = marsreduced_feature_maker.make(videodataset)
+    df = videodataset.data[videodataset.raw_track_columns]
+    social = fe.make_features_social(df, videodataset.animal_setup, n_shifts = 2, mode = 'diff', 
+                                     offsets = video_offsets(videodataset.data))
+    sets = videodataset.data[new_cols].set_axis([c[len('sets__'):] for c in new_cols], axis = 1)
+    pd.testing.assert_frame_equal(sets[reduced.columns], reduced)
+    pd.testing.assert_frame_equal(sets[social.columns], social)
+    assert feature_sets_maker.context_size(feature_sets = ['mars_reduced', 'social'], n_shifts = 2, mode = 'diff') \
+        == tuple(max(c) for c in zip(fe.feature_set_context('mars_reduced', 2, 'diff'), 
+                                     fe.feature_set_context('social', 2, 'diff')))
+
+def test_ellipse_axes():
+    import numpy as np
+    from behaveml.dl.feature_engineering import _ellipse_axes
+    #Any number of animals and body parts
+    data = np.random.default_rng(0).normal(size = (100, 3, 5, 2))*[3, 1]
+    svals = np.linalg.svd(data - data.mean(axis = 2, keepdims = True), compute_uv = False)
+    np.testing.assert_allclose(_ellipse_axes(data), svals, atol = 1e-10)
+
+def test_geometry_backends(videodataset):
+    from behaveml.config import global_config
+    from behaveml.dl import geometry
+    from behaveml.dl import feature_engineering as fe
+    df = videodataset.data[videodataset.raw_track_columns]
+    backends = ['pandas', 'numpy'] + (['numba'] if geometry.has_numba else [])
+    tables = []
+    try:
+        #Check mode compares the kernels with the reference implementation
+        global_config['feature_engineering__check_geometry_backend'] = True
+        for backend in backends:
+            global_config['feature_engineering__geometry_backend'] = backend
+            tables.append(fe.make_features_social(df, videodataset.animal_setup, n_shifts = 0))
+    finally:
+        global_config['feature_engineering__geometry_backend'] = 'auto'
+        global_config['feature_engineering__check_geometry_backend'] = False
+    for table in tables[1:]:
+        pd.testing.assert_frame_equal(table, tables[0])
+
+def test_parallel_add_features(metadata):
+    from behaveml import distance_feature_maker, speed_feature_maker, com_velocity_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    tables = []
+    for n_jobs in [1, 2]:
+        vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+        for name, maker in [('distances', distance_feature_maker), ('speeds', speed_feature_maker), 
+                            ('com_vel', com_velocity_feature_maker)]:
+            vdf.add_features(maker, featureset_name = name, n_jobs = n_jobs)
+        tables.append(vdf.data)
+    pd.testing.assert_frame_equal(tables[0], tables[1])
+
+def test_feature_stream(videodataset):
+    import numpy as np
+    from behaveml import social_feature_maker, speed_feature_maker
+    data = videodataset.data
+    data = data.loc[data['filename'] == videodataset.videos[0], videodataset.raw_track_columns + ['time', 'frame']]
+    data = data.iloc[:600].reset_index(drop = True)
+    chunk_sizes = np.random.default_rng(0).integers(1, 30, size = len(data))
+    for maker in [social_feature_maker, speed_feature_maker]:
+        batch = maker.make_from_data(data, videodataset.animal_setup)
+        stream = maker.stream(videodataset.animal_setup)
+        rows = []
+        start = 0
+        for size in chunk_sizes:
+            if start >= len(data): break
+            new_rows = stream.push(data.iloc[start:start+size])
+            if new_rows is not None:
+                #Rows are emitted at most `latency` frames late
+                assert new_rows.index[-1] == min(start + size, len(data)) - 1 - stream.latency
+                rows.append(new_rows)
+            start += size
+        rows.append(stream.flush())
+        streamed = pd.concat(rows)
+        assert list(streamed.index) == list(range(len(data)))
+        #Same as the batch features once the buffer has warmed up
+        warm = slice(stream.past, len(data) - stream.future)
+        pd.testing.assert_frame_equal(streamed.iloc[warm], batch.iloc[warm], check_dtype = False, atol = 1e-6)
+
+    #Missing values are filled with the given means, or with the means of the rows emitted so far
+    data.iloc[100:130, :4] = np.nan
+    batch = social_feature_maker.make_from_data(data, videodataset.animal_setup)
+    means = social_feature_maker.make_from_data(data, videodataset.animal_setup, impute = False).mean()
+    for stream_means in [means, None]:
+        stream = social_feature_maker.stream(videodataset.animal_setup, means = stream_means)
+        rows = [stream.push(data.iloc[start:start+50]) for start in range(0, len(data), 50)] + [stream.flush()]
+        streamed = pd.concat(rows)
+        assert not streamed.isnull().any().any()
+        if stream_means is not None:
+            pd.testing.assert_frame_equal(streamed, batch, check_dtype = False, atol = 1e-6)
+        else:
+            missing = social_feature_maker.make_from_data(data, videodataset.animal_setup, impute = False).isnull()
+            complete = ~missing.any(axis = 1)
+            pd.testing.assert_frame_equal(streamed[complete], batch[complete], check_dtype = False, atol = 1e-6)
+
+    with pytest.raises(RuntimeError):
+        from behaveml import cnn_probability_feature_maker
+        cnn_probability_feature_maker.stream(videodataset.animal_setup)
+
+def test_feature_columns(videodataset):
+    from behaveml import mars_feature_maker, social_feature_maker
+    from behaveml.dl import feature_engineering as fe
+    full = mars_feature_maker.make(videodataset)
+    columns = [c for c in full.columns if c.endswith('_pm_5')][:5] + [c for c in full.columns if '_pm_' not in c][:5]
+    selected = mars_feature_maker.make_columns(videodataset, columns)
+    pd.testing.assert_frame_equal(selected, full[[c for c in full.columns if c in columns]])
+
+    #Only the nodes needed are computed
+    calls = []
+    original = fe.FEATURE_GRAPH['iou'].function
+    def counted(*args, **kwargs):
+        calls.append('iou')
+        return original(*args, **kwargs)
+    full = social_feature_maker.make(videodataset)
+    columns = [c for c in full.columns if c.startswith('dist_') and c.endswith('_shifted_-10')]
+    try:
+        fe.FEATURE_GRAPH['iou'].function = counted
+        new_cols = videodataset.add_features(social_feature_maker, featureset_name = 'social', 
+                                             columns = ['social__' + c for c in columns])
+    finally:
+        fe.FEATURE_GRAPH['iou'].function = original
+    assert len(calls) == 0
+    assert new_cols == ['social__' + c for c in full.columns if c in columns]
+    pd.testing.assert_frame_equal(videodataset.data[new_cols].set_axis(columns, axis = 1), full[columns], 
+                                  check_dtype = False)
+
+    with pytest.raises(ValueError):
+        social_feature_maker.make_columns(videodataset, ['not_a_feature'])
+
+def test_disk_feature_cache(metadata, tmp_path_factory):
+    from behaveml import speed_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    path = str(tmp_path_factory.mktemp('feature_cache'))
+    expected = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    expected.add_features(speed_feature_maker, featureset_name = 'speeds', n_jobs = 2)
+
+    vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    vdf.use_disk_cache(path)
+    vdf.add_features(speed_feature_maker, featureset_name = 'speeds')
+    assert len(vdf.disk_cache) == len(vdf.videos)
+    pd.testing.assert_frame_equal(vdf.data, expected.data, check_dtype = False)
+
+    #Only the video whose tracks changed is computed again
+    calls = []
+    original = speed_feature_maker.make_from_data
+    def counted(data, *args, **kwargs):
+        calls.append(data['filename'].iloc[0])
+        return original(data, *args, **kwargs)
+    vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    vdf.use_disk_cache(path)
+    vid = vdf.videos[0]
+    col = vdf.raw_track_columns[0]
+    vdf.data.loc[vdf.data['filename'] == vid, col] += 1
+    try:
+        speed_feature_maker.make_from_data = counted
+        vdf.add_features(speed_feature_maker, featureset_name = 'speeds')
+    finally:
+        del speed_feature_maker.make_from_data
+    assert calls == [vid]
+    assert len(vdf.disk_cache) == len(vdf.videos) + 1
+
+    #Least recently used entries are evicted
+    vdf.use_disk_cache(path, max_size = 1)
+    assert len(vdf.disk_cache) == 0
+
+def test_disk_feature_cache_lru(tmp_path_factory):
+    import os
+    import numpy as np
+    from joblib import Parallel, delayed
+    from behaveml.features import DiskFeatureCache
+    def _put_disk_cache_entries(path, keys):
+        cache = DiskFeatureCache(path)
+        for key in keys:
+            cache.put(key, pd.DataFrame(np.zeros((10, 2)), columns = ['a', 'b']))
+    path = str(tmp_path_factory.mktemp('feature_cache_lru'))
+    _put_disk_cache_entries(path, ['first', 'second'])
+    cache = DiskFeatureCache(path)
+    index = pd.RangeIndex(10)
+    #Loading an entry marks it as used, so it's evicted last
+    assert cache.get('first', index) is not None
+    cache = DiskFeatureCache(path, max_size = os.path.getsize(cache._entry_fn('first')))
+    assert cache.get('first', index) is not None
+    assert cache.get('second', index) is None
+
+    #Processes sharing the cache don't lose each other's entries
+    cache.clear()
+    Parallel(n_jobs = 4)(delayed(_put_disk_cache_entries)(path, [f'{job}_{idx}' for idx in range(20)]) 
+                         for job in range(4))
+    cache = DiskFeatureCache(path)
+    assert len(cache) == 80
+    assert np.array_equal(cache.get('3_19', index).to_numpy(), np.zeros((10, 2)))
+
+    #The directory is only scanned once the cache is over max_size
+    scans = []
+    keys = cache._keys
+    cache._keys = lambda: scans.append(1) or keys()
+    block = pd.DataFrame(np.ones((10, 2)), columns = ['a', 'b'])
+    for idx in range(10):
+        cache.put(f'new_{idx}', block)
+    assert len(scans) == 0
+    cache.max_size = cache._size
+    cache.put('last', block)
+    assert len(scans) == 1
+    assert len(cache) == 90
+    assert cache.get('last', index) is not None
+
+def test_per_video_imputation(metadata, tmp_path_factory):
+    import numpy as np
+    from behaveml import social_feature_maker, MemmapVideosetDataFrame
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    metadata = {vid: metadata[vid] for vid in sorted(metadata)[:2]}
+    def load():
+        vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+        #Missing tracks in one video only, so its own column means differ from those over both videos
+        rows = np.flatnonzero(vdf.data['filename'] == vdf.videos[0])[10:40]
+        vdf.data.iloc[rows, vdf.data.columns.get_indexer(vdf.raw_track_columns[:4])] = np.nan
+        return vdf
+    path = tmp_path_factory.mktemp('imputation')
+    vdf = load()
+    vdf.save_memmap(str(path / 'memmap'))
+    new_cols = vdf.add_features(social_feature_maker, featureset_name = 'social', add_to_features = True)
+    expected = vdf.data[new_cols]
+    assert not expected.isnull().any().any()
+
+    for n_jobs, cache in [(2, None), (1, str(path / 'cache')), (2, str(path / 'cache'))]:
+        other = load()
+        if cache is not None:
+            other.use_disk_cache(cache)
+        other.add_features(social_feature_maker, featureset_name = 'social', n_jobs = n_jobs)
+        pd.testing.assert_frame_equal(other.data[new_cols], expected, check_dtype = False)
+    mm = MemmapVideosetDataFrame(str(path / 'memmap'))
+    mm.add_features(social_feature_maker, featureset_name = 'social', add_to_features = True, n_jobs = 2)
+    assert np.allclose(mm.features, vdf.features)
+
+def test_interpolate_tracks_only(metadata, capsys):
+    from behaveml import speed_feature_maker
+    animal_renamer = {'adult': 'resident', 'juvenile': 'intruder'}
+    vdf = VideosetDataFrame(metadata, animal_renamer = animal_renamer)
+    new_cols = vdf.add_features(speed_feature_maker, featureset_name = 'speeds')
+    features = vdf.data[new_cols].copy()
+    capsys.readouterr()
+
+    filtered = interpolate_lowconf_points(vdf, in_place = False)
+    assert list(filtered.columns) == vdf.raw_track_columns + ['filename', 'frame']
+    interpolate_lowconf_points(vdf)
+    assert capsys.readouterr().out == ''
+    pd.testing.assert_frame_equal(vdf.data[vdf.raw_track_columns], filtered[vdf.raw_track_columns])
+    #Only the tracks are interpolated
+    pd.testing.assert_frame_equal(vdf.data[new_cols], features)
@@ -85,4 +85,122 @@ def test_sample_threemouse_data():
     vdf = VideosetDataFrame(metadata)
 
     assert vdf.animals == ['ind1', 'ind2', 'ind3']
-    assert len(vdf.data.columns) == 39
\ No newline at end of file
+    assert len(vdf.data.columns) == 39
+
+def test_read_DLC_tracks_float32():
+    import os
+    import numpy as np
+    from behaveml import read_DLC_tracks
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    fn = os.path.join(cur_dir, '..', 'behaveml', 'data', 'dlc', 'openfield', 'openfield_dlc_inference_example_three.csv')
+    df, body_parts, animals, colnames, scorer = read_DLC_tracks(fn)
+    df32, _, _, _, _ = read_DLC_tracks(fn, dtype = np.float32)
+
+    assert animals == ['ind1', 'ind2', 'ind3']
+    assert all(df32[colnames].dtypes == np.float32)
+    assert np.allclose(df[colnames], df32[colnames])
+
+def test_read_DLC_tracks_h5(tmp_path_factory):
+    pytest.importorskip('tables')
+    import os
+    import pandas as pd
+    from glob import glob
+    from behaveml import read_DLC_tracks, VideosetDataFrame, clone_metadata
+    from behaveml.video import get_sample_openfield_data
+
+    vdf = get_sample_openfield_data()
+    base_dir = tmp_path_factory.mktemp('dlc_h5')
+    vdf.to_dlc_csv(base_dir, save_h5_too = True)
+    fn_csv = glob(os.path.join(base_dir, '*.csv'))[0]
+    fn_h5 = glob(os.path.join(base_dir, '*.h5'))[0]
+
+    df_csv, body_parts_csv, animals_csv, colnames_csv, scorer_csv = read_DLC_tracks(fn_csv)
+    df_h5, body_parts_h5, animals_h5, colnames_h5, scorer_h5 = read_DLC_tracks(fn_h5)
+    assert colnames_h5 == colnames_csv
+    assert animals_h5 == animals_csv
+    assert scorer_h5 == scorer_csv
+    pd.testing.assert_frame_equal(df_csv.drop(columns = 'filename'), df_h5.drop(columns = 'filename'))
+
+    vdf_h5 = VideosetDataFrame(clone_metadata([fn_h5], fps = 30))
+    assert vdf_h5.raw_track_columns == vdf.raw_track_columns
+    assert len(vdf_h5.data) == len(vdf.data)
+
+def test_read_boris_annotation(label_files):
+    import numpy as np
+    from behaveml.io import read_boris_annotation, read_boris_events
+
+    fn = label_files[0]
+    events = read_boris_events(fn)
+    fps = 30
+    duration = events['Total length'][0]
+    ground_truth, behav_labels = read_boris_annotation(fn, fps, duration)
+
+    #Compare to painting the intervals one at a time
+    expected = np.zeros(int(duration*fps))
+    for behav_idx, behavior in behav_labels.items():
+        labels = events[events['Behavior'] == behavior]
+        starts = labels.loc[labels['Status'] == 'START', 'Time']
+        ends = labels.loc[labels['Status'] == 'STOP', 'Time']
+        for start, end in zip(starts, ends):
+            expected[int(start*fps):int(end*fps)] = behav_idx
+
+    assert ground_truth.sum() > 0
+    assert np.array_equal(ground_truth, expected)
+
+    ground_truth_cached, _ = read_boris_annotation(fn, fps, duration, behav_labels, events = events)
+    assert np.array_equal(ground_truth, ground_truth_cached)
+
+def test_iter_DLC_tracks():
+    import os
+    import pandas as pd
+    from behaveml import read_DLC_tracks
+    from behaveml.io import iter_DLC_tracks
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    fn = os.path.join(cur_dir, '..', 'behaveml', 'data', 'dlc', 'openfield', 'openfield_dlc_inference_example_three.csv')
+    animal_renamer = {'ind1': 'mouse1'}
+    df, _, _, _, _ = read_DLC_tracks(fn, animal_renamer = animal_renamer)
+    chunks = list(iter_DLC_tracks(fn, chunk_size = 1000, animal_renamer = animal_renamer))
+
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert len(chunks) == -(-len(df) // 1000)
+    pd.testing.assert_frame_equal(pd.concat(chunks, axis = 0), df)
+
+def test_csv_engine_fallback(monkeypatch):
+    import os
+    import numpy as np
+    from behaveml import io
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    fn = os.path.join(cur_dir, '..', 'behaveml', 'data', 'dlc', 'openfield', 'openfield_dlc_inference_example_three.csv')
+    expected = io._read_dlc_csv(fn)[0]
+    #pandas < 1.4 raises a ValueError for the pyarrow engine
+    read_csv = io.pd.read_csv
+    def old_read_csv(*args, engine = 'c', **kwargs):
+        if engine == 'pyarrow':
+            raise ValueError("The 'engine' argument must be one of 'c' or 'python'")
+        return read_csv(*args, engine = engine, **kwargs)
+    monkeypatch.setattr(io, '_CSV_ENGINE', 'pyarrow')
+    monkeypatch.setattr(io.pd, 'read_csv', old_read_csv)
+    np.testing.assert_allclose(io._read_dlc_csv(fn)[0], expected)
+
+def test_read_DLC_tracks_string_index(tmp_path_factory):
+    import os
+    import numpy as np
+    from behaveml import io
+
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    fn = os.path.join(cur_dir, '..', 'behaveml', 'data', 'dlc', 'openfield', 'openfield_dlc_inference_example_three.csv')
+    expected = io._read_dlc_csv(fn)[0]
+    #Labelled-frame exports are indexed by image path
+    with open(fn) as file:
+        lines = file.read().splitlines()
+    n_header_rows = len(io._sniff_dlc_header(fn))
+    lines = lines[:n_header_rows] + [f'labeled-data/video/img{idx:05d}.png' + line[line.index(','):] 
+                                     for idx, line in enumerate(lines[n_header_rows:])]
+    fn_out = os.path.join(str(tmp_path_factory.mktemp('dlc')), 'labeled.csv')
+    with open(fn_out, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    np.testing.assert_allclose(io._read_dlc_csv(fn_out)[0], expected)
+
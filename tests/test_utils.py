@@ -6,4 +6,49 @@ import pytest
 
 def test_ffmpeg():
     from behaveml.utils import checkFFMPEG
-    assert type(checkFFMPEG()) is bool
\ No newline at end of file
+    assert type(checkFFMPEG()) is bool
+
+def test_within_segments():
+    import numpy as np
+    import pandas as pd
+    from behaveml.utils import segment_offsets, shift_within_segments, diff_within_segments, \
+                               rolling_mean_within_segments
+    groups = np.repeat(['a', 'b', 'c'], [7, 2, 11])
+    data = np.random.default_rng(0).normal(size = (20, 3))
+    data[3,1] = np.nan
+    df = pd.DataFrame(data)
+    df['filename'] = groups
+    grouped = df.groupby('filename')[[0, 1, 2]]
+
+    offsets = segment_offsets(groups)
+    assert list(offsets) == [0, 7, 9, 20]
+    for p in [-3, -1, 1, 5]:
+        np.testing.assert_allclose(shift_within_segments(data, p, offsets), grouped.shift(p))
+        np.testing.assert_allclose(diff_within_segments(data, p, offsets), grouped.diff(p))
+    np.testing.assert_allclose(rolling_mean_within_segments(data, 3, offsets), 
+                               grouped.rolling(3, min_periods = 1).mean())
+    #Windows longer than a segment
+    np.testing.assert_allclose(rolling_mean_within_segments(data, 8, offsets, min_periods = 3), 
+                               grouped.rolling(8, min_periods = 3).mean())
+
+def test_window_stats_within_segments():
+    import numpy as np
+    from behaveml.utils import segment_offsets, shift_within_segments, window_stats_within_segments
+    groups = np.repeat(['a', 'b', 'c'], [30, 4, 41])
+    data = np.random.default_rng(0).normal(size = (75, 3))*10 + 100
+    data[40,1] = np.nan
+    offsets = segment_offsets(groups)
+
+    stats = window_stats_within_segments(data, [1, 5, 10], offsets)
+    for ws in [1, 5, 10]:
+        stacked = np.dstack([shift_within_segments(data, p, offsets) for p in range(-ws, ws+1)])
+        expected = [np.min(stacked, axis = 2), np.max(stacked, axis = 2), 
+                    np.std(stacked, axis = 2), np.mean(stacked, axis = 2)]
+        for result, exp in zip(stats[ws], expected):
+            np.testing.assert_allclose(result, exp)
+
+def test_parallel_imap():
+    import math
+    from behaveml.utils import parallel_imap
+    results = parallel_imap(math.sqrt, (i**2 for i in range(10)), n_jobs = 3)
+    assert list(results) == list(range(10))